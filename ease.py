@@ -1,5 +1,9 @@
 """イージング
 よく使うもののみ
+
+*_fx は整数のみで計算する版（小数を使わない）.
+引数と戻り値は整数. 値は元の関数を int() したものと同じ（elastic は誤差 1 程度）.
+elastic は正規化した曲線の表（読み込み時に作成）を補間する.
 """
 __author__ = "Choi Gyun 2022"
 
@@ -123,3 +127,113 @@ def inout_elastic(current, start, delta, total):
 
     current -= 1
     return a * math.pow(2, -10 * current) * math.sin((current * total - s) * (2 * math.pi) / p) * 0.5 + delta + start
+
+
+# 整数版
+
+_FX_BITS = 14
+_FX_ONE = 1 << _FX_BITS
+# elastic の表の分割数 2**_FX_SEG_BITS
+_FX_SEG_BITS = 7
+
+
+def _div(a, b):
+    """a / b の 0 方向への切り捨て（int() と同じ） b は正"""
+    if a >= 0:
+        return a // b
+    return -(-a // b)
+
+
+def _curve(f):
+    """正規化した曲線 f(0..1) の表（_FX_ONE 倍）"""
+    n = 1 << _FX_SEG_BITS
+    return [int(f(i / n) * _FX_ONE) for i in range(n + 1)]
+
+
+def _lookup(table, current, start, delta, total):
+    """表を補間して値を求める"""
+    if current <= 0:
+        return start
+    if current >= total:
+        return start + delta
+    x = (current << 16) // total
+    i = x >> (16 - _FX_SEG_BITS)
+    f = x & ((1 << (16 - _FX_SEG_BITS)) - 1)
+    v = table[i] + ((table[i + 1] - table[i]) * f >> (16 - _FX_SEG_BITS))
+    return _div(start * _FX_ONE + delta * v, _FX_ONE)
+
+
+def _out_elastic_curve(u):
+    return math.pow(2, -10 * u) * math.sin((u - 0.075) * (2 * math.pi) / 0.3) + 1
+
+
+def _in_elastic_curve(u):
+    u -= 1
+    return -(math.pow(2, 10 * u) * math.sin((u - 0.075) * (2 * math.pi) / 0.3))
+
+
+def _inout_elastic_curve(u):
+    u = u * 2 - 1
+    w = math.sin((u - 0.1125) * (2 * math.pi) / 0.45)
+    if u < 0:
+        return -0.5 * math.pow(2, 10 * u) * w
+    return math.pow(2, -10 * u) * w * 0.5 + 1
+
+
+_OUT_ELASTIC = _curve(_out_elastic_curve)
+_IN_ELASTIC = _curve(_in_elastic_curve)
+_INOUT_ELASTIC = _curve(_inout_elastic_curve)
+
+
+def linear_fx(current, start, delta, total):
+    return _div(start * total + delta * current, total)
+
+
+def in_quad_fx(current, start, delta, total):
+    d = total * total
+    return _div(start * d + delta * current * current, d)
+
+
+def out_quad_fx(current, start, delta, total):
+    d = total * total
+    return _div(start * d + delta * current * (2 * total - current), d)
+
+
+def inout_quad_fx(current, start, delta, total):
+    # inout_quad と同じ（後半も前半の式）
+    d = 2 * total * total
+    return _div(start * d + delta * current * current, d)
+
+
+def in_quart_fx(current, start, delta, total):
+    c2 = current * current
+    d = total * total * total * total
+    return _div(start * d + delta * c2 * c2, d)
+
+
+def out_quart_fx(current, start, delta, total):
+    r2 = (total - current) * (total - current)
+    d = total * total * total * total
+    return _div(start * d + delta * (d - r2 * r2), d)
+
+
+def inout_quart_fx(current, start, delta, total):
+    d = total * total * total * total
+    if current * 2 < total:
+        c2 = current * current
+        return _div(start * d + delta * 8 * c2 * c2, d)
+    r2 = (total - current) * (total - current)
+    return _div(start * d + delta * (d - 8 * r2 * r2), d)
+
+
+def in_elastic_fx(current, start, delta, total):
+    # 周期は total * 0.3（in_elastic は current * 0.3 なので値が違う）
+    return _lookup(_IN_ELASTIC, current, start, delta, total)
+
+
+def out_elastic_fx(current, start, delta, total):
+    return _lookup(_OUT_ELASTIC, current, start, delta, total)
+
+
+def inout_elastic_fx(current, start, delta, total):
+    return _lookup(_INOUT_ELASTIC, current, start, delta, total)
@@ -0,0 +1,582 @@
+"""picogamelib のベンチマーク（PC で実行）
+
+host/run.py と同じ代用モジュールを使ってスプライト処理の時間とメモリを測る.
+時間は CPython での値なので実機との比較ではなく変更前後の比較に使う.
+メモリは tracemalloc で測った CPython のヒープ.
+
+使い方:
+    python3 host/bench.py sprites [--count 120] [--frames 300] [--no-draw]
+    python3 host/bench.py churn [--count 1000] [--base 1000] [--frames 30] [--batch]
+    python3 host/bench.py collision [--count 120] [--frames 300]
+    python3 host/bench.py anime [--count 120] [--frames 300]
+    python3 host/bench.py tween [--count 120] [--frames 300]
+    python3 host/bench.py pipeline [--count 120] [--frames 300] [--byte-ns 128]
+    python3 host/bench.py events [--count 100] [--frames 600]
+    python3 host/bench.py field [--frames 300] [--no-dirty] [--no-draw]
+    python3 host/bench.py boot [--no-assets]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import run  # noqa: E402
+
+
+def setup():
+    """picogamelib を import してダミーの画像を用意
+
+    Returns:
+        (module): picogamelib
+    """
+    run.setup_path()
+    import framebuf
+    import picogamelib as gl
+
+    if not gl.image_buffers:
+        for i in range(8):
+            b = framebuf.FrameBuffer(bytearray(8 * 8 * 2), 8, 8, framebuf.RGB565)
+            b.fill(0x1111 * (i + 1))
+            gl.image_buffers.append(b)
+    return gl
+
+
+def build_stage(gl, count, groups=10):
+    """コンテナの下にスプライトを並べたステージを作成
+
+    Params:
+        gl (module): picogamelib
+        count (int): 描画するスプライトの数
+        groups (int): コンテナの数
+
+    Returns:
+        (Stage, list): ステージ, 描画するスプライトのリスト
+    """
+    stage = gl.Stage(None, gl.EventManager(), "stage", 0, 0, 0, 240, 135, True)
+    containers = []
+    for g in range(groups):
+        c = gl.SpriteContainer()
+        c.init_params(stage, "group", (g % 5) * 48, (g // 5) * 64, g)
+        containers.append(c)
+    sprites = []
+    for i in range(count):
+        x = (i // groups) % 6 * 8
+        y = i // 60 * 8
+        sp = gl.Sprite().init_params(
+            containers[i % groups], i % 4 * 2, "sp", x, y, i, 8, 8
+        )
+        sp.init_frame_param(2, 3)  # 2 枚のフレームアニメ
+        sprites.append(sp)
+    stage.enter()
+    return stage, sprites
+
+
+def bench_sprites(count, frames, draw=True):
+    """スプライトの多いステージのメモリとフレーム時間
+
+    Params:
+        count (int): スプライトの数
+        frames (int): 計測するフレーム数
+        draw (bool): False の時はバッファに描画しない（スプライトの処理のみ測る）
+    """
+    gl = setup()
+    if not draw:
+        gl.Sprite.draw = lambda self, frame_buffer, x, y: None
+        gl.lcd.fill_rect = lambda x, y, w, h, c: None
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    stage, sprites = build_stage(gl, count)
+    mem = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    # 半分のスプライトを動かす
+    t_action = 0
+    t_show = 0
+    for f in range(frames):
+        for i in range(0, count, 2):
+            sp = sprites[i]
+            sp.x = (sp.x + 1) % 48
+        t = time.perf_counter()
+        stage.action()
+        t_action += time.perf_counter() - t
+        t = time.perf_counter()
+        stage.show()
+        t_show += time.perf_counter() - t
+
+    print(
+        "sprites %d  memory %d bytes (%d bytes/sprite)" % (count, mem, mem // count)
+    )
+    print(
+        "action %.3f ms  show %.3f ms  per frame"
+        % (t_action * 1000 / frames, t_show * 1000 / frames)
+    )
+
+
+def bench_churn(count, base, frames, batch=False):
+    """スプライトの追加・削除 毎フレーム count 個を追加して削除する
+
+    Params:
+        count (int): 1 フレームで追加・削除するスプライトの数
+        base (int): 常にあるスプライトの数
+        frames (int): 計測するフレーム数
+        batch (bool): Stage.batch で追加・削除をまとめる
+    """
+    gl = setup()
+    stage = gl.Stage(None, gl.EventManager(), "stage", 0, 0, 0, 240, 135, True)
+    stage.batch = batch
+    layer = gl.SpriteContainer()
+    layer.init_params(stage, "layer", 0, 0, 0)
+    rnd = gl.Random(1)
+    for i in range(base):
+        gl.Sprite().init_params(layer, 0, "base", 0, 0, rnd.randint(0, 99), 8, 8)
+    churn = [gl.Sprite() for _ in range(count)]
+    z = [rnd.randint(0, 99) for _ in range(count)]
+
+    t = time.perf_counter()
+    for f in range(frames):
+        for i in range(count):
+            churn[i].init_params(layer, 0, "churn", 0, 0, z[i], 8, 8)
+        stage.commit()
+        for sp in churn:
+            layer.remove_sprite(sp)
+        stage.commit()
+    elapsed = time.perf_counter() - t
+
+    print(
+        "churn %d  base %d  batch %s  frame %.2f ms  %.2f us/op"
+        % (
+            count,
+            base,
+            batch,
+            elapsed * 1000 / frames,
+            elapsed * 1000000 / (frames * count * 2),
+        )
+    )
+
+
+def bench_collision(count, frames):
+    """当たり判定 Collision と全ての組の hit_test の比較
+
+    Params:
+        count (int): スプライトの数
+        frames (int): 計測するフレーム数
+    """
+    gl = setup()
+    stage, sprites = build_stage(gl, count)
+    col = gl.Collision(stage)
+    col.check(0, 1)
+    for i in range(count):
+        sprites[i].w = 20
+        sprites[i].h = 20
+        col.add(sprites[i], i & 1)
+    stage.collision = col
+
+    t = time.perf_counter()
+    for f in range(frames):
+        col.update()
+        stage.event.clear_queue()
+    t_grid = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for f in range(frames // 10 or 1):
+        for i in range(0, count, 2):
+            for j in range(1, count, 2):
+                sprites[i].hit_test(sprites[j])
+    t_pairs = time.perf_counter() - t
+
+    print(
+        "collision %d  grid %.3f ms  hit_test all pairs %.3f ms  per frame"
+        % (count, t_grid * 1000 / frames, t_pairs * 1000 / (frames // 10 or 1))
+    )
+
+
+def bench_anime(count, frames):
+    """アニメーションの値 表（Anime）と毎フレームのイージング関数の呼び出しの比較
+
+    Params:
+        count (int): アニメーションの数
+        frames (int): 計測するフレーム数
+    """
+    gl = setup()
+    import ease
+
+    animes = []
+    for i in range(count):
+        a = gl.Anime("bench", gl.EventManager(), ease.out_elastic)
+        a.start = i % 6 * 22
+        a.delta = 22 if i & 1 else -22
+        a.total_frame = 6
+        animes.append(a)
+
+    def call(anime):
+        anime.current_frame += 1
+        if anime.current_frame <= anime.total_frame:
+            anime.value = anime.func(
+                anime.current_frame, anime.start, anime.delta, anime.total_frame
+            )
+        else:
+            anime.stop()
+
+    results = []
+    for step in (lambda a: a.ev_anime_enter_frame(None, None, None), call):
+        t = time.perf_counter()
+        for f in range(frames):
+            for a in animes:
+                if not a.is_playing:
+                    a.play()
+                step(a)
+        results.append(time.perf_counter() - t)
+        for a in animes:
+            a.stop()
+            a.event.clear_queue()
+
+    print(
+        "anime %d  table %.3f ms  ease call %.3f ms  per frame"
+        % (count, results[0] * 1000 / frames, results[1] * 1000 / frames)
+    )
+
+
+def bench_tween(count, frames):
+    """イベントで動かす Anime と TweenManager の比較
+    毎フレーム 1 割を開始する（止まっているものも含めて比べる）.
+
+    Params:
+        count (int): アニメーションの数
+        frames (int): 計測するフレーム数
+    """
+    gl = setup()
+    import ease
+
+    class Target:
+        y = 0
+
+    event = gl.EventManager()
+    event.add_frame_event([gl.EV_ANIME_ENTER_FRAME, gl.EV_PRIORITY_MID, 0, None, None])
+    animes = []
+    for i in range(count):
+        a = gl.Anime("bench", event, ease.out_elastic)
+        a.attach()
+        a.delta = 22
+        a.total_frame = 6
+        animes.append(a)
+    tweens = gl.TweenManager()
+    targets = [Target() for _ in range(count)]
+    tws = [gl.Tween(targets[i], "y", ease.out_elastic) for i in range(count)]
+    for tw in tws:
+        tw.delta = 22
+        tw.total_frame = 6
+
+    t = time.perf_counter()
+    for f in range(frames):
+        for i in range(f % 10, count, 10):
+            a = animes[i]
+            if not a.is_playing:
+                a.play()
+            targets[i].y = a.value
+        event.post_frame_events()
+        event.fire()
+    t_anime = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for f in range(frames):
+        for i in range(f % 10, count, 10):
+            if not tws[i].is_playing:
+                tweens.play(tws[i])
+        tweens.update()
+    t_tween = time.perf_counter() - t
+
+    print(
+        "tween %d  Anime (event) %.3f ms  TweenManager %.3f ms  per frame"
+        % (count, t_anime * 1000 / frames, t_tween * 1000 / frames)
+    )
+
+
+def bench_pipeline(count, frames, byte_ns):
+    """CORE1 の転送パイプライン（LCDPipeline）で描画と転送が重なるか
+    SPI の代用に 1 バイト byte_ns の転送時間を与えて, 全画面のフレームを
+    描画のみ, 転送のみ, 描画して同期転送, 描画してパイプラインで転送 の 4 通りで測る.
+    重なり = (描画 + 転送 - パイプライン) / min(描画, 転送) 100% で完全に重なる.
+
+    Params:
+        count (int): スプライトの数
+        frames (int): 計測するフレーム数
+        byte_ns (int): SPI 1 バイトの転送時間（ns） 128 は 62.5MHz 相当
+    """
+    gl = setup()
+    import machine
+
+    stage, sprites = build_stage(gl, count)
+    stage.dirty_rect = False  # 毎フレーム全画面
+    lcd = gl.lcd
+    pipe = gl.LCDPipeline(lcd)
+    pipe.start()
+    machine.SPI.byte_ns = byte_ns
+    # 転送が終わったスレッドがすぐに GIL を取れるように（CPython のみの事情）
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(0.0002)
+
+    def draw():
+        for i in range(0, count, 2):
+            sp = sprites[i]
+            sp.x = (sp.x + 1) % 48
+        stage.action()
+        stage.show()
+
+    def timed(step):
+        t = time.perf_counter()
+        for f in range(frames):
+            step()
+        return (time.perf_counter() - t) * 1000 / frames
+
+    t_draw = timed(draw)
+    t_spi = timed(lcd.show)
+    t_sync = timed(lambda: (draw(), lcd.show()))
+    t_pipe = timed(lambda: (draw(), pipe.swap()))
+    # 最後のフレームの転送を待つ
+    pipe.done.acquire()
+    pipe.done.release()
+    machine.SPI.byte_ns = 0
+    sys.setswitchinterval(interval)
+
+    overlap = (t_draw + t_spi - t_pipe) / min(t_draw, t_spi)
+    print(
+        "pipeline %d  draw %.2f ms  spi %.2f ms  sync %.2f ms  pipeline %.2f ms"
+        "  overlap %.0f%%" % (count, t_draw, t_spi, t_sync, t_pipe, overlap * 100)
+    )
+
+
+def bench_events(count, frames):
+    """遅延イベントのポストと処理
+    毎フレーム count 個のイベントを 0〜299 フレームの遅延でポストして fire() する.
+    待っているイベントは平均 count * 150 個になる.
+
+    Params:
+        count (int): 1 フレームでポストするイベントの数
+        frames (int): 計測するフレーム数
+    """
+    gl = setup()
+
+    class Listner:
+        fired = 0
+
+        def ev_bench(self, type, sender, option):
+            self.fired += 1
+
+    event = gl.EventManager()
+    listner = Listner()
+    event.add_listner(["ev_bench", listner, True])
+    prio = (gl.EV_PRIORITY_HI, gl.EV_PRIORITY_MID, gl.EV_PRIORITY_LOW)
+    rnd = random.Random(1)
+    posts = [
+        (prio[rnd.randrange(3)], rnd.randrange(300)) for _ in range(count * frames)
+    ]
+
+    t_post = 0
+    t_fire = 0
+    i = 0
+    for f in range(frames):
+        t = time.perf_counter()
+        for _ in range(count):
+            p, d = posts[i]
+            event.post(["ev_bench", p, d, None, None])
+            i += 1
+        t_post += time.perf_counter() - t
+        t = time.perf_counter()
+        event.fire()
+        t_fire += time.perf_counter() - t
+
+    print(
+        "events %d/frame  fired %d  post %.3f ms  fire %.3f ms  per frame"
+        % (count, listner.fired, t_post * 1000 / frames, t_fire * 1000 / frames)
+    )
+
+
+def bench_field(frames, dirty=True, draw=True):
+    """パネルのフィールド TileLayer と 1 パネル 1 スプライト（変更前）の比較
+    main.py と同じ 12x6 のフィールドを埋めて, 3 フレーム毎に 1 ドット横にスクロールする.
+    変更前はパネル毎のスプライトの x を書き換えていた.
+
+    Params:
+        frames (int): 計測するフレーム数
+        dirty (bool): 差分描画
+        draw (bool): False の時は blit しない（スプライトの処理のみ測る）
+    """
+    gl = setup()
+    import framebuf
+
+    if not draw:
+        framebuf.FrameBuffer.blit = lambda self, fb, x, y, key=-1, palette=None: None
+
+    cols, rows, cw, ch, size = 12, 6, 20, 22, 20
+    tile = len(gl.image_buffers)
+    for i in range(4):
+        b = framebuf.FrameBuffer(bytearray(size * size * 2), size, size, 1)
+        b.fill(0x2222 * (i + 1))
+        gl.image_buffers.append(b)
+
+    def new_stage():
+        return gl.Stage(
+            None, gl.EventManager(), "stage", 0, 0, 0, 240, 135, dirty
+        )
+
+    # 変更前 パネル毎のスプライト
+    stage = new_stage()
+    panels = []
+    for c in range(cols):
+        for r in range(rows):
+            sp = gl.Sprite().init_params(
+                stage, tile + (c + r) % 4, "panel", c * cw, r * ch, 10, size, size
+            )
+            panels.append(sp)
+    stage.enter()
+    t = time.perf_counter()
+    for f in range(frames):
+        offset = f // 3 % cw
+        i = 0
+        for c in range(cols):
+            x = c * cw + offset
+            for r in range(rows):
+                panels[i].x = x
+                i += 1
+        stage.action()
+        stage.show()
+    t_panel = time.perf_counter() - t
+
+    # TileLayer
+    stage = new_stage()
+    layer = gl.TileLayer(stage, "panel", 0, 0, 10, cols, rows, cw, ch, size, size)
+    for c in range(cols):
+        for r in range(rows):
+            layer.set_tile(c, r, tile + (c + r) % 4)
+    stage.enter()
+    t = time.perf_counter()
+    for f in range(frames):
+        layer.scroll_x = f // 3 % cw
+        stage.action()
+        stage.show()
+    t_layer = time.perf_counter() - t
+
+    print(
+        "field %dx%d  dirty %s  draw %s  panel sprites %.3f ms  TileLayer %.3f ms"
+        "  per frame"
+        % (
+            cols,
+            rows,
+            dirty,
+            draw,
+            t_panel * 1000 / frames,
+            t_layer * 1000 / frames,
+        )
+    )
+
+
+def bench_boot(assets=True):
+    """起動（main.py の実行から Director.play まで）の時間とメモリ
+    assets.bin ありは tools/assetc.py で作成したファイルを読み込み,
+    なしは gamedata.py を import して展開する.
+    1 回の実行でどちらか一方を測る（import したモジュールが残るため）.
+    CORE1 の転送スレッドは起動しない.
+
+    Params:
+        assets (bool): assets.bin を使う
+    """
+    gl = setup()
+    del gl.image_buffers[:]  # setup() のダミー画像
+    os.chdir(tempfile.mkdtemp(prefix="picogame-"))
+    if assets:
+        sys.path.insert(0, os.path.join(run.ROOT_DIR, "tools"))
+        import assetc
+
+        with open("assets.bin", "wb") as f:
+            f.write(assetc.build(run.ROOT_DIR)[0])
+
+    def play(director):
+        raise run.Stop()
+
+    gl.Director.play = play
+    gl.start_pipeline = lambda: None
+    path = os.path.join(run.ROOT_DIR, "main.py")
+    code = compile(open(path, encoding="utf-8").read(), path, "exec")
+    game = {"__name__": "__main__", "__file__": path}
+
+    gc.collect()
+    tracemalloc.start()
+    t = time.perf_counter()
+    try:
+        exec(code, game)
+    except run.Stop:
+        pass
+    elapsed = time.perf_counter() - t
+    gc.collect()
+    mem, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        "boot  assets %s  %.1f ms  heap %d bytes  peak %d bytes  images %d"
+        % (assets, elapsed * 1000, mem, peak, len(gl.image_buffers))
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="picogamelib のベンチマーク")
+    parser.add_argument(
+        "bench",
+        choices=[
+            "sprites",
+            "churn",
+            "collision",
+            "anime",
+            "tween",
+            "pipeline",
+            "events",
+            "field",
+            "boot",
+        ],
+        help="ベンチマーク",
+    )
+    parser.add_argument("--count", type=int, default=None, help="スプライトの数")
+    parser.add_argument("--base", type=int, default=1000, help="churn: 常にある数")
+    parser.add_argument("--frames", type=int, default=None, help="フレーム数")
+    parser.add_argument("--no-draw", action="store_true", help="描画しない")
+    parser.add_argument(
+        "--no-dirty", action="store_true", help="field: 毎フレーム全画面を描画"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="churn: まとめて追加・削除"
+    )
+    parser.add_argument(
+        "--no-assets", action="store_true", help="boot: gamedata.py から展開"
+    )
+    parser.add_argument(
+        "--byte-ns", type=int, default=128, help="pipeline: SPI 1 バイトの時間"
+    )
+    args = parser.parse_args(argv)
+
+    if args.bench == "sprites":
+        bench_sprites(args.count or 120, args.frames or 300, not args.no_draw)
+    elif args.bench == "churn":
+        bench_churn(args.count or 1000, args.base, args.frames or 30, args.batch)
+    elif args.bench == "collision":
+        bench_collision(args.count or 120, args.frames or 300)
+    elif args.bench == "anime":
+        bench_anime(args.count or 120, args.frames or 300)
+    elif args.bench == "tween":
+        bench_tween(args.count or 120, args.frames or 300)
+    elif args.bench == "pipeline":
+        bench_pipeline(args.count or 120, args.frames or 300, args.byte_ns)
+    elif args.bench == "events":
+        bench_events(args.count or 100, args.frames or 600)
+    elif args.bench == "field":
+        bench_field(args.frames or 300, not args.no_dirty, not args.no_draw)
+    elif args.bench == "boot":
+        bench_boot(not args.no_assets)
+
+
+if __name__ == "__main__":
+    main()
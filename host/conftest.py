@@ -0,0 +1,8 @@
+"""host/ のテストの設定
+
+python3 -m pytest host で実行する.
+代用モジュール（machine, framebuf, micropython, utime）を import できるようにする.
+"""
+import run
+
+run.setup_path()
@@ -0,0 +1,91 @@
+"""framebuf モジュールの代用（PC 実行用）
+
+RGB565 のみ対応. 色はリトルエンディアンで格納.
+"""
+RGB565 = 1
+
+
+class FrameBuffer:
+    def __init__(self, buf, width, height, format, stride=None):
+        self._buf = buf
+        self._w = width
+        self._h = height
+
+    def fill(self, c):
+        self._buf[:] = bytes((c & 0xFF, (c >> 8) & 0xFF)) * (self._w * self._h)
+
+    def fill_rect(self, x, y, w, h, c):
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self._w)
+        y1 = min(y + h, self._h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        row = bytes((c & 0xFF, (c >> 8) & 0xFF)) * (x1 - x0)
+        for yy in range(y0, y1):
+            p = (yy * self._w + x0) * 2
+            self._buf[p : p + len(row)] = row
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self._w and 0 <= y < self._h):
+            return None
+        p = (y * self._w + x) * 2
+        if c is None:
+            return self._buf[p] | (self._buf[p + 1] << 8)
+        self._buf[p] = c & 0xFF
+        self._buf[p + 1] = (c >> 8) & 0xFF
+        return None
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        e = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * e
+            if e2 >= dy:
+                e += dy
+                x1 += sx
+            if e2 <= dx:
+                e += dx
+                y1 += sy
+
+    def blit(self, fb, x, y, key=-1, palette=None):
+        src = fb._buf
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + fb._w, self._w)
+        y1 = min(y + fb._h, self._h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        for dy in range(y0, y1):
+            s = ((dy - y) * fb._w + x0 - x) * 2
+            d = (dy * self._w + x0) * 2
+            if key == -1:
+                self._buf[d : d + (x1 - x0) * 2] = src[s : s + (x1 - x0) * 2]
+                continue
+            for _ in range(x0, x1):
+                if (src[s] | (src[s + 1] << 8)) != key:
+                    self._buf[d] = src[s]
+                    self._buf[d + 1] = src[s + 1]
+                s += 2
+                d += 2
@@ -0,0 +1,166 @@
+"""machine モジュールの代用（PC 実行用）
+
+Pin: 入力は script で指定した時間だけ LOW（押下）になる.
+     irq() で登録した関数は仮想時計が script の開始・終了を過ぎた時に呼ぶ.
+SPI: 送信したバイト数を数える. log を bytearray にすると内容も記録.
+     byte_ns を設定すると送信に実際の時間がかかる（呼んだスレッドだけ止まる）.
+PWM: 何もしない.
+mem32: SIO の GPIO_IN のみ読める（Pin と同じ入力）.
+"""
+import time
+
+import utime
+
+_SIO_GPIO_IN = 0xD0000004
+_GPIO_COUNT = 30
+
+
+class Pin:
+    """GPIO
+
+    Attributes:
+        script (list): 入力スクリプト (開始ms, 終了ms, ピン番号) のリスト
+        levels (dict): 出力ピンの状態
+    """
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    script = []
+    levels = {}
+    irqs = {}
+
+    def __init__(self, id, mode=-1, pull=-1):
+        self.id = id
+
+    def value(self, v=None):
+        if v is not None:
+            Pin.levels[self.id] = v
+            return None
+        return Pin.level(self.id, utime.now_ms())
+
+    @staticmethod
+    def level(id, t):
+        """ピンの状態
+
+        Params:
+            id (int): ピン番号
+            t (int): 時刻（ms）
+
+        Returns:
+            (int): 0 または 1
+        """
+        if id in Pin.levels:
+            return Pin.levels[id]
+        for start, end, pin in Pin.script:
+            if pin == id and start <= t < end:
+                return 0
+        return 1
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        Pin.irqs[self.id] = (self, handler, trigger)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+def _edges(prev_us, now_us):
+    """仮想時計が進んだ間の script の変化で割り込みを呼ぶ
+    割り込みの中では時計は変化した時刻になる.
+    """
+    if not Pin.irqs:
+        return
+    t0 = prev_us // 1000
+    t1 = now_us // 1000
+    if t0 == t1:
+        return
+    edges = []
+    for start, end, id in Pin.script:
+        irq = Pin.irqs.get(id)
+        if irq is None:
+            continue
+        if t0 < start <= t1 and irq[2] & Pin.IRQ_FALLING:
+            edges.append((start, id))
+        if t0 < end <= t1 and irq[2] & Pin.IRQ_RISING:
+            edges.append((end, id))
+    for t, id in sorted(edges):
+        utime.now_us = t * 1000
+        pin, handler, trigger = Pin.irqs[id]
+        handler(pin)
+    utime.now_us = now_us
+
+
+utime.hooks.append(_edges)
+
+
+class _Mem32:
+    """mem32 の代用 GPIO_IN のみ"""
+
+    def __getitem__(self, addr):
+        if addr != _SIO_GPIO_IN:
+            return 0
+        t = utime.now_ms()
+        v = (1 << _GPIO_COUNT) - 1  # プルアップ
+        for start, end, id in Pin.script:
+            if start <= t < end:
+                v &= ~(1 << id)
+        for id, level in Pin.levels.items():
+            if id < _GPIO_COUNT and not level:
+                v &= ~(1 << id)
+        return v
+
+    def __setitem__(self, addr, value):
+        pass
+
+
+mem32 = _Mem32()
+
+
+class SPI:
+    """SPI 送信を記録
+
+    Attributes:
+        total (int): 送信したバイト数の合計
+        log (bytearray): 送信データ None の時は記録しない
+        byte_ns (int): 1 バイトの送信時間（ns） 0 は待たない
+        busy_s (float): 送信で待った時間の合計（秒）
+    """
+
+    total = 0
+    log = None
+    byte_ns = 0
+    busy_s = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def write(self, buf):
+        SPI.total += len(buf)
+        if SPI.log is not None:
+            SPI.log += bytes(buf)
+        if SPI.byte_ns:
+            # 実際の転送と同じく送信中は呼んだスレッドが止まる（GIL は離す）
+            t = time.perf_counter()
+            time.sleep(len(buf) * SPI.byte_ns / 1e9)
+            SPI.busy_s += time.perf_counter() - t
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+
+    def freq(self, f):
+        pass
+
+    def duty_u16(self, v):
+        pass
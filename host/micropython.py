@@ -0,0 +1,20 @@
+"""micropython モジュールの代用（PC 実行用）
+
+コード生成のデコレータは何もしない.
+"""
+
+
+def const(v):
+    return v
+
+
+def native(f):
+    return f
+
+
+def viper(f):
+    return f
+
+
+def mem_info(verbose=None):
+    pass
@@ -0,0 +1,313 @@
+"""PC（CPython）でゲームを実行
+
+machine, framebuf, micropython, utime の代用モジュールを使って
+main.py を画面なしで実行する. 時計は仮想なので待ち時間なしで進む.
+
+使い方:
+    python3 host/run.py [--frames 1500] [--keys A:1000-1100,LEFT:2000-2200]
+                        [--hash] [--profile] [--workdir DIR]
+                        [--record FILE] [--replay FILE] [--turbo]
+                        [--frame-stats] [--latency] [--taps B:3000-60000/517]
+                        [--heap]
+
+キーは ボタン名:開始ms-終了ms をカンマ区切り.
+ボタン名は A, B, UP, DOWN, LEFT, RIGHT, CENTER.
+--taps は ボタン名:開始ms-終了ms/間隔ms で 50ms の連打（カンマ区切りで複数）.
+
+--record でキー入力と乱数のシードを保存し, --replay で再生する.
+--turbo は描画しないで最速で実行（リプレイの確認用）.
+--frame-stats はフェーズ毎の処理時間（Profiler）を表示. 処理時間は実際の時間.
+--latency は B ボタンから弾が表示されるまでの時間（LatencyProbe）を表示.
+時間は仮想時計なので FPS の待ちとフレームの順序による遅れのみ
+（--frame-stats と一緒に使うと描画と転送の実際の時間を含む）.
+--heap は最初の 1 割のフレーム（ウォームアップ）の後に増えたヒープ（tracemalloc）を表示.
+フレーム毎にヒープを使っていても解放されていれば増えない. 増えた時は場所も表示する.
+"""
+import argparse
+import builtins
+import cProfile
+import gc
+import hashlib
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(HOST_DIR)
+
+# 連打の押している時間
+TAP_MS = 50
+
+# InputKey のピン番号
+KEY_PINS = {
+    "A": 15,
+    "B": 17,
+    "UP": 2,
+    "CENTER": 3,
+    "LEFT": 16,
+    "DOWN": 18,
+    "RIGHT": 20,
+}
+
+
+class Stop(Exception):
+    """指定フレーム数に達した"""
+
+
+def parse_keys(text):
+    """キー入力スクリプトを解析
+
+    Params:
+        text (str): ボタン名:開始ms-終了ms のカンマ区切り
+
+    Returns:
+        (list): (開始ms, 終了ms, ピン番号) のリスト
+    """
+    script = []
+    for item in text.split(","):
+        if not item:
+            continue
+        name, span = item.split(":")
+        start, end = span.split("-")
+        script.append((int(start), int(end), KEY_PINS[name.upper()]))
+    return script
+
+
+def parse_taps(text):
+    """連打のスクリプトを解析
+
+    Params:
+        text (str): ボタン名:開始ms-終了ms/間隔ms のカンマ区切り
+
+    Returns:
+        (list): (開始ms, 終了ms, ピン番号) のリスト
+    """
+    script = []
+    for item in text.split(","):
+        if not item:
+            continue
+        name, span = item.split(":")
+        span, interval = span.split("/")
+        start, end = span.split("-")
+        pin = KEY_PINS[name.upper()]
+        for t in range(int(start), int(end), int(interval)):
+            script.append((t, t + TAP_MS, pin))
+    return script
+
+
+def setup_path():
+    """代用モジュールとゲームを import できるようにする"""
+    sys.path.insert(0, HOST_DIR)
+    sys.path.insert(1, ROOT_DIR)
+    import micropython
+
+    # MicroPython では const は組み込み
+    builtins.const = micropython.const
+
+
+def run(
+    frames,
+    keys=(),
+    hashes=False,
+    turbo=False,
+    key_log=False,
+    stats=False,
+    latency=False,
+    heap=False,
+):
+    """main.py を指定フレーム数だけ実行
+
+    Params:
+        frames (int): 実行するフレーム数
+        keys (list): キー入力スクリプト
+        hashes (bool): 転送したフレームのハッシュを記録
+        turbo (bool): ターボモード
+        key_log (bool): キー入力を KeyRecorder で記録
+        stats (bool): Profiler で計測
+        latency (bool): LatencyProbe で B ボタンを計測
+        heap (bool): ウォームアップ後に増えたヒープを計測
+
+    Returns:
+        (dict): 実行結果
+    """
+    setup_path()
+    import machine
+    import picolcd114
+    import picogamelib
+    import utime
+
+    machine.Pin.script = list(keys)
+    picogamelib.set_turbo(turbo)
+    if latency:
+        picogamelib.start_latency_probe(picolcd114.KEY_B, size=1024)
+    if stats:
+        picogamelib.start_profiler()
+        # 乱数のシードは仮想時計 ゲーム開始後は実際の時間で計測
+        director_play = picogamelib.Director.play
+
+        def play(director):
+            utime.realtime_us = True
+            director_play(director)
+
+        picogamelib.Director.play = play
+
+    result = {"frames": 0, "hashes": []}
+
+    if key_log:
+        input_key = picolcd114.InputKey
+        picolcd114.InputKey = lambda: picogamelib.KeyRecorder(input_key())
+
+    # フレーム数を数える
+    scene_action = picogamelib.Scene.action
+    warm_up = frames // 10
+
+    def action(scene):
+        scene_action(scene)
+        if scene.active:
+            result["frames"] += 1
+            if heap and result["frames"] == warm_up:
+                gc.collect()
+                tracemalloc.start(8)
+            if result["frames"] >= frames:
+                raise Stop()
+
+    picogamelib.Scene.action = action
+
+    # 転送したフレームを記録
+    if hashes:
+        send = picolcd114.LCD.send
+
+        def send_hash(lcd, buf, rects=None, count=0):
+            result["hashes"].append(hashlib.md5(bytes(buf)).digest())
+            send(lcd, buf, rects, count)
+
+        picolcd114.LCD.send = send_hash
+
+    # 実行後にグローバル変数を参照するのでモジュールとして実行
+    game = types.ModuleType("__main__")
+    game.__file__ = os.path.join(ROOT_DIR, "main.py")
+    code = compile(open(game.__file__, encoding="utf-8").read(), game.__file__, "exec")
+    t = time.perf_counter()
+    try:
+        exec(code, game.__dict__)
+    except Stop:
+        pass
+    result["wall"] = time.perf_counter() - t
+    result["game"] = game
+    if heap:
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+        result["heap"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        game_files = [
+            tracemalloc.Filter(True, os.path.join(ROOT_DIR, "*.py")),
+        ]
+        result["heap_top"] = (
+            snapshot.filter_traces(game_files).statistics("lineno")[:5]
+        )
+
+    # 転送中のフレームを待つ
+    pipeline = picogamelib.pipeline
+    if pipeline is not None and pipeline.done.acquire(True, 1):
+        pipeline.done.release()
+
+    result["spi_bytes"] = machine.SPI.total
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PC でゲームを実行")
+    parser.add_argument("--frames", type=int, default=1500, help="実行するフレーム数")
+    parser.add_argument("--keys", default="", help="キー入力 例 A:1000-1100")
+    parser.add_argument("--hash", action="store_true", help="フレームのハッシュを表示")
+    parser.add_argument("--profile", action="store_true", help="cProfile の結果を表示")
+    parser.add_argument("--workdir", default=None, help="セーブデータを置くディレクトリ")
+    parser.add_argument("--record", default=None, help="キー入力を保存するファイル")
+    parser.add_argument("--replay", default=None, help="再生するファイル")
+    parser.add_argument("--turbo", action="store_true", help="描画しないで最速で実行")
+    parser.add_argument(
+        "--frame-stats", action="store_true", help="フェーズ毎の処理時間を表示"
+    )
+    parser.add_argument(
+        "--latency", action="store_true", help="キー入力から表示までの時間を表示"
+    )
+    parser.add_argument("--taps", default="", help="連打 例 B:3000-60000/517")
+    parser.add_argument(
+        "--heap", action="store_true", help="ウォームアップ後に増えたヒープを表示"
+    )
+    args = parser.parse_args(argv)
+
+    keys = parse_keys(args.keys) + parse_taps(args.taps)
+    record = os.path.abspath(args.record) if args.record else None
+    replay = os.path.abspath(args.replay) if args.replay else None
+    # セーブデータ, assets.bin, replay.bin はカレントディレクトリ
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="picogame-"))
+    if replay:
+        shutil.copy(replay, "replay.bin")
+
+    params = (
+        args.frames,
+        keys,
+        args.hash,
+        args.turbo,
+        bool(record),
+        args.frame_stats,
+        args.latency,
+        args.heap,
+    )
+    if args.profile:
+        prof = cProfile.Profile()
+        result = prof.runcall(run, *params)
+    else:
+        result = run(*params)
+
+    game = result["game"]
+    if record:
+        game.key_global.save(record, game.game_seed)
+
+    print(
+        "frames %d  wall %.2fs  %.1f fps  spi %d bytes"
+        % (
+            result["frames"],
+            result["wall"],
+            result["frames"] / result["wall"],
+            result["spi_bytes"],
+        )
+    )
+    scene = game.director.scene_stack[-1].name
+    print("scene %s  status %s" % (scene, game.game_status))
+    if args.hash:
+        print(
+            "hash %s (%d frames sent)"
+            % (
+                hashlib.md5(b"".join(result["hashes"])).hexdigest(),
+                len(result["hashes"]),
+            )
+        )
+    if args.frame_stats:
+        gl = sys.modules["picogamelib"]
+        gl.profiler.dump()
+        if gl.gc_manager is not None:
+            gl.gc_manager.dump()
+        gl.dump_pools()
+    if args.latency:
+        sys.modules["picogamelib"].latency_probe.dump()
+    if args.heap:
+        print(
+            "heap growth %d bytes after warm-up (frame %d to %d)"
+            % (result["heap"], args.frames // 10, result["frames"])
+        )
+        for stat in result["heap_top"]:
+            if stat.size > 0:
+                print("  %s" % stat)
+    if args.profile:
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
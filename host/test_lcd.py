@@ -0,0 +1,96 @@
+"""picolcd114 の転送の確認
+
+DMA の代用を付けた show_async(), show() と DMA なしの show() で SPI に送るバイト列が同じこと.
+"""
+import random
+
+import machine
+import picolcd114
+
+
+class FakeDMA:
+    """rp2.DMA の代用 開始した時に読み込み元の内容を SPI の記録に足す
+    アドレスは addressof() で割り当てた値（上位がバッファの番号, 下位がオフセット）.
+    """
+
+    def __init__(self):
+        self.bufs = []
+
+    def addressof(self, buf):
+        """uctypes.addressof の代用"""
+        for i, b in enumerate(self.bufs):
+            if b is buf:
+                return (i + 1) << 24
+        self.bufs.append(buf)
+        return len(self.bufs) << 24
+
+    def pack_ctrl(self, **kwargs):
+        return 0
+
+    def config(self, read=None, write=None, count=0, ctrl=0, trigger=False):
+        assert write == picolcd114._SPI1_SSPDR
+        assert isinstance(read, int)
+        buf = self.bufs[(read >> 24) - 1]
+        start = read & 0xFFFFFF
+        assert start + count <= len(buf)
+        machine.SPI.log += bytes(memoryview(buf)[start : start + count])
+
+    def active(self):
+        return False
+
+
+def _capture(lcd, send):
+    """send() で SPI に送ったバイト列"""
+    machine.SPI.log = bytearray()
+    try:
+        send()
+        lcd.wait_done()
+        return bytes(machine.SPI.log)
+    finally:
+        machine.SPI.log = None
+
+
+def _frame(lcd, seed):
+    rnd = random.Random(seed)
+    lcd.buf[:] = rnd.randbytes(len(lcd.buf))
+
+
+def _compare(rects, count):
+    lcd = picolcd114.LCD()
+    _frame(lcd, 1)
+    sync = _capture(lcd, lambda: lcd.show(rects, count))
+
+    lcd.dma = FakeDMA()
+    lcd.dma_ctrl = 0
+    picolcd114.addressof = lcd.dma.addressof
+    try:
+        dma = _capture(lcd, lambda: lcd.show_async(rects, count))
+        assert not lcd.busy
+        # DMA での同期転送
+        dma_sync = _capture(lcd, lambda: lcd.show(rects, count))
+    finally:
+        del picolcd114.addressof
+    assert dma == sync
+    assert dma_sync == sync
+    return sync
+
+
+def test_full_frame_dma_matches_sync():
+    sent = _compare(None, 0)
+    assert len(sent) > picolcd114.LCD_W * picolcd114.LCD_H * 2
+
+
+def test_dirty_frame_dma_matches_sync():
+    # 最後が横幅いっぱい（DMA で送る）
+    rects = [8, 4, 16, 10, 100, 60, 32, 20, 0, 90, picolcd114.LCD_W, 12]
+    _compare(rects, 3)
+
+
+def test_dirty_frame_partial_last_rect_matches_sync():
+    # 最後が横幅の一部（同期転送になる）
+    rects = [0, 0, picolcd114.LCD_W, 6, 200, 100, 40, 35]
+    _compare(rects, 2)
+
+
+def test_empty_dirty_frame_sends_nothing():
+    assert _compare([], 0) == b""
@@ -0,0 +1,161 @@
+"""picopixel の viper カーネルと *_ref の比較
+
+viper の関数は CPython では動かないので, ソースから関数を取り出して
+ptr8/ptr16/ptr32 を memoryview で代用して実行する.
+結果はバイト単位で一致すること.
+"""
+import ast
+import os
+import random
+
+import picopixel
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Ptr:
+    """viper のポインタの代用 リトルエンディアン
+    読み書きはビット幅で切り詰める. バッファの外へのアクセスは例外になる.
+    """
+
+    def __init__(self, obj, size, signed):
+        self.mv = memoryview(obj).cast("B")
+        self.size = size
+        self.signed = signed
+
+    def __getitem__(self, i):
+        p = i * self.size
+        assert 0 <= p and p + self.size <= len(self.mv), "out of range"
+        return int.from_bytes(self.mv[p : p + self.size], "little", signed=self.signed)
+
+    def __setitem__(self, i, v):
+        p = i * self.size
+        assert 0 <= p and p + self.size <= len(self.mv), "out of range"
+        v &= (1 << (self.size * 8)) - 1
+        self.mv[p : p + self.size] = v.to_bytes(self.size, "little")
+
+
+def _viper_kernels():
+    """picopixel.py の MicroPython 用の関数を CPython で実行できるようにする
+
+    Returns:
+        (dict): 関数名 -> 関数
+    """
+    path = os.path.join(ROOT_DIR, "picopixel.py")
+    tree = ast.parse(open(path, encoding="utf-8").read())
+    block = next(
+        n
+        for n in tree.body
+        if isinstance(n, ast.If) and "micropython" in ast.dump(n.test)
+    )
+    funcs = [n for n in block.body if isinstance(n, ast.FunctionDef)]
+    for f in funcs:
+        f.decorator_list = []  # @micropython.viper
+    module = ast.Module(body=funcs, type_ignores=[])
+    namespace = {
+        "ptr8": lambda o: _Ptr(o, 1, False),
+        "ptr16": lambda o: _Ptr(o, 2, False),
+        # viper の int は 32bit 符号付き
+        "ptr32": lambda o: _Ptr(o, 4, True),
+    }
+    exec(compile(module, path, "exec"), namespace)
+    return {f.name: namespace[f.name] for f in funcs}
+
+
+VIPER = _viper_kernels()
+
+
+def _image(rnd, w, h, colors):
+    """ランダムな (w/2)x(h/2) の RGB565 画像"""
+    palette = [rnd.randrange(0x10000) for _ in range(colors)]
+    buf = bytearray()
+    for _ in range((w >> 1) * (h >> 1)):
+        c = rnd.choice(palette)
+        buf.append(c & 0xFF)
+        buf.append(c >> 8)
+    return bytes(buf)
+
+
+def _cases(rnd, n):
+    """描画先の大きさと位置 はみ出る場合を多めに"""
+    for _ in range(n):
+        dw = rnd.choice((240, 37, 8, 2))
+        dh = rnd.choice((135, 21, 6, 2))
+        w = rnd.randrange(1, 13) * 4
+        h = rnd.randrange(1, 13) * 2
+        x = rnd.randrange(-w - 3, dw + 3)
+        y = rnd.randrange(-h - 3, dh + 3)
+        yield dw, dh, w, h, x, y
+
+
+def _geom(dw, dh, w, h, x, y):
+    g = picopixel.new_geometry(dw, dh)
+    g[picopixel.GEOM_W] = w
+    g[picopixel.GEOM_H] = h
+    g[picopixel.GEOM_X] = x
+    g[picopixel.GEOM_Y] = y
+    return g
+
+
+def _check(kernel, ref, src_fn, seed):
+    rnd = random.Random(seed)
+    for dw, dh, w, h, x, y in _cases(rnd, 300):
+        src = src_fn(rnd, w, h)
+        base = bytearray(rnd.randbytes(dw * dh * 2))
+        a = bytearray(base)
+        b = bytearray(base)
+        kernel(a, src, _geom(dw, dh, w, h, x, y))
+        ref(b, src, _geom(dw, dh, w, h, x, y))
+        assert a == b, (dw, dh, w, h, x, y)
+
+
+def test_scale2x_matches_ref():
+    def src(rnd, w, h):
+        return _image(rnd, w, h, 64)
+
+    _check(VIPER["scale2x"], picopixel.scale2x_ref, src, 1)
+
+
+def test_rle2x_matches_ref():
+    def src(rnd, w, h):
+        return picopixel.rle_encode(_image(rnd, w, h, rnd.randrange(1, 17)), w, h)
+
+    _check(VIPER["rle2x"], picopixel.rle2x_ref, src, 2)
+
+
+def test_rle2x_matches_scale2x():
+    """圧縮した画像の描画は元の画像の拡大と同じ"""
+    rnd = random.Random(3)
+    for dw, dh, w, h, x, y in _cases(rnd, 200):
+        img = _image(rnd, w, h, rnd.randrange(1, 17))
+        a = bytearray(dw * dh * 2)
+        b = bytearray(dw * dh * 2)
+        g = _geom(dw, dh, w, h, x, y)
+        picopixel.rle2x_ref(a, picopixel.rle_encode(img, w, h), g)
+        picopixel.scale2x_ref(b, img, g)
+        assert a == b, (dw, dh, w, h, x, y)
+
+
+def test_copy_rect_matches_ref():
+    rnd = random.Random(4)
+    for dw, dh, w, h, x, y in _cases(rnd, 300):
+        w >>= 1  # 奇数の幅と位置も
+        src = rnd.randbytes(dw * dh * 2)
+        base = bytearray(rnd.randbytes(dw * dh * 2))
+        a = bytearray(base)
+        b = bytearray(base)
+        VIPER["copy_rect"](a, src, _geom(dw, dh, w, h, x, y))
+        picopixel.copy_rect_ref(b, src, _geom(dw, dh, w, h, x, y))
+        assert a == b, (dw, dh, w, h, x, y)
+        # 矩形の外は変わらない
+        for py in range(dh):
+            for px in range(dw):
+                i = (py * dw + px) * 2
+                inside = x <= px < x + w and y <= py < y + h
+                assert b[i : i + 2] == (src if inside else base)[i : i + 2]
+
+
+def test_viper_kernels_take_at_most_four_args():
+    """viper の関数は引数 4 つまで"""
+    for name, f in VIPER.items():
+        assert f.__code__.co_argcount <= 4, name
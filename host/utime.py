@@ -0,0 +1,102 @@
+"""utime モジュールの代用（PC 実行用）
+
+仮想時計. ticks_ms() を呼ぶたびに step_us だけ進むので,
+フレーム待ちのループは待たずに次のフレームに進む.
+時計を進めるのはメインスレッド（CORE0 相当）のみ.
+
+realtime を True にすると実際の時間を返す.
+realtime_us を True にすると ticks_us() は実際の時間に sleep した時間を足して返す
+（sleep は待たずに進めて, 処理時間は実際に測る）.
+ticks_* は MicroPython と同じく 2**30 で一周する.
+
+Attributes:
+    now_us (int): 現在時刻（マイクロ秒）
+    step_us (int): ticks_ms() 1回で進める時間
+    limit_us (int): この時刻を過ぎたら TimeLimit を投げる None は無制限
+    realtime (bool): 実際の時間を使う
+    realtime_us (bool): ticks_us() は実際の時間 + sleep した時間
+    hooks (list): 時計を進めた後に呼ぶ関数 引数は進める前と後の時刻（マイクロ秒）
+"""
+import threading
+import time
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MASK = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+now_us = 0
+step_us = 1000
+limit_us = None
+realtime = False
+realtime_us = False
+hooks = []
+
+
+class TimeLimit(Exception):
+    """limit_us を過ぎた"""
+
+
+def _main():
+    return threading.current_thread() is threading.main_thread()
+
+
+def advance(us):
+    """時計を進める
+
+    Params:
+        us (int): 進める時間（マイクロ秒）
+    """
+    global now_us
+    if not _main():
+        return
+    prev = now_us
+    now_us += us
+    for hook in hooks:
+        hook(prev, now_us)
+    if limit_us is not None and now_us > limit_us:
+        raise TimeLimit()
+
+
+def now_ms():
+    """現在時刻（ms） 時計は進めない realtime_us の影響を受けない"""
+    if realtime:
+        return time.perf_counter_ns() // 1000000
+    return now_us // 1000
+
+
+def ticks_us():
+    if realtime:
+        return (time.perf_counter_ns() // 1000) & _TICKS_MASK
+    if realtime_us:
+        return (time.perf_counter_ns() // 1000 + now_us) & _TICKS_MASK
+    return now_us & _TICKS_MASK
+
+
+def ticks_ms():
+    if realtime:
+        return (time.perf_counter_ns() // 1000000) & _TICKS_MASK
+    advance(step_us)
+    return (now_us // 1000) & _TICKS_MASK
+
+
+def ticks_diff(a, b):
+    return ((a - b + _TICKS_HALF) & _TICKS_MASK) - _TICKS_HALF
+
+
+def ticks_add(a, b):
+    return (a + b) & _TICKS_MASK
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+def sleep_us(us):
+    if realtime:
+        time.sleep(us / 1000000)
+    else:
+        advance(us)
+
+
+def sleep(s):
+    sleep_us(int(s * 1000000))
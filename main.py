@@ -2,11 +2,8 @@
 __version__ = "1.0.0"
 __author__ = "Choi Gyun 2022"
 
-# import _thread
-import random
 
 import ease
-import gamedata as dat
 import picogamelib as gl
 import picolcd114 as lcd
 
@@ -87,6 +84,12 @@ _CHR_DEADLINE = const(12)
 _CHR_ITEM = const(13)
 _CHR_AIM = const(15)
 
+### パネルのカラー（_CHR_PANEL からのオフセット）
+_COLOR_GREY = const(_CHR_PANELX - _CHR_PANEL)  # グレーパネル
+_COLOR_FLASH = const(_CHR_FLASH - _CHR_PANEL)  # フラッシュ
+_COLOR_NONE = const(0xFF)  # パネルなし
+_COLUMN_FULL = const((1 << _FIELD_H) - 1)  # 1列そろった
+
 ### ビットマップ
 _BMP_TITLE = const(0)
 _BMP_OVER = const(1)
@@ -170,6 +173,16 @@ _EV_FREEZE_STOP = const("ev_freeze_stop")
 
 # セーブデータ
 _FILENAME = const("gw100.json")
+# アセット
+_ASSET_FILE = const("assets.bin")
+# リプレイ（KeyRecorder で保存したファイル）
+_REPLAY_FILE = const("replay.bin")
+# スプライトプールの使用数の記録
+_POOL_FILE = const("pools.json")
+# 処理時間の表示（開発用） 画面上部のバーと 10 秒毎のシリアル出力
+_PROFILE = const(False)
+# B ボタンから弾が表示されるまでの時間の計測（開発用） 20 回毎のシリアル出力
+_LATENCY = const(False)
 
 
 class MainScene(gl.Scene):
@@ -248,31 +261,28 @@ class MainScene(gl.Scene):
 
         super().enter()
 
-    def action(self):
-        """フレーム毎のアクション 30FPS"""
-        super().action()
-
-        if self.active:
-            # ポーズ
-            if self.key.push & lcd.KEY_A:
-                self.director.push("pause")
+    def update(self):
+        """フレーム毎の処理 30FPS"""
+        # ポーズ
+        if self.key.push & lcd.KEY_A:
+            self.director.push("pause")
 
-            if not self.gameover:
-                # アイテム出現
-                self.appear_item()
+        if not self.gameover:
+            # アイテム出現
+            self.appear_item()
 
-                # 一定時間で deadline が移動
-                if self.frame_count % _DEAD_INTERVAL == 0:
-                    self.update_deadtime_bar(-1)
+            # 一定時間で deadline が移動
+            if self.frame_count % _DEAD_INTERVAL == 0:
+                self.update_deadtime_bar(-1)
 
     def appear_item(self):
         """アイテム出現"""
         if (
             self.frame_count % _ITEM_INTERVAL == 0
             and self.item_num < _MAX_ITEM
-            and random.randint(0, 2) == 0
+            and self.random.randint(0, 2) == 0
         ):
-            if random.randint(0, 2) == 0:
+            if self.random.randint(0, 2) == 0:
                 item_type = _ITEM_FREEZE
             else:
                 item_type = _ITEM_BURST
@@ -283,7 +293,7 @@ class MainScene(gl.Scene):
                 item_type,
                 "item",
                 lcd.LCD_W,
-                random.randint(0, 5) * _OBJ_BH,
+                self.random.randint(0, 5) * _OBJ_BH,
                 _ITEM_Z,
                 _OBJ_W,
                 _OBJ_H,
@@ -296,7 +306,9 @@ class MainScene(gl.Scene):
         if self.deadtime < 0:
             self.deadtime = _MAX_DEADTIME
             # イベント発行
-            self.event.post([_EV_UPDATE_DEADLINE, gl.EV_PRIORITY_MID, 0, self, None])
+            self.event.post_event(
+                _EV_UPDATE_DEADLINE, gl.EV_PRIORITY_MID, 0, self, None
+            )
             self.deadline.x += _OBJ_W  # 一段移動
         elif self.deadtime > _MAX_DEADTIME:
             self.deadtime = _MAX_DEADTIME
@@ -332,7 +344,9 @@ class PauseScene(gl.Scene):
         # イベントマネージャ
         event = gl.EventManager()
         # ステージ
-        stage = gl.Stage(self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H)
+        stage = gl.Stage(
+            self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H, dirty_rect=True
+        )
         super().__init__(name, event, stage, key)
 
         # スプライト作成
@@ -400,26 +414,23 @@ class PauseScene(gl.Scene):
         else:
             self.ex.visible = True
 
-    def action(self):
-        super().action()
+    def update(self):
+        # ブライトネス調整
+        if (
+            self.key.push & lcd.KEY_UP
+            and game_status["brightness"] < lcd.LCD_BRIGHTNESS_MAX - 1
+        ):
+            game_status["brightness"] += 1
+            gl.lcd.brightness(game_status["brightness"])
+            gl.save_status(game_status, _FILENAME)
+        elif self.key.push & lcd.KEY_DOWN and game_status["brightness"] > 0:
+            game_status["brightness"] -= 1
+            gl.lcd.brightness(game_status["brightness"])
+            gl.save_status(game_status, _FILENAME)
 
-        if self.active:
-            # ブライトネス調整
-            if (
-                self.key.push & lcd.KEY_UP
-                and game_status["brightness"] < lcd.LCD_BRIGHTNESS_MAX - 1
-            ):
-                game_status["brightness"] += 1
-                gl.lcd.brightness(game_status["brightness"])
-                gl.save_status(game_status, _FILENAME)
-            elif self.key.push & lcd.KEY_DOWN and game_status["brightness"] > 0:
-                game_status["brightness"] -= 1
-                gl.lcd.brightness(game_status["brightness"])
-                gl.save_status(game_status, _FILENAME)
-
-            # ポーズ解除
-            if self.key.push & lcd.KEY_A:
-                self.director.pop()
+        # ポーズ解除
+        if self.key.push & lcd.KEY_A:
+            self.director.pop()
 
 
 class OverScene(gl.Scene):
@@ -431,7 +442,9 @@ class OverScene(gl.Scene):
         # イベントマネージャ
         event = gl.EventManager()
         # ステージ
-        stage = gl.Stage(self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H)
+        stage = gl.Stage(
+            self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H, dirty_rect=True
+        )
         super().__init__(name, event, stage, key)
 
         # スプライト作成
@@ -499,24 +512,23 @@ class OverScene(gl.Scene):
             game_status["hi_ex"] = hi
             self.hi_num.set_value(hi)
         gl.save_status(game_status, _FILENAME)
+        # プールの使用数を記録
+        gl.save_pool_stats(_POOL_FILE)
 
         self.lines_num.set_value(game_status["lines"])
         self.score_num.set_value(game_status["score"])
         super().enter()
 
-    def action(self):
-        super().action()
-
-        if self.active:
-            # リスタート
-            if self.key.push & lcd.KEY_B:
-                self.director.pop()
-                self.director.pop()  # メイン画面もpop
-                self.director.push("main")
-            elif self.key.push & lcd.KEY_A:
-                self.director.pop()
-                self.director.pop()
-                self.director.push("title")
+    def update(self):
+        # リスタート
+        if self.key.push & lcd.KEY_B:
+            self.director.pop()
+            self.director.pop()  # メイン画面もpop
+            self.director.push("main")
+        elif self.key.push & lcd.KEY_A:
+            self.director.pop()
+            self.director.pop()
+            self.director.push("title")
 
 
 class TitleScene(gl.Scene):
@@ -528,7 +540,9 @@ class TitleScene(gl.Scene):
         # イベントマネージャ
         event = gl.EventManager()
         # ステージ
-        stage = gl.Stage(self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H)
+        stage = gl.Stage(
+            self, event, "stage", 0, 0, 0, lcd.LCD_W, lcd.LCD_H, dirty_rect=True
+        )
         super().__init__(name, event, stage, key)
 
         # スプライト作成
@@ -567,9 +581,8 @@ class TitleScene(gl.Scene):
         )
         # 数値表示
         self.hi_num = ScoreNum(self.stage, _SCORE_DIGIT, "hi_num", 90, 85, _MES_Z)
-        # アニメ
-        self.anime = gl.Anime("title", self.event, ease.linear)
-        self.anime.attach()
+        # アニメ 上に移動
+        self.tween = gl.Timeline(self.title, "y", ((-20, 10, ease.linear),))
 
     def enter(self):
         if game_status["mode"] == 0:
@@ -578,22 +591,16 @@ class TitleScene(gl.Scene):
             self.hi_num.set_value(game_status["hi_ex"])
 
         self.title.y = 20
-        self.anime.start = self.title.y
-        self.anime.delta = -20
-        self.anime.total_frame = 10
-        self.anime.play()
+        self.tween.start = self.title.y
+        self.tweens.play(self.tween)
         super().enter()
 
         self.hi.visible = False
         self.hi_num.visible = False
         self.ex.visible = False
 
-    def action(self):
-        super().action()
-
-        if self.anime.is_playing:
-            self.title.y = int(self.anime.value)
-        else:
+    def update(self):
+        if not self.tween.is_playing:
             self.hi.visible = True
             self.hi_num.visible = True
             if game_status["mode"] == 1:
@@ -601,48 +608,49 @@ class TitleScene(gl.Scene):
             else:
                 self.ex.visible = False
 
-        if self.active:
-            # ゲーム開始
-            if self.key.push & lcd.KEY_B:
-                self.anime.stop()
-                self.director.pop()
-                self.director.push("main")
-            # モード切替
-            if self.key.push & lcd.KEY_A:
-                game_status["mode"] ^= 1
-                if game_status["mode"] == 1:
-                    self.ex.visible = True
-                    self.hi_num.set_value(game_status["hi_ex"])
-                else:
-                    self.ex.visible = False
-                    self.hi_num.set_value(game_status["hi"])
+        # ゲーム開始
+        if self.key.push & lcd.KEY_B:
+            self.tweens.stop(self.tween)
+            self.director.pop()
+            self.director.push("main")
+        # モード切替
+        if self.key.push & lcd.KEY_A:
+            game_status["mode"] ^= 1
+            if game_status["mode"] == 1:
+                self.ex.visible = True
+                self.hi_num.set_value(game_status["hi_ex"])
+            else:
+                self.ex.visible = False
+                self.hi_num.set_value(game_status["hi"])
 
 
 class MainStage(gl.Stage):
     """ステージ
     メイン画面用のステージ
-    弾とパネルのスプライトはプールで管理.
+    弾とアイテムのスプライトはプールで管理.
     """
 
     def __init__(self, scene, event, name, x, y, z, w, h):
-        super().__init__(scene, event, name, x, y, z, w, h)
-        # パネルのプール
-        self.panel_pool = gl.SpritePool(self, globals()["Panel"], 60)
+        super().__init__(scene, event, name, x, y, z, w, h, dirty_rect=True)
         # ショットのプール
-        self.shot_pool = gl.SpritePool(self, globals()["ShotPanel"], 4)
+        self.shot_pool = gl.SpritePool(self, globals()["ShotPanel"], 4, "shot")
         # メテオ・バースト
-        self.item_pool = gl.SpritePool(self, globals()["Item"], _MAX_ITEM)
+        self.item_pool = gl.SpritePool(self, globals()["Item"], _MAX_ITEM, "item")
 
         event.add_listner([_EV_UPDATE_DEADLINE, self, True])  # デッドライン更新
-        event.add_listner([gl.EV_ANIME_COMPLETE, self, True])  # アニメ終了
         event.add_listner([_EV_FREEZE_START, self, True])  # フリーズ開始
         event.add_listner([_EV_FREEZE_STOP, self, True])  # フリーズ終了
 
-        # ステージのアニメ
-        self.shake_anime = gl.Anime("stage_shake", event, ease.linear)
-        self.shake_anime.attach()
-        # アニメのパラメータリスト
-        self.shake_params = [-_SHAKE_DELTA, _SHAKE_DELTA * 2, -_SHAKE_DELTA]
+        # ステージのアニメ 上下にゆれて戻る
+        self.shake_tween = gl.Timeline(
+            self,
+            "y",
+            (
+                (-_SHAKE_DELTA, _SHAKE_FRAME_MAX, ease.linear),
+                (_SHAKE_DELTA, _SHAKE_FRAME_MAX, ease.linear),
+                (0, _SHAKE_FRAME_MAX, ease.linear),
+            ),
+        )
 
     def enter(self):
         """初期化"""
@@ -651,47 +659,23 @@ class MainStage(gl.Stage):
             if self.sprite_list[i].name in ("shot", "item"):
                 self.sprite_list[i].leave()
 
-        self.shake_index = 0
-        self.shake_anime.stop()
+        self.scene.tweens.stop(self.shake_tween)
         self.y = 0
 
         super().enter()
 
-    def action(self):
-        super().action()
-
-        # アニメ中
-        if self.shake_anime.is_playing:
-            self.y = int(self.shake_anime.value)
-
     def shake(self):
         """画面をゆらす"""
-        if self.shake_anime.is_playing:
+        if self.shake_tween.is_playing:
             return
-        self.shake_anime.start = self.y
-        self.shake_anime.delta = self.shake_params[self.shake_index]
-        self.shake_anime.total_frame = _SHAKE_FRAME_MAX
-        self.shake_anime.play()
-        self.shake_index = 1
+        self.shake_tween.start = self.y
+        self.scene.tweens.play(self.shake_tween)
 
     def ev_update_deadline(self, type, sender, option):
         """イベント:フレーム毎"""
         # 画面ゆらす
         self.shake()
 
-    def ev_anime_complete(self, type, sender, option):
-        """イベント:アニメ終了"""
-        if option != "stage_shake" or self.shake_index < 1:
-            return
-        # 次のアニメ
-        self.shake_anime.start = self.y
-        self.shake_anime.delta = self.shake_params[self.shake_index]
-        self.shake_anime.total_frame = _SHAKE_FRAME_MAX
-        self.shake_anime.play()
-        self.shake_index += 1
-        if self.shake_index >= len(self.shake_params):
-            self.shake_index = 0
-
     def ev_freeze_start(self, type, sender, option):
         """フリーズ開始"""
         self.event.disable_listners(
@@ -725,8 +709,7 @@ class Ship(gl.Sprite):
         self.aim = Aim().init_params(
             self, _CHR_AIM, "aim", 0, self.y, _AIM_Z, _OBJ_W, _OBJ_H
         )
-        self.move_anime = gl.Anime("ship_move", self.event, ease.out_elastic)  # 移動アニメ
-        self.move_anime.attach()  # アニメ有効化
+        self.move_tween = gl.Tween(self, "y", ease.out_elastic)  # 移動アニメ
 
         # イベントリスナー登録
         self.event.add_listner([gl.EV_ENTER_FRAME, self, True])
@@ -753,8 +736,8 @@ class Ship(gl.Sprite):
             return
 
         # 移動中の場合
-        if self.move_anime.is_playing:  # アニメ中
-            y = self.move_anime.start + self.move_anime.delta  # 移動先の座標
+        if self.move_tween.is_playing:  # アニメ中
+            y = self.move_tween.start + self.move_tween.delta  # 移動先の座標
         else:
             y = self.y
 
@@ -774,6 +757,8 @@ class Ship(gl.Sprite):
             _OBJ_W,
             _OBJ_H,
         ).enter()
+        if gl.latency_probe is not None:
+            gl.latency_probe.effect()
         # 連弾
         if self.burst_time > 0 and not self.scene.fieldmap.existsPanel(_OBJ_W, y):
             self.stage.shot_pool.get_instance().init_params(
@@ -793,25 +778,25 @@ class Ship(gl.Sprite):
         if (
             option.repeat & lcd.KEY_UP
             and self.y > 0
-            and not self.move_anime.is_playing
+            and not self.move_tween.is_playing
             and self.stop_time == 0
         ):
             # アニメセット
-            self.move_anime.start = self.y
-            self.move_anime.delta = -_SHIP_MOVE_STEP
-            self.move_anime.total_frame = _SHIP_MOVE_FRAME_MAX
-            self.move_anime.play()
+            self.move_tween.start = self.y
+            self.move_tween.delta = -_SHIP_MOVE_STEP
+            self.move_tween.total_frame = _SHIP_MOVE_FRAME_MAX
+            self.scene.tweens.play(self.move_tween)
         if (
             option.repeat & lcd.KEY_DOWN
             and self.y < _SHIP_MOVE_MAX
-            and not self.move_anime.is_playing
+            and not self.move_tween.is_playing
             and self.stop_time == 0
         ):
             # アニメセット
-            self.move_anime.start = self.y
-            self.move_anime.delta = _SHIP_MOVE_STEP
-            self.move_anime.total_frame = _SHIP_MOVE_FRAME_MAX
-            self.move_anime.play()
+            self.move_tween.start = self.y
+            self.move_tween.delta = _SHIP_MOVE_STEP
+            self.move_tween.total_frame = _SHIP_MOVE_FRAME_MAX
+            self.scene.tweens.play(self.move_tween)
 
         if option.repeat & lcd.KEY_LEFT:
             # 強制スクロール
@@ -839,40 +824,6 @@ class Ship(gl.Sprite):
         if option.push & lcd.KEY_B:
             self.fire_panel()
 
-        # 移動中
-        if self.move_anime.is_playing:
-            self.y = int(self.move_anime.value)
-
-
-class Panel(gl.Sprite):
-    """迫りくるパネル"""
-
-    def __init__(self):
-        super().__init__()
-
-    def init_params(self, parent, chr_no, name, x, y, z, w, h):
-        super().init_params(parent, chr_no, name, x, y, z, w, h)
-        # ベースのX座標
-        self.base_x = x
-        # 点滅用
-        self.flash = False
-        self.flash_time = 0
-        return self
-
-    def enter(self):
-        return super().enter()
-
-    def leave(self):
-        super().leave()
-
-    def action(self):
-        super().action()
-        # 点滅
-        if self.flash:
-            self.flash_time += 1
-            if self.flash_time % _FLASH_INTERVAL == 0:
-                self.visible = not self.visible
-
 
 class ShotPanel(gl.Sprite):
     """自機の打ち出すパネル"""
@@ -920,19 +871,14 @@ class Aim(gl.Sprite):
 
     def ev_enter_frame(self, type, sender, option):
         """イベント:毎フレーム"""
-        if self.scene.ship.move_anime.is_playing:  # アニメ中
-            mv = self.scene.ship.move_anime
+        if self.scene.ship.move_tween.is_playing:  # アニメ中
+            mv = self.scene.ship.move_tween
             y = (mv.start + mv.delta) // _OBJ_BH  # 移動先の座標
         else:
             y = self.scene.ship.y // _OBJ_BH
 
-        mp = self.scene.fieldmap.fieldmap
         offset = self.scene.fieldmap.scroll_offset
-        pos = _FIELD_W - 1
-        for x in range(_FIELD_W):
-            if mp[y][x] is not None and mp[y][x].chr_no < _CHR_FLASH:
-                pos = x - 1
-                break
+        pos = self.scene.fieldmap.first_solid(y) - 1
         # X座標更新
         if pos < (_FIELD_W - 1):
             self.x = pos * _OBJ_W + offset
@@ -992,23 +938,11 @@ class Item(gl.Sprite):
             self.stage.shake()
 
             # 画面フリーズ演出
-            self.stage.event.post(
-                [
-                    _EV_FREEZE_START,
-                    gl.EV_PRIORITY_HI,
-                    0,
-                    self,
-                    None,
-                ]
+            self.stage.event.post_event(
+                _EV_FREEZE_START, gl.EV_PRIORITY_HI, 0, self, None
             )
-            self.stage.event.post(
-                [
-                    _EV_FREEZE_STOP,
-                    gl.EV_PRIORITY_HI,
-                    _STAGE_FREEZE_TIME,
-                    self,
-                    None,
-                ]
+            self.stage.event.post_event(
+                _EV_FREEZE_STOP, gl.EV_PRIORITY_HI, _STAGE_FREEZE_TIME, self, None
             )
             self.leave()
         elif self.x < 0:
@@ -1049,34 +983,38 @@ class DeadLine(gl.SpriteContainer):
 class BlinkMessage(gl.BitmapSprite):
     """点滅メッセージ表示
     一定期間で消える
+    点滅は visible のタイムライン. duration は interval * 2 の倍数.
 
     Attributes:
         duration (int): 表示時間
         interval (int): 点滅間隔 0の時は点滅しない
+        blink (Timeline): 点滅のタイムライン
     """
 
     def __init__(self, parent, bitmap, duration, interval, name, x, y, z, w, h):
         super().__init__(parent, bitmap, name, x, y, z, w, h)
         self.duration = duration
         self.interval = interval
+        if interval == 0:
+            keys = ((1, duration, None),)
+            loops = 1
+        else:
+            keys = ((0, interval, None), (1, interval, None))
+            loops = duration // (interval * 2)
+        self.blink = gl.Timeline(self, "visible", keys, loops, self.blink_end)
 
     def enter(self):
+        self.scene.tweens.play(self.blink)
         return super().enter()
 
     def leave(self):
+        self.scene.tweens.stop(self.blink)
         self.visible = False
         super().leave()
 
-    def action(self):
-        super().action()
-
-        if self.interval != 0 and self.duration % self.interval == 0:
-            self.visible = not self.visible
-
-        # 一定時間で消える
-        self.duration -= 1
-        if self.duration == 0:
-            self.leave()
+    def blink_end(self, timeline):
+        """一定時間で消える"""
+        self.leave()
 
 
 class ScoreNum(gl.SpriteContainer):
@@ -1118,7 +1056,21 @@ class ScoreNum(gl.SpriteContainer):
 
 
 class FieldMap:
-    """フィールドマップの管理"""
+    """フィールドマップの管理
+    パネルの状態は列毎のビットマスクとカラーの配列で持つ.
+    表示はタイルレイヤーで, マップから同期する.
+
+    Attributes:
+        colors (bytearray): パネルのカラー（_CHR_PANEL からのオフセット） 列優先
+            _COLOR_NONE はパネルなし
+        occ (bytearray): 列毎のパネルの有無 ビットがY座標
+        solid (bytearray): 列毎の当たり判定のあるパネル（フラッシュ色以外）
+        flash (bytearray): 列毎の点滅中のパネル
+        grey (bytearray): 列毎のグレーパネル
+        line_id (bytearray): 列毎のライン消去イベントのID 0 はなし
+        columns (tuple): 列のスクロール・削除で一緒に動かす列毎の配列
+        layer (TileLayer): パネルの表示
+    """
 
     def __init__(self, stage):
         self.stage = stage
@@ -1128,8 +1080,38 @@ class FieldMap:
         self.stage.event.add_listner([_EV_DELETE_LINE, self, True])  # ライン消去
         self.stage.event.add_listner([_EV_UPDATE_DEADLINE, self, True])  # デッドライン更新
 
-        # フィールドマップ パネルの配置 2次元マップ
-        self.fieldmap = [[None for i in range(_FIELD_W)] for j in range(_FIELD_H)]
+        # フィールドマップ
+        self.colors = bytearray(b"\xff" * (_FIELD_W * _FIELD_H))
+        self.occ = bytearray(_FIELD_W)
+        self.solid = bytearray(_FIELD_W)
+        self.flash = bytearray(_FIELD_W)
+        self.grey = bytearray(_FIELD_W)
+        self.line_id = bytearray(_FIELD_W)
+        # 列と一緒に動かす配列 毎回タプルを作らない
+        self.columns = (self.occ, self.solid, self.flash, self.grey, self.line_id)
+        self.next_line_id = 1
+        # 行毎の最初の当たり判定のあるパネル
+        self.row_first = bytearray(_FIELD_H)
+        self.rows_dirty = True
+        # パネルの表示
+        self.layer = gl.TileLayer(
+            stage,
+            "panel",
+            0,
+            0,
+            _PANEL_Z,
+            _FIELD_W,
+            _FIELD_H,
+            _OBJ_W,
+            _OBJ_BH,
+            _OBJ_W,
+            _OBJ_H,
+        )
+        self.layer.blink_interval = _FLASH_INTERVAL
+        # 処理待ちのライン消去イベント
+        self.line_events = []
+        # 使い終わったライン消去イベント 取り消し用に持つので自前で使い回す
+        self.free_line_events = []
 
     def init_map(self):
         # スクロールのオフセット ドット単位で移動するため
@@ -1154,6 +1136,50 @@ class FieldMap:
         for i in range(_DEF_LINES):
             self.set_new_line(_FIELD_W - _DEF_LINES + i)
 
+    def update_column(self, x):
+        """列のビットマスクを更新
+
+        Params:
+            x (int): X座標
+        """
+        occ = solid = grey = 0
+        i = x * _FIELD_H
+        for y in range(_FIELD_H):
+            c = self.colors[i + y]
+            if c != _COLOR_NONE:
+                bit = 1 << y
+                occ |= bit
+                if c != _COLOR_FLASH:
+                    solid |= bit
+                if c == _COLOR_GREY:
+                    grey |= bit
+        self.occ[x] = occ
+        self.solid[x] = solid
+        self.grey[x] = grey
+        self.flash[x] &= occ
+        self.rows_dirty = True
+
+    def first_solid(self, y):
+        """行の最初の当たり判定のあるパネル
+
+        Params:
+            y (int): Y座標
+
+        Returns:
+            (int): X座標 ない場合は _FIELD_W
+        """
+        if self.rows_dirty:
+            self.rows_dirty = False
+            for row in range(_FIELD_H):
+                self.row_first[row] = _FIELD_W
+            for x in range(_FIELD_W - 1, -1, -1):
+                m = self.solid[x]
+                if m:
+                    for row in range(_FIELD_H):
+                        if m & (1 << row):
+                            self.row_first[row] = x
+        return self.row_first[y]
+
     def existsPanel(self, x, y):
         """パネルが存在するか
 
@@ -1164,12 +1190,7 @@ class FieldMap:
         Returns:
             (bool): 存在するか
         """
-        px = x // _OBJ_W
-        py = y // _OBJ_BH
-        if self.fieldmap[py][px] is not None:
-            return True
-        else:
-            return False
+        return self.occ[x // _OBJ_W] & (1 << (y // _OBJ_BH)) != 0
 
     def existsPanels(self, x):
         """パネルが存在するか 1列分判定
@@ -1180,23 +1201,25 @@ class FieldMap:
         Returns:
             (bool): 存在するか
         """
-        px = x // _OBJ_W
-        for y in range(_FIELD_H):
-            if self.fieldmap[y][px] is not None:
-                return True
-
-        return False
+        return self.occ[x // _OBJ_W] != 0
 
     def clear(self):
         """マップをクリア
         スプライトは回収
         """
-        for y in range(_FIELD_H):
-            for x in range(_FIELD_W):
-                p = self.fieldmap[y][x]
-                if p is not None:
-                    p.leave()
-                    self.fieldmap[y][x] = None
+        # 処理待ちのライン消去は取り消す
+        for e in self.line_events:
+            self.stage.event.cancel(e)
+            self.free_line_events.append(e)
+        self.line_events.clear()
+
+        for i in range(_FIELD_W * _FIELD_H):
+            self.colors[i] = _COLOR_NONE
+        self.layer.clear()
+        for x in range(_FIELD_W):
+            self.line_id[x] = 0
+            self.flash[x] = 0
+            self.update_column(x)
 
     def set_new_line(self, x=_FIELD_W - 1):
         """新しいラインを作成
@@ -1207,7 +1230,7 @@ class FieldMap:
         # 1列削除
         self.clear_line(x)
 
-        count = random.randint(2, 4)
+        count = self.scene.random.randint(2, 4)
         for y in range(count):
             self.set_new_panel(x, y, self.current_color)
         # シャッフルする
@@ -1227,22 +1250,9 @@ class FieldMap:
             y (int): Y座標
             color (int): カラー
         """
-        sp_x = x * _OBJ_W
-        sp_y = y * _OBJ_BH
-        self.fieldmap[y][x] = (
-            self.stage.panel_pool.get_instance()
-            .init_params(
-                self.stage,
-                color + _CHR_PANEL,
-                "panel",
-                sp_x,
-                sp_y,
-                _PANEL_Z,
-                _OBJ_W,
-                _OBJ_H,
-            )
-            .enter()
-        )
+        self.colors[x * _FIELD_H + y] = color
+        self.layer.set_tile(x, y, color + _CHR_PANEL)
+        self.update_column(x)
 
     def check_hit_panel(self, shot_panel):
         """弾とパネルの当たり判定
@@ -1253,24 +1263,13 @@ class FieldMap:
         """
         x = shot_panel.x // _OBJ_W
         y = shot_panel.y // _OBJ_BH
-        hit = False
-
-        # 端まで行った or ひとつ先
-        if (
-            x == (_FIELD_W - 1)
-            or self.fieldmap[y][x + 1] is not None
-            and self.fieldmap[y][x + 1].chr_no < _CHR_FLASH
-        ):
-            hit = True
-        # 直下
-        p = self.fieldmap[y][x]
-        if p is not None and p.chr_no < _CHR_FLASH:
-            hit = True
+        bit = 1 << y
 
-        if hit:
+        # 端まで行った or ひとつ先 or 直下
+        if x == (_FIELD_W - 1) or (self.solid[x + 1] | self.solid[x]) & bit:
             # 実際にパネルを置ける場所を探す
             for px in range(x, -1, -1):
-                if self.fieldmap[y][px] is None:
+                if not self.occ[px] & bit:
                     break
 
             self.set_new_panel(
@@ -1289,17 +1288,18 @@ class FieldMap:
         Params:
             x (int): X座標
         """
+        c = self.colors
+        base = x * _FIELD_H
         for i in range(_FIELD_H):
-            y = random.randint(0, _FIELD_H - 1)
-            self.fieldmap[i][x], self.fieldmap[y][x] = (
-                self.fieldmap[y][x],
-                self.fieldmap[i][x],
-            )
-        # Y座標決定
+            y = self.scene.random.randint(0, _FIELD_H - 1)
+            c[base + i], c[base + y] = c[base + y], c[base + i]
+        # 表示を更新
         for y in range(_FIELD_H):
-            p = self.fieldmap[y][x]
-            if p is not None:
-                p.y = y * _OBJ_BH
+            if c[base + y] == _COLOR_NONE:
+                self.layer.set_tile(x, y, gl.TILE_EMPTY)
+            else:
+                self.layer.set_tile(x, y, c[base + y] + _CHR_PANEL)
+        self.update_column(x)
 
     def get_panel_color(self, x):
         """パネルの色を取得
@@ -1308,12 +1308,12 @@ class FieldMap:
         Params:
             x (int): X座標
         """
+        m = self.occ[x]
         for y in range(_FIELD_H):
-            p = self.fieldmap[y][x]
-            if p is not None:
-                return p.chr_no - _CHR_PANEL
+            if m & (1 << y):
+                return self.colors[x * _FIELD_H + y]
         # 見つからない場合はグレー
-        return _CHR_PANELX - _CHR_PANEL
+        return _COLOR_GREY
 
     def clear_line(self, pos_x):
         """1列削除
@@ -1321,8 +1321,12 @@ class FieldMap:
         Params:
             pos_x (int): X座標
         """
-        for i in range(_FIELD_H):
-            self.fieldmap[i][pos_x] = None
+        i = pos_x * _FIELD_H
+        for y in range(_FIELD_H):
+            self.colors[i + y] = _COLOR_NONE
+        self.layer.clear_column(pos_x)
+        self.line_id[pos_x] = 0
+        self.update_column(pos_x)
 
     def check_line(self, x, shot_y):
         """1列そろったか
@@ -1331,31 +1335,37 @@ class FieldMap:
             x (int): X座標
             shot_y (int): ショットのY座標
         """
-        for y in range(_FIELD_H):
-            if self.fieldmap[y][x] is None:
-                return
+        if self.occ[x] != _COLUMN_FULL:
+            return
 
+        # グレー以外はフラッシュ色
+        base = x * _FIELD_H
+        grey = self.grey[x]
         for y in range(_FIELD_H):
-            p = self.fieldmap[y][x]
-            p.flash = True
-            if p.chr_no < _CHR_PANELX:
-                p.chr_no = _CHR_FLASH
+            if not grey & (1 << y):
+                self.colors[base + y] = _COLOR_FLASH
+            self.layer.set_tile(
+                x, y, self.colors[base + y] + _CHR_PANEL, gl.TILE_BLINK
+            )
+        self.flash[x] = _COLUMN_FULL
+        self.update_column(x)
 
         # ライン消去のイベント
-        self.stage.event.post(
-            [
-                _EV_DELETE_LINE,
-                gl.EV_PRIORITY_MID,
-                _DELETE_DELAY,
-                self,
-                self.fieldmap[0][x],
-            ]
-        )
+        line_id = self.next_line_id
+        self.next_line_id = line_id % 255 + 1
+        self.line_id[x] = line_id
+        if self.free_line_events:
+            e = self.free_line_events.pop()
+            e[2] = _DELETE_DELAY  # post() で処理フレームになっている
+            e[4] = line_id
+        else:
+            e = [_EV_DELETE_LINE, gl.EV_PRIORITY_MID, _DELETE_DELAY, self, line_id]
+        self.line_events.append(self.stage.event.post(e))
         # 一定時間停止
         self.scroll_wait += _SCROLL_STOP_TIME
 
         # スコア可算 グレーパネルは無効
-        if self.fieldmap[0][x].chr_no == _CHR_FLASH:
+        if not grey & 1:
             self.combo += 1
             if self.combo > 1:
                 combo_x = x * _OBJ_W + 22
@@ -1383,13 +1393,14 @@ class FieldMap:
             self.scene.update_deadtime_bar(self.combo * _DEADTIME_RECOVERY)
 
     def scroll_map(self):
-        """フィールドマップとスプライトの更新"""
-        for y in range(_FIELD_H):
-            for x in range(_FIELD_W - 1):
-                self.fieldmap[y][x] = self.fieldmap[y][x + 1]  # 1キャラクタ分スクロール
-                p = self.fieldmap[y][x]
-                if p is not None:
-                    p.base_x -= _OBJ_W  # ベース座標の更新
+        """フィールドマップを1列左へ
+        右端の列はそのまま残る（set_new_line で上書き）.
+        """
+        gl.move_items(self.colors, 0, _FIELD_H, (_FIELD_W - 1) * _FIELD_H)
+        self.layer.move_columns(0, 1, _FIELD_W - 1)
+        for a in self.columns:
+            gl.move_items(a, 0, 1, _FIELD_W - 1)
+        self.rows_dirty = True
 
     def check_over(self):
         """ゲームオーバー判定
@@ -1397,35 +1408,28 @@ class FieldMap:
         Returns:
             (bool): ゲームオーバーか
         """
-        for x in range(self.deadline, -1, -1):
-            for y in range(_FIELD_H):
-                if (
-                    self.fieldmap[y][x] is not None
-                    and self.fieldmap[y][x].chr_no < _CHR_FLASH
-                ):
-                    # イベント発行
-                    self.stage.event.post(
-                        [
-                            _EV_GAMEOVER,
-                            gl.EV_PRIORITY_HI,
-                            60,  # タイムラグ
-                            self,
-                            None,
-                        ]
-                    )
-                    # ゲームオーバー処理以外のリスナーをオフにする
-                    self.stage.event.disable_listners(
-                        None,
-                        [
-                            _EV_GAMEOVER,
-                            gl.EV_ANIME_ENTER_FRAME,
-                            gl.EV_ANIME_COMPLETE,
-                        ],
-                    )
-                    # シーンのフラグ
-                    self.scene.gameover = True
-                    return True
-        return False
+        m = 0
+        for x in range(self.deadline + 1):
+            m |= self.solid[x]
+        if m == 0:
+            return False
+
+        # イベント発行
+        self.stage.event.post_event(
+            _EV_GAMEOVER, gl.EV_PRIORITY_HI, 60, self, None  # 60: タイムラグ
+        )
+        # ゲームオーバー処理以外のリスナーをオフにする
+        self.stage.event.disable_listners(
+            None,
+            [
+                _EV_GAMEOVER,
+                gl.EV_ANIME_ENTER_FRAME,
+                gl.EV_ANIME_COMPLETE,
+            ],
+        )
+        # シーンのフラグ
+        self.scene.gameover = True
+        return True
 
     # イベントリスナー
     def ev_enter_frame(self, type, sender, option):
@@ -1444,7 +1448,7 @@ class FieldMap:
                     return
 
                 # スクロールできない
-                if self.existsPanels(0):
+                if self.occ[0]:
                     return
 
                 # マップを更新（スクロール）
@@ -1452,41 +1456,35 @@ class FieldMap:
                 # 新しいパネルをセット
                 self.set_new_line()
 
-        # パネルスプライトを更新
-        for y in range(_FIELD_H):
-            for x in range(_FIELD_W):
-                p = self.fieldmap[y][x]
-                if p is not None:
-                    p.x = p.base_x + self.scroll_offset
+        # 表示を更新
+        self.layer.scroll_x = self.scroll_offset
 
     def ev_delete_line(self, type, sender, option):
         """イベント:ライン消去"""
-        for pos in range(_FIELD_W):
-            p = self.fieldmap[0][pos]
-            if p is option:  # X座標を取得
-                chr_no = p.chr_no
+        for i in range(len(self.line_events)):
+            if self.line_events[i][4] == option:
+                self.free_line_events.append(self.line_events.pop(i))
                 break
 
-        # 1列削除
-        for y in range(_FIELD_H):
-            self.fieldmap[y][pos].leave()
-            self.fieldmap[y][pos] = None
-
-        # 詰める
-        for y in range(_FIELD_H):
-            for x in range(pos, 0, -1):
-                self.fieldmap[y][x] = self.fieldmap[y][x - 1]
-                p = self.fieldmap[y][x]
-                if p is not None:
-                    p.base_x += _OBJ_W
+        for pos in range(_FIELD_W):
+            if self.line_id[pos] == option:  # X座標を取得
+                break
+        grey = self.grey[pos]
 
-        # 先頭は空
+        # 1列削除して詰める 先頭は空
+        gl.move_items(self.colors, _FIELD_H, 0, pos * _FIELD_H)
+        self.layer.move_columns(1, 0, pos)
+        for a in self.columns:
+            gl.move_items(a, 1, 0, pos)
         for y in range(_FIELD_H):
-            if self.fieldmap[y][0] is not None:
-                self.fieldmap[y][0] = None
+            self.colors[y] = _COLOR_NONE
+        self.layer.clear_column(0)
+        self.line_id[0] = 0
+        self.flash[0] = 0
+        self.update_column(0)
 
         # コンボひとつ終了
-        if chr_no == _CHR_FLASH:
+        if not grey & 1:
             self.combo -= 1
 
     def ev_update_deadline(self, type, sender, option):
@@ -1498,55 +1496,61 @@ class FieldMap:
                 self.check_over()
 
 
-# インデックスカラースプライト
-chr_data = (
-    [
-        (dat.ship_0, 20, 20),  # 自機
-        (dat.ship_red, 20, 20),  # 自機 状態異常
-        (dat.ship_blue, 20, 20),  # 自機 状態異常
-        (dat.p_0, 20, 20),  # パネル
-        (dat.p_1, 20, 20),
-        (dat.p_2, 20, 20),
-        (dat.p_3, 20, 20),
-        (dat.p_4, 20, 20),
-        (dat.p_5, 20, 20),
-        (dat.p_x, 20, 20),  # グレーパネル
-        (dat.p_flash, 20, 20),  # フラッシュ
-        (dat.s_0, 20, 20),  # 弾
-        (dat.deadline, 4, 22),  # dead line
-        (dat.item_0, 20, 20),  # アイテム
-        (dat.item_1, 20, 20),
-        (dat.aim, 20, 20),  # 照準
-    ]
-)
-# イメージバッファ生成
-gl.create_image_buffers(dat.palette565, chr_data)
-
-# ビットマップスプライト
-bmp_data = (
-    [
-        (dat.title, 240, 70),
-        (dat.gameover, 152, 24),
-        (dat.hi, 24, 20),
-        (dat.score, 80, 20),
-        (dat.lines, 72, 20),
-        (dat.info_bright, 48, 24),
-        (dat.ready, 96, 24),
-        (dat.combo, 88, 20),
-        (dat.num_0, 16, 16),
-        (dat.num_1, 16, 16),
-        (dat.num_2, 16, 16),
-        (dat.num_3, 16, 16),
-        (dat.num_4, 16, 16),
-        (dat.num_5, 16, 16),
-        (dat.num_6, 16, 16),
-        (dat.num_7, 16, 16),
-        (dat.num_8, 16, 16),
-        (dat.num_9, 16, 16),
-        (dat.credit, 144, 10),
-        (dat.ex, 32, 14),
-    ]
-)
+# 画像の読み込み tools/assetc.py で作成したアセットファイル
+bmp_data = gl.load_assets(_ASSET_FILE)
+if bmp_data is None:
+    # アセットファイルがない時は gamedata から作成
+    import gamedata as dat
+
+    # インデックスカラースプライト
+    chr_data = (
+        [
+            (dat.ship_0, 20, 20),  # 自機
+            (dat.ship_red, 20, 20),  # 自機 状態異常
+            (dat.ship_blue, 20, 20),  # 自機 状態異常
+            (dat.p_0, 20, 20),  # パネル
+            (dat.p_1, 20, 20),
+            (dat.p_2, 20, 20),
+            (dat.p_3, 20, 20),
+            (dat.p_4, 20, 20),
+            (dat.p_5, 20, 20),
+            (dat.p_x, 20, 20),  # グレーパネル
+            (dat.p_flash, 20, 20),  # フラッシュ
+            (dat.s_0, 20, 20),  # 弾
+            (dat.deadline, 4, 22),  # dead line
+            (dat.item_0, 20, 20),  # アイテム
+            (dat.item_1, 20, 20),
+            (dat.aim, 20, 20),  # 照準
+        ]
+    )
+    # イメージバッファ生成
+    gl.create_image_buffers(dat.palette565, chr_data)
+
+    # ビットマップスプライト
+    bmp_data = (
+        [
+            (dat.title, 240, 70),
+            (dat.gameover, 152, 24),
+            (dat.hi, 24, 20),
+            (dat.score, 80, 20),
+            (dat.lines, 72, 20),
+            (dat.info_bright, 48, 24),
+            (dat.ready, 96, 24),
+            (dat.combo, 88, 20),
+            (dat.num_0, 16, 16),
+            (dat.num_1, 16, 16),
+            (dat.num_2, 16, 16),
+            (dat.num_3, 16, 16),
+            (dat.num_4, 16, 16),
+            (dat.num_5, 16, 16),
+            (dat.num_6, 16, 16),
+            (dat.num_7, 16, 16),
+            (dat.num_8, 16, 16),
+            (dat.num_9, 16, 16),
+            (dat.credit, 144, 10),
+            (dat.ex, 32, 14),
+        ]
+    )
 
 # ステータスをロード
 game_status = gl.load_status(_FILENAME)
@@ -1561,6 +1565,12 @@ gl.lcd.brightness(game_status["brightness"])
 
 # キー入力 シーン共通
 key_global = lcd.InputKey()
+# リプレイファイルがあれば記録したキー入力で実行
+game_seed = None
+key_replay = gl.KeyPlayer.load(_REPLAY_FILE)
+if key_replay is not None:
+    key_global = key_replay
+    game_seed = key_replay.seed
 
 # 各シーンの作成
 title = TitleScene("title", key_global)
@@ -1568,9 +1578,28 @@ main = MainScene("main", key_global)
 pause = PauseScene("pause", key_global)
 over = OverScene("over", key_global)
 scenes = [main, pause, over, title]
+# 乱数のシード リプレイ以外は毎回変わる
+main.random.seed(game_seed)
+game_seed = main.random.seed_value
+
+# プールは記録した使用数の大きさで作っておく
+gl.prewarm_pools(_POOL_FILE)
+
+# 処理時間の計測 プールが足りない時は例外にする
+if _PROFILE:
+    gl.start_profiler(dump_interval=gl.DEFAULT_FPS * 10, overlay=True)
+    gl.strict_pools = True
+if _LATENCY:
+    gl.start_latency_probe(lcd.KEY_B, dump_interval=20)
 
 # 描画スレッド
-# _thread.start_new_thread(gl.thread_send_buf_to_lcd, ())
+try:
+    gl.start_pipeline()
+except MemoryError:
+    pass  # メモリ不足の時は CORE0 で転送
+
+# GC はフレームの空き時間に
+gl.start_gc_manager()
 
 # ディレクターの作成
 director = gl.Director(scenes)
@@ -23,15 +23,17 @@ __author__ = "Choi Gyun 2022"
 
 import io
 import json
+import struct
 import utime
 import framebuf as buf
 import micropython
 import gc
 
-#import _thread
+import _thread
 from micropython import const
 
 import picolcd114 as lcd114
+import picopixel as pixel
 
 
 # 標準イベント
@@ -41,18 +43,80 @@ EV_ANIME_ENTER_FRAME = const("ev_anime_enter_frame")
 """毎フレーム（アニメ）"""
 EV_ANIME_COMPLETE = const("ev_anime_complete")
 """アニメ終了"""
+EV_COLLISION = const("ev_collision")
+"""当たり判定 sender と option が当たったスプライト（Collision）"""
 
 # イベント プライオリティ
 EV_PRIORITY_HI = const(10)
 EV_PRIORITY_MID = const(50)
 EV_PRIORITY_LOW = const(100)
 
+# タイル
+TILE_EMPTY = const(0xFF)
+"""タイルなし"""
+TILE_BLINK = const(0x01)
+"""タイル属性: 点滅"""
+TILE_HIDDEN = const(0x02)
+"""タイル属性: 非表示"""
+
+# ビットマップ
+BMP_RAW = const(0)
+"""ビットマップ形式: RGB565"""
+BMP_RLE = const(1)
+"""ビットマップ形式: ランレングス圧縮（picopixel.rle_encode）"""
+
 DEFAULT_FPS = const(30)
 """デフォルトFPS"""
+DEFAULT_CATCH_UP = const(4)
+"""処理が遅れた時に 1 回の描画でまとめて進めるフレーム数の上限"""
+
+_WHEEL_BITS = const(6)
+"""タイミングホイール 1段のバケツ数 2**6"""
+_WHEEL_SIZE = const(1 << _WHEEL_BITS)
+_WHEEL_MASK = const(_WHEEL_SIZE - 1)
+
+_EASE_TABLE_MAX = const(32)
+"""イージングの表のキャッシュ数"""
+
+_PROF_KEY = const(0)
+"""プロファイラ フェーズ: キースキャン"""
+_PROF_EVENT = const(1)
+"""プロファイラ フェーズ: イベント処理"""
+_PROF_ACTION = const(2)
+"""プロファイラ フェーズ: スプライトのアクション"""
+_PROF_DRAW = const(3)
+"""プロファイラ フェーズ: バッファに描画"""
+_PROF_SEND = const(4)
+"""プロファイラ フェーズ: 転送（待ちを含む）"""
+_PROF_PHASES = const(5)
+_PROF_BUCKET_US = const(2000)
+"""プロファイラ ヒストグラムの刻み 2ms"""
+_PROF_BUCKETS = const(25)
+"""プロファイラ ヒストグラムの数 最後は 48ms 以上"""
+
+_GC_COLLECT_BYTES = const(8 * 1024)
+"""GC: この量を確保したら空き時間に回収"""
+_GC_THRESHOLD_BYTES = const(32 * 1024)
+"""GC: この量を確保したら自動で回収（空き時間に回収できなかった時の保険）"""
+_GC_MARGIN_US = const(2000)
+"""GC: 回収にかかる時間の見積もりに足す余裕"""
+_GC_INTERVAL = const(DEFAULT_FPS * 10)
+"""GC: 確保量がわからない環境で回収する間隔（フレーム数）"""
+
+_DIRTY_MAX = const(16)
+"""差分描画 矩形の最大数（超えたら全画面描画）"""
+_DIRTY_AREA_MAX = const(lcd114.LCD_W * lcd114.LCD_H // 2)
+"""差分描画 この面積を超えたら全画面描画"""
 
 image_buffers = []
 """スプライトが参照するイメージバッファのリスト"""
 
+_NO_SPRITES = ()
+"""子スプライトのないスプライトで共有する空のリスト"""
+
+_pixel_geom = pixel.new_geometry(lcd114.LCD_W, lcd114.LCD_H)
+"""picopixel のカーネルに渡す位置と大きさ 毎回作らない"""
+
 bg_color = 0x0000
 """BGカラー"""
 trans_color = 0x618
@@ -61,8 +125,29 @@ trans_color = 0x618
 lcd = lcd114.LCD()
 """BGバッファ 全シーン共有"""
 
-#lock = _thread.allocate_lock()
-"""共有ロック"""
+pipeline = None
+"""LCD転送パイプライン start_pipeline() で開始"""
+
+lcd_owner = None
+"""最後に LCD バッファへ描画したステージ"""
+
+turbo = False
+"""ターボモード FPS の待ちと描画をしない set_turbo() で設定"""
+
+profiler = None
+"""フレームのプロファイラ start_profiler() で開始"""
+
+gc_manager = None
+"""GC の管理 start_gc_manager() で開始"""
+
+latency_probe = None
+"""キー入力から画面表示までの時間の計測 start_latency_probe() で開始"""
+
+sprite_pools = []
+"""作成したスプライトプール 使用数の記録用"""
+
+strict_pools = False
+"""プールが空の時に例外にする（プロファイル時にプールの大きさを確認する）"""
 
 
 def load_status(filename):
@@ -83,6 +168,20 @@ def save_status(d, filename):
         pass
 
 
+def set_turbo(on):
+    """ターボモードの切り替え
+    ターボモードではフレームを待たずに次のフレームを処理し, 描画と転送もしない.
+    リプレイを高速に実行するためのもの.
+
+    Params:
+        on (bool): ターボモードにするか
+    """
+    global turbo, lcd_owner
+    turbo = on
+    # 戻った時は全画面描画
+    lcd_owner = None
+
+
 def create_image_buffers(palette, index_images):
     """インデックスカラーのキャラデータ から RGB565 の描画用フレームバッファを作成
     LCDが小さいので縦横サイズは2倍にする.
@@ -105,6 +204,93 @@ def create_image_buffers(palette, index_images):
         image_buffers.append(buf565)
 
 
+def fit_rect(r, n, x0, y0, x1, y1):
+    """差分描画: 矩形に一部だけ掛かる再描画範囲を矩形を含むように広げる
+
+    Params:
+        r (list): 再描画範囲 [x, y, w, h, ...]
+        n (int): 再描画範囲の数
+        x0 (int): 矩形 左
+        y0 (int): 矩形 上
+        x1 (int): 矩形 右（含まない）
+        y1 (int): 矩形 下（含まない）
+
+    Returns:
+        (bool): 広げたか
+    """
+    changed = False
+    for j in range(n):
+        jx = j * 4
+        rx0 = r[jx]
+        ry0 = r[jx + 1]
+        rx1 = rx0 + r[jx + 2]
+        ry1 = ry0 + r[jx + 3]
+        if x0 < rx1 and rx0 < x1 and y0 < ry1 and ry0 < y1:
+            if x0 < rx0 or y0 < ry0 or x1 > rx1 or y1 > ry1:
+                rx0 = min(rx0, x0)
+                ry0 = min(ry0, y0)
+                r[jx] = rx0
+                r[jx + 1] = ry0
+                r[jx + 2] = max(rx1, x1) - rx0
+                r[jx + 3] = max(ry1, y1) - ry0
+                changed = True
+    return changed
+
+
+def move_items(a, dst, src, count):
+    """配列の要素を移動 範囲が重なってもよい
+    スライスを作らないのでヒープを使わない.
+
+    Params:
+        a (bytearray or list): 配列
+        dst (int): 移動先の位置
+        src (int): 移動元の位置
+        count (int): 要素数
+    """
+    if dst < src:
+        for i in range(count):
+            a[dst + i] = a[src + i]
+    else:
+        for i in range(count - 1, -1, -1):
+            a[dst + i] = a[src + i]
+
+
+def load_assets(filename):
+    """アセットファイル（tools/assetc.py で作成）を読み込む
+    インデックスカラーの画像は展開済みなので image_buffers にそのまま追加する.
+
+    Params:
+        filename (str): ファイル名
+
+    Returns:
+        (list): ビットマップ (bitmap, width, height, format) のリスト ファイルがない時は None
+    """
+    try:
+        f = io.open(filename, "rb")
+    except OSError:
+        return None
+
+    bitmaps = []
+    with f:
+        head = bytearray(8)
+        f.readinto(head)
+        if head[0:4] != b"GWA2":
+            return None
+        chr_num, bmp_num = struct.unpack_from("<HH", head, 4)
+        index = bytearray(14 * (chr_num + bmp_num))
+        f.readinto(index)
+        for i in range(chr_num + bmp_num):
+            w, h, fmt, offset, size = struct.unpack_from("<HHHII", index, i * 14)
+            data = bytearray(size)
+            f.seek(offset)
+            f.readinto(data)
+            if i < chr_num:
+                image_buffers.append(buf.FrameBuffer(data, w, h, buf.RGB565))
+            else:
+                bitmaps.append((data, w, h, fmt))
+    return bitmaps
+
+
 class Sprite:
     """スプライト
     表示キャラクタの基本単位.
@@ -131,12 +317,47 @@ class Sprite:
         frame_wait (int): アニメ用フレーム切り替えウェイト
         frame_wait_def (int): アニメ用フレーム切り替えウェイト デフォルト値
         owner (obj): スプライトの所有者
+        container (Sprite): 子として登録されている親 登録されていない時は None
+        drect (list): 差分描画用 前回の描画範囲 [0]:x [1]:y [2]:w [3]:h [4]:描画内容 [5]:フレーム
     """
 
+    # MicroPython では無視される（PC で実行する時のみインスタンスの dict がなくなる）
+    __slots__ = (
+        "parent",
+        "chr_no",
+        "name",
+        "x",
+        "y",
+        "z",
+        "w",
+        "h",
+        "visible",
+        "sprite_list",
+        "stage",
+        "scene",
+        "event",
+        "frame_max",
+        "frame_index",
+        "frame_wait",
+        "frame_wait_def",
+        "owner",
+        "container",
+        "flat_index",
+        "drect",
+    )
+
+    drawable = True
+    """自分自身を描画するか"""
+
     def __init__(self):
-        self.sprite_list = []  # 子スプライトのリスト
+        # 子スプライトのリスト 最初の子を追加した時に作る
+        self.sprite_list = _NO_SPRITES
+        self.parent = None
+        self.container = None
+        self.flat_index = -1  # Stage.flat の位置
         self.visible = False
         self.owner = None
+        self.drect = None
 
     def init_params(self, parent, chr_no, name, x, y, z, w, h):
         """パラメータを初期化
@@ -210,9 +431,98 @@ class Sprite:
                 sp.show(frame_buffer, x, y)
 
             # 現在のフレームを描画
-            frame_buffer.blit(
-                image_buffers[self.chr_no + self.frame_index], x, y, trans_color
-            )
+            self.draw(frame_buffer, x, y)
+
+    def draw(self, frame_buffer, x, y):
+        """自分自身のみフレームバッファに描画
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ(通常BG)
+            x (int): 絶対座標 X
+            y (int): 絶対座標 Y
+        """
+        frame_buffer.blit(
+            image_buffers[self.chr_no + self.frame_index], x, y, trans_color
+        )
+
+    def draw_clip(self, frame_buffer, x, y, rx, ry, rw, rh):
+        """再描画範囲に掛かる部分のみ描画
+        通常は全体を描画する（範囲は fit_dirty() で広げてある）.
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ(通常BG)
+            x (int): 絶対座標 X
+            y (int): 絶対座標 Y
+            rx (int): 再描画範囲 X
+            ry (int): 再描画範囲 Y
+            rw (int): 再描画範囲 幅
+            rh (int): 再描画範囲 高さ
+        """
+        self.draw(frame_buffer, x, y)
+
+    def check_dirty(self, stage, x, y):
+        """差分描画: 描画範囲と内容の変化をステージに通知
+
+        Params:
+            stage (Stage): ステージ
+            x (int): 絶対座標 X
+            y (int): 絶対座標 Y
+        """
+        self.track_dirty(stage, x, y, self.w, self.h, self.chr_no + self.frame_index)
+
+    def fit_dirty(self, r, n):
+        """差分描画: 一部だけ掛かる再描画範囲を描画範囲を含むように広げる
+        はみ出た部分を描画すると上に重なるスプライトを消してしまうため.
+
+        Params:
+            r (list): 再描画範囲 [x, y, w, h, ...]
+            n (int): 再描画範囲の数
+
+        Returns:
+            (bool): 広げたか
+        """
+        d = self.drect
+        # 画面内にクリップ
+        x0 = max(d[0], 0)
+        y0 = max(d[1], 0)
+        x1 = min(d[0] + d[2], lcd114.LCD_W)
+        y1 = min(d[1] + d[3], lcd114.LCD_H)
+        if x0 >= x1 or y0 >= y1:
+            return False
+        return fit_rect(r, n, x0, y0, x1, y1)
+
+    def track_dirty(self, stage, x, y, w, h, sig):
+        """差分描画: 前回の描画範囲と比較して変化があれば再描画領域に追加
+
+        Params:
+            stage (Stage): ステージ
+            x (int): 描画範囲 X（絶対座標）
+            y (int): 描画範囲 Y（絶対座標）
+            w (int): 描画範囲 幅
+            h (int): 描画範囲 高さ
+            sig (obj): 描画内容 変化したら再描画
+        """
+        d = self.drect
+        if d is None:
+            d = self.drect = [x, y, w, h, sig, -1]
+
+        if d[5] != stage.stamp - 1:
+            # 前回は非表示 新しい範囲のみ
+            stage.add_dirty(x, y, w, h)
+        elif d[0] != x or d[1] != y or d[2] != w or d[3] != h or d[4] != sig:
+            # 前回の範囲と新しい範囲
+            stage.add_dirty(d[0], d[1], d[2], d[3])
+            stage.add_dirty(x, y, w, h)
+        else:
+            d[5] = stage.stamp
+            return
+
+        d[0] = x
+        d[1] = y
+        d[2] = w
+        d[3] = h
+        d[4] = sig
+        d[5] = stage.stamp
 
     def action(self):
         """フレーム毎のアクション"""
@@ -237,10 +547,10 @@ class Sprite:
             bool: 当たっているか
         """
         # 絶対座標を取得
-        px = self.parent_x()
-        py = self.parent_y()
-        sx = sp.parent_x()
-        sy = sp.parent_y()
+        px = self.abs_x()
+        py = self.abs_y()
+        sx = sp.abs_x()
+        sy = sp.abs_y()
 
         if (
             px <= sx + sp.w
@@ -256,43 +566,113 @@ class Sprite:
         """スプライト追加
         z順になるように.
         すでにあったら追加しない.
+        ステージがバッチ中の時は Stage.commit() で追加する.
 
         Params:
             sp (Sprite): スプライト
         """
-        if self.sprite_list == 0:
-            self.sprite_list.append(sp)
+        if sp.container is self:
             return
+        sp.container = self
+        stage = self.stage
+        if stage is not None and stage.batch:
+            stage.defer(self, sp, True)
+        else:
+            self.insert_sprite(sp)
 
-        for s in self.sprite_list:
-            if s is sp:
-                return
+    def insert_sprite(self, sp):
+        """スプライトリストに挿入
+        z昇順・同じ z は後ろに追加. 挿入位置は二分探索.
 
-        # z昇順・新規は後ろに追加
-        for i, s in enumerate(self.sprite_list):
-            if sp.z < s.z:
-                # 挿入
-                self.sprite_list.insert(i, sp)
-                return
+        Params:
+            sp (Sprite): スプライト
+        """
+        lst = self.sprite_list
+        if lst is _NO_SPRITES:
+            lst = self.sprite_list = []
+        z = sp.z
+        lo = 0
+        hi = len(lst)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if z < lst[mid].z:
+                hi = mid
+            else:
+                lo = mid + 1
+        lst.insert(lo, sp)
+        self.__changed()
+
+    def index_sprite(self, sp):
+        """スプライトリストの位置
+        同じ z の範囲を後ろから探す. 見つからない時は全体を探す（追加後に z を変えた時）.
 
-        self.sprite_list.append(sp)
+        Params:
+            sp (Sprite): スプライト
+
+        Returns:
+            (int): インデックス ない時は -1
+        """
+        lst = self.sprite_list
+        z = sp.z
+        lo = 0
+        hi = len(lst)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if z < lst[mid].z:
+                hi = mid
+            else:
+                lo = mid + 1
+        i = lo - 1
+        while i >= 0 and lst[i].z == z:
+            if lst[i] is sp:
+                return i
+            i -= 1
+        for i in range(len(lst) - 1, -1, -1):
+            if lst[i] is sp:
+                return i
+        return -1
+
+    def __changed(self):
+        """子スプライトの構成が変わったことをステージに通知"""
+        stage = self.stage
+        if stage is not None:
+            stage.tree_changed = True
 
     def remove_sprite(self, sp):
         """スプライト削除
         親から切り離す
+        ステージがバッチ中の時は Stage.commit() で削除する.
 
         Params:
             sp (Sprite): スプライト
         """
-        for i in range(len(self.sprite_list) - 1, -1, -1):
-            if self.sprite_list[i] is sp:
-                del self.sprite_list[i]
-                sp.parent = None
-                sp.stage = None
-                sp.scene = None
-                sp.event = None
-                sp.visible = False
-                return
+        if sp.container is not self:
+            return
+        sp.container = None
+        stage = self.stage
+        if stage is not None and stage.batch:
+            stage.defer(self, sp, False)
+        else:
+            self.delete_sprite(sp)
+
+    def delete_sprite(self, sp):
+        """スプライトリストから削除して切り離す
+        他の親に追加済み（バッチ中に付け替えた）の時は切り離さない.
+
+        Params:
+            sp (Sprite): スプライト
+        """
+        i = self.index_sprite(sp)
+        if i < 0:
+            return
+        del self.sprite_list[i]
+        self.__changed()
+        if sp.container is None:
+            sp.parent = None
+            sp.stage = None
+            sp.scene = None
+            sp.event = None
+            sp.visible = False
 
     def enter(self):
         """入場
@@ -316,20 +696,20 @@ class Sprite:
             self.parent.remove_sprite(self)
 
         # プールに返却
-        if self.owner is SpritePool:
-            self.owner.pool.return_instance(self)
+        if isinstance(self.owner, SpritePool):
+            self.owner.return_instance(self)
 
     def abs_x(self):
         """絶対座標 X"""
-        if self.parent == None:
+        if self.parent is None:
             return self.x
-        return self.x + self.abs_x()
+        return self.x + self.parent.abs_x()
 
     def abs_y(self):
         """絶対座標 Y"""
-        if self.parent == None:
+        if self.parent is None:
             return self.y
-        return self.y + self.abs_y()
+        return self.y + self.parent.abs_y()
 
 
 class SpriteContainer(Sprite):
@@ -337,6 +717,10 @@ class SpriteContainer(Sprite):
     子スプライトのみ描画.
     """
 
+    __slots__ = ()
+
+    drawable = False
+
     def __init__(self):
         super().__init__()
 
@@ -369,29 +753,30 @@ class SpriteContainer(Sprite):
 
 
 class BitmapSprite(Sprite):
-    """ビットマップを直接描画するスプライト（低速）
+    """ビットマップを直接描画するスプライト
     インデックスと同じく２倍にして表示.
     大きな画像はメモリ不足になるのでこちらを使用.
     width は 4 で割り切れること.
+    ランレングス圧縮（BMP_RLE）の画像は展開しながら描画する.
 
     Params:
-        bitmap (taple): bitmap, width, height
+        bitmap (taple): bitmap, width, height, format（省略時は BMP_RAW）
     """
 
+    __slots__ = ("bmp_src", "bmp_format")
+
     def __init__(self, parent, bitmap, name, x, y, z, w, h):
         super().__init__()
         self.init_params(parent, 0, name, x, y, z, w, h)
         self.set_bitmap(bitmap)
-        self.lcd_w = lcd114.LCD_W * 2
 
     def set_bitmap(self, bitmap):
         """ビットマップ画像をセット"""
-        self.bmp = memoryview(bitmap[0])
+        self.bmp_src = bitmap[0]
         self.w = bitmap[1]
         self.h = bitmap[2]
-        self.w2 = self.w * 2
+        self.bmp_format = bitmap[3] if len(bitmap) > 3 else BMP_RAW
 
-    @micropython.native
     def show(self, frame_buffer, x, y):
         """フレームバッファに描画
         自分自身のみ描画.
@@ -401,47 +786,30 @@ class BitmapSprite(Sprite):
             y (int): 親のY座標
         """
         if self.visible:
-            x += self.x
-            y += self.y
+            self.draw(frame_buffer, x + self.x, y + self.y)
+
+    def check_dirty(self, stage, x, y):
+        """差分描画: 描画範囲と内容の変化をステージに通知"""
+        self.track_dirty(stage, x, y, self.w, self.h, self.bmp_src)
 
-            buf = memoryview(frame_buffer.buf)
-            bmp = self.bmp
-            w = self.w
-            w2 = self.w2
-            h = self.h
-            lcd_w = self.lcd_w
-            start = x * 2 + y * lcd_w
-
-            idx = 0
-            for dy in range(0, h, 2):
-                pos1 = dy * lcd_w + start
-                pos2 = pos1 + lcd_w
-                for dx in range(0, w2, 8):
-                    pos_x1 = pos1 + dx
-                    pos_x2 = pos2 + dx
-
-                    c1 = bmp[idx]
-                    c2 = bmp[idx + 1]
-                    buf[pos_x1] = c1
-                    buf[pos_x1 + 1] = c2
-                    buf[pos_x1 + 2] = c1
-                    buf[pos_x1 + 3] = c2
-                    buf[pos_x2] = c1
-                    buf[pos_x2 + 1] = c2
-                    buf[pos_x2 + 2] = c1
-                    buf[pos_x2 + 3] = c2
-
-                    c1 = bmp[idx + 2]
-                    c2 = bmp[idx + 3]
-                    buf[pos_x1 + 4] = c1
-                    buf[pos_x1 + 5] = c2
-                    buf[pos_x1 + 6] = c1
-                    buf[pos_x1 + 7] = c2
-                    buf[pos_x2 + 4] = c1
-                    buf[pos_x2 + 5] = c2
-                    buf[pos_x2 + 6] = c1
-                    buf[pos_x2 + 7] = c2
-                    idx += 4
+    def draw(self, frame_buffer, x, y):
+        """自分自身のみフレームバッファに描画
+        画面外にはみ出る部分はクリップ.
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ(通常BG)
+            x (int): 絶対座標 X
+            y (int): 絶対座標 Y
+        """
+        g = _pixel_geom
+        g[pixel.GEOM_W] = self.w
+        g[pixel.GEOM_H] = self.h
+        g[pixel.GEOM_X] = x
+        g[pixel.GEOM_Y] = y
+        if self.bmp_format == BMP_RLE:
+            pixel.rle2x(frame_buffer.buf, self.bmp_src, g)
+        else:
+            pixel.scale2x(frame_buffer.buf, self.bmp_src, g)
 
 
 class ShapeSprite(SpriteContainer):
@@ -452,6 +820,10 @@ class ShapeSprite(SpriteContainer):
         shape (list): 図形データ 0:mode(LINE|HLINE|VLINE|RECT|RECTF) 1:x1 2:y1 3:x2 4:y2 5:color
     """
 
+    __slots__ = ("shape",)
+
+    drawable = True
+
     def __init__(self, parent, shape, name, z):
         super().__init__()
         self.init_params(parent, name, shape[2], shape[3], z)
@@ -460,80 +832,522 @@ class ShapeSprite(SpriteContainer):
     def show(self, frame_buffer, x, y):
         """フレームバッファに図形を描画"""
         if self.visible:
-            x += self.x
-            y += self.y
-            shape = self.shape
-            m = shape[0]
-
-            if m == "LINE":
-                frame_buffer.line(shape[1], shape[2], shape[3], shape[4], shape[5])
-            elif m == "HLINE":
-                frame_buffer.hline(shape[1], shape[2], shape[3] - shape[1], shape[5])
-            elif m == "VLINE":
-                frame_buffer.vline(shape[1], shape[2], shape[4] - shape[2], shape[5])
-            elif m == "RECT":
-                frame_buffer.rect(shape[1], shape[2], shape[3], shape[4], shape[5])
-            elif m == "RECTF":
-                frame_buffer.rect(
-                    shape[1], shape[2], shape[3], shape[4], shape[5], True
-                )
+            self.draw(frame_buffer, x + self.x, y + self.y)
+
+    def draw(self, frame_buffer, x, y):
+        """フレームバッファに図形を描画
+        図形データの座標をそのまま使う.
+        """
+        shape = self.shape
+        m = shape[0]
+
+        if m == "LINE":
+            frame_buffer.line(shape[1], shape[2], shape[3], shape[4], shape[5])
+        elif m == "HLINE":
+            frame_buffer.hline(shape[1], shape[2], shape[3] - shape[1], shape[5])
+        elif m == "VLINE":
+            frame_buffer.vline(shape[1], shape[2], shape[4] - shape[2], shape[5])
+        elif m == "RECT":
+            frame_buffer.rect(shape[1], shape[2], shape[3], shape[4], shape[5])
+        elif m == "RECTF":
+            frame_buffer.rect(
+                shape[1], shape[2], shape[3], shape[4], shape[5], True
+            )
+
+    def check_dirty(self, stage, x, y):
+        """差分描画: 図形の範囲と色の変化をステージに通知"""
+        shape = self.shape
+        m = shape[0]
+        x1 = shape[1]
+        y1 = shape[2]
+
+        if m == "LINE":
+            x2 = shape[3]
+            y2 = shape[4]
+            if x2 < x1:
+                x1, x2 = x2, x1
+            if y2 < y1:
+                y1, y2 = y2, y1
+            w = x2 - x1 + 1
+            h = y2 - y1 + 1
+        elif m == "HLINE":
+            w = shape[3] - x1
+            h = 1
+        elif m == "VLINE":
+            w = 1
+            h = shape[4] - y1
+        else:
+            w = shape[3]
+            h = shape[4]
+
+        self.track_dirty(stage, x1, y1, w, h, shape[5])
+
+
+class TileLayer(Sprite):
+    """タイルマップを描画するスプライト
+    グリッド全体をひとつのスプライトで描画する.
+    タイルは image_buffers の番号. 列優先で並ぶ（index = col * rows + row）.
+    差分描画では変化したタイルのみ再描画する.
+
+    Params:
+        parent (Sprite): 親のスプライト
+        name (str or int): キャラクタ識別の名前
+        x (int): X座標（親からの相対座標）
+        y (int): Y座標（親からの相対座標）
+        z (int): Z座標
+        cols (int): 列数
+        rows (int): 行数
+        cell_w (int): セルの幅
+        cell_h (int): セルの高さ
+        tile_w (int): タイル画像の幅
+        tile_h (int): タイル画像の高さ
+
+    Attributes:
+        tiles (bytearray): タイル TILE_EMPTY は空
+        flags (bytearray): タイル属性 TILE_BLINK | TILE_HIDDEN
+        timers (bytearray): 点滅用のカウンタ
+        scroll_x (int): 横スクロール
+        blink_interval (int): 点滅の間隔
+        version (int): タイルが変化したら更新
+    """
+
+    __slots__ = (
+        "cols",
+        "rows",
+        "cell_w",
+        "cell_h",
+        "tile_w",
+        "tile_h",
+        "tiles",
+        "flags",
+        "timers",
+        "scroll_x",
+        "blink_interval",
+        "blink_count",
+        "version",
+        "shown",
+        "shown_version",
+        "shown_x",
+        "shown_y",
+    )
+
+    def __init__(
+        self, parent, name, x, y, z, cols, rows, cell_w, cell_h, tile_w, tile_h
+    ):
+        super().__init__()
+        self.init_params(parent, 0, name, x, y, z, cols * cell_w, rows * cell_h)
+        self.cols = cols
+        self.rows = rows
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+        self.tile_w = tile_w
+        self.tile_h = tile_h
+
+        n = cols * rows
+        self.tiles = bytearray(b"\xff" * n)
+        self.flags = bytearray(n)
+        self.timers = bytearray(n)
+        self.scroll_x = 0
+        self.blink_interval = 4
+        self.blink_count = 0  # 点滅中のタイル数
+        self.version = 0
+
+        # 差分描画 前回表示したタイル
+        self.shown = bytearray(b"\xff" * n)
+        self.shown_version = -1
+        self.shown_x = 0
+        self.shown_y = 0
+
+    def set_tile(self, col, row, tile, flags=0):
+        """タイルをセット
+
+        Params:
+            col (int): 列
+            row (int): 行
+            tile (int): 画像No TILE_EMPTY で消去
+            flags (int): タイル属性
+        """
+        i = col * self.rows + row
+        if self.flags[i] & TILE_BLINK:
+            self.blink_count -= 1
+        if flags & TILE_BLINK:
+            self.blink_count += 1
+        self.tiles[i] = tile
+        self.flags[i] = flags
+        self.timers[i] = 0
+        self.version += 1
+
+    def blink(self, col, row):
+        """タイルを点滅させる
+
+        Params:
+            col (int): 列
+            row (int): 行
+        """
+        i = col * self.rows + row
+        if not self.flags[i] & TILE_BLINK:
+            self.blink_count += 1
+        self.flags[i] |= TILE_BLINK
+        self.timers[i] = 0
+
+    def clear(self):
+        """全てのタイルを消去"""
+        for i in range(self.cols * self.rows):
+            self.tiles[i] = TILE_EMPTY
+            self.flags[i] = 0
+        self.blink_count = 0
+        self.version += 1
+
+    def clear_column(self, col):
+        """1列消去
+
+        Params:
+            col (int): 列
+        """
+        for row in range(self.rows):
+            self.set_tile(col, row, TILE_EMPTY)
+
+    def move_columns(self, dst, src, count):
+        """列をまとめて移動 移動元は残る
+        点滅の状態も移動する.
+
+        Params:
+            dst (int): 移動先の列
+            src (int): 移動元の列
+            count (int): 列数
+        """
+        rows = self.rows
+        # 上書きされる点滅中のタイル
+        for i in range(dst * rows, (dst + count) * rows):
+            if self.flags[i] & TILE_BLINK:
+                self.blink_count -= 1
+        for i in range(src * rows, (src + count) * rows):
+            if self.flags[i] & TILE_BLINK:
+                self.blink_count += 1
+
+        d = dst * rows
+        a = src * rows
+        n = count * rows
+        move_items(self.tiles, d, a, n)
+        move_items(self.flags, d, a, n)
+        move_items(self.timers, d, a, n)
+        self.version += 1
+
+    def action(self):
+        """フレーム毎のアクション 点滅"""
+        super().action()
+        if self.blink_count == 0:
+            return
+        flags = self.flags
+        timers = self.timers
+        interval = self.blink_interval
+        for i in range(self.cols * self.rows):
+            if flags[i] & TILE_BLINK:
+                t = timers[i] + 1
+                if t == interval:
+                    t = 0
+                    flags[i] ^= TILE_HIDDEN
+                    self.version += 1
+                timers[i] = t
+
+    def show(self, frame_buffer, x, y):
+        """フレームバッファに描画
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ(通常BG)
+            x (int): 親のX座標
+            y (int): 親のY座標
+        """
+        if self.visible:
+            self.shown_x = x + self.x + self.scroll_x
+            self.shown_y = y + self.y
+            self.draw_clip(
+                frame_buffer, 0, 0, 0, 0, lcd114.LCD_W, lcd114.LCD_H
+            )
+
+    def draw(self, frame_buffer, x, y):
+        """全てのタイルを描画
+        座標は check_dirty() または show() で決めたものを使う.
+        """
+        self.draw_clip(frame_buffer, x, y, 0, 0, lcd114.LCD_W, lcd114.LCD_H)
+
+    def draw_clip(self, frame_buffer, x, y, rx, ry, rw, rh):
+        """再描画範囲に掛かるタイルのみ描画"""
+        ox = self.shown_x
+        oy = self.shown_y
+        cw = self.cell_w
+        ch = self.cell_h
+        rows = self.rows
+        c0 = max((rx - ox) // cw, 0)
+        c1 = min((rx + rw - 1 - ox) // cw, self.cols - 1)
+        r0 = max((ry - oy) // ch, 0)
+        r1 = min((ry + rh - 1 - oy) // ch, rows - 1)
+        tw = self.tile_w
+        th = self.tile_h
+        tiles = self.tiles
+        flags = self.flags
+        for c in range(c0, c1 + 1):
+            i = c * rows
+            px = ox + c * cw
+            if px + tw <= rx:  # セルの隙間だけ掛かっている
+                continue
+            for r in range(r0, r1 + 1):
+                py = oy + r * ch
+                if py + th <= ry:
+                    continue
+                t = tiles[i + r]
+                if t != TILE_EMPTY and not flags[i + r] & TILE_HIDDEN:
+                    frame_buffer.blit(image_buffers[t], px, py, trans_color)
+
+    def check_dirty(self, stage, x, y):
+        """差分描画: 変化したタイルの範囲をステージに通知
+        移動した時はタイルのある範囲全体.
+        """
+        x += self.scroll_x
+        d = self.drect
+        moved = (
+            d is None
+            or d[5] != stage.stamp - 1
+            or x != self.shown_x
+            or y != self.shown_y
+        )
+        if not moved and self.version == self.shown_version:
+            d[5] = stage.stamp
+            return
+
+        self.shown_x = x
+        self.shown_y = y
+        self.shown_version = self.version
+        cols = self.cols
+        rows = self.rows
+        cw = self.cell_w
+        ch = self.cell_h
+        tiles = self.tiles
+        flags = self.flags
+        shown = self.shown
+        c0 = cols
+        c1 = -1
+        for c in range(cols):
+            i = c * rows
+            for r in range(rows):
+                t = tiles[i + r]
+                if flags[i + r] & TILE_HIDDEN:
+                    t = TILE_EMPTY
+                if t != TILE_EMPTY:
+                    if c < c0:
+                        c0 = c
+                    c1 = c
+                if t != shown[i + r]:
+                    shown[i + r] = t
+                    if not moved:
+                        stage.add_dirty(
+                            x + c * cw, y + r * ch, self.tile_w, self.tile_h
+                        )
+
+        # タイルのある範囲
+        if c1 < 0:
+            bx = x
+            bw = 0
+        else:
+            bx = x + c0 * cw
+            bw = (c1 - c0 + 1) * cw
+        if moved:
+            self.track_dirty(stage, bx, y, bw, rows * ch, None)
+        else:
+            d[0] = bx
+            d[2] = bw
+            d[5] = stage.stamp
+
+    def fit_dirty(self, r, n):
+        """差分描画: 一部だけ掛かる再描画範囲をタイル単位で広げる"""
+        ox = self.shown_x
+        oy = self.shown_y
+        cw = self.cell_w
+        ch = self.cell_h
+        rows = self.rows
+        shown = self.shown
+        changed = False
+        for j in range(n):
+            jx = j * 4
+            rx = r[jx]
+            ry = r[jx + 1]
+            c0 = max((rx - ox) // cw, 0)
+            c1 = min((rx + r[jx + 2] - 1 - ox) // cw, self.cols - 1)
+            r0 = max((ry - oy) // ch, 0)
+            r1 = min((ry + r[jx + 3] - 1 - oy) // ch, rows - 1)
+            for c in range(c0, c1 + 1):
+                i = c * rows
+                x0 = ox + c * cw
+                x1 = min(x0 + self.tile_w, lcd114.LCD_W)
+                x0 = max(x0, 0)
+                for row in range(r0, r1 + 1):
+                    if shown[i + row] == TILE_EMPTY:
+                        continue
+                    y0 = oy + row * ch
+                    y1 = min(y0 + self.tile_h, lcd114.LCD_H)
+                    y0 = max(y0, 0)
+                    if x0 < x1 and y0 < y1 and fit_rect(r, n, x0, y0, x1, y1):
+                        changed = True
+        return changed
 
 
 class SpritePool:
     """スプライトプール
     スプライトを直接生成しないでプールから取得.
-    使用後は返却.
+    使用後は返却（Sprite.leave() で返却される）.
+
+    使用数を記録するので, save_pool_stats() で保存して
+    次回は prewarm_pools() で使用数の最大に合わせた大きさで作成できる.
+    strict_pools が True の時はプールが空だと例外にする.
 
     Params:
         stage (Stage): 所属するステージ
         cls (): クラス
         size (int): プールのサイズ
+        name (str): 記録用の名前 省略時はクラス名
 
     Attributes:
-        name (str): クラス
+        name (str): 記録用の名前
         size (int): プールのサイズ
         pool (list): スプライトのリスト
+        in_use (int): 使用中の数
+        high (int): 使用中の数の最大
+        gets (int): 取得した回数
+        misses (int): プールが空で新規作成した回数
+        returns (int): 返却された回数
+        drops (int): サイズを超えて捨てた回数
     """
 
-    def __init__(self, stage, clz, size=32):
+    def __init__(self, stage, clz, size=32, name=None):
         self.stage = stage
         self.size = size
         self.clz = clz
+        self.name = name if name is not None else clz.__name__
         self.pool = []
+        self.reset_stats()
         # プール作成
         for _ in range(size):
-            sp = clz()
-            sp.parent = None
-            sp.stage = stage
-            sp.scene = stage.scene
-            sp.event = stage.event
-            sp.owner = self
-            self.pool.append(sp)
+            self.pool.append(self.__create())
+        sprite_pools.append(self)
+
+    def __create(self):
+        """インスタンスを作成"""
+        sp = self.clz()
+        sp.parent = None
+        sp.stage = self.stage
+        sp.scene = self.stage.scene
+        sp.event = self.stage.event
+        sp.owner = self
+        return sp
+
+    def reset_stats(self):
+        """記録をクリア"""
+        self.in_use = 0
+        self.high = 0
+        self.gets = 0
+        self.misses = 0
+        self.returns = 0
+        self.drops = 0
+
+    def prewarm(self, size):
+        """プールのサイズを変更 インスタンスを作成しておく
+
+        Params:
+            size (int): プールのサイズ
+        """
+        self.size = size
+        while len(self.pool) < size:
+            self.pool.append(self.__create())
+        while len(self.pool) > size:
+            self.pool.pop()
 
     def get_instance(self):
         """インスタンスを取得"""
+        self.gets += 1
+        self.in_use += 1
+        if self.in_use > self.high:
+            self.high = self.in_use
         if len(self.pool) == 0:
-            o = self.clz()  # プールが空の時は新規作成
-            o.parent = None
-            o.stage = self.stage
-            o.scene = self.stage.scene
-            o.event = self.stage.event
-            o.owner = self
-            return o
-        else:
-            o = self.pool.pop()
-            o.parent = None
-            o.stage = self.stage
-            o.scene = self.stage.scene
-            o.event = self.stage.event
-            return o
+            # プールが空の時は新規作成
+            self.misses += 1
+            if strict_pools:
+                raise RuntimeError("SpritePool %s is empty" % self.name)
+            return self.__create()
+        o = self.pool.pop()
+        o.parent = None
+        o.stage = self.stage
+        o.scene = self.stage.scene
+        o.event = self.stage.event
+        return o
 
     def return_instance(self, sp):
         """インスタンスを返却
-        設定したサイズを超えたら捨てる
+        設定したサイズを超えたら捨てる. 返却済みのものは無視.
         """
+        for o in self.pool:
+            if o is sp:
+                return
+        self.returns += 1
+        if self.in_use > 0:
+            self.in_use -= 1
         if len(self.pool) < self.size:
             self.pool.append(sp)
+        else:
+            self.drops += 1
+
+    def dump(self):
+        """記録をシリアルに表示"""
+        print(
+            "pool %s size %d high %d gets %d misses %d returns %d drops %d"
+            % (
+                self.name,
+                self.size,
+                self.high,
+                self.gets,
+                self.misses,
+                self.returns,
+                self.drops,
+            )
+        )
+
+
+def save_pool_stats(filename):
+    """プールの使用数の最大を保存
+    前回までの記録より大きい時のみ更新.
+
+    Params:
+        filename (str): ファイル名
+    """
+    d = load_status(filename)
+    if d is None:
+        d = {}
+    changed = False
+    for p in sprite_pools:
+        if p.high > d.get(p.name, 0):
+            d[p.name] = p.high
+            changed = True
+    if changed:
+        save_status(d, filename)
+
+
+def prewarm_pools(filename):
+    """保存した使用数の最大に合わせてプールのサイズを変更
+
+    Params:
+        filename (str): save_pool_stats() で保存したファイル名
+    """
+    d = load_status(filename)
+    if d is None:
+        return
+    for p in sprite_pools:
+        if p.name in d:
+            p.prewarm(d[p.name])
+
+
+def dump_pools():
+    """全てのプールの記録をシリアルに表示"""
+    for p in sprite_pools:
+        p.dump()
 
 
 class Stage(Sprite):
@@ -542,15 +1356,97 @@ class Stage(Sprite):
     スプライトのルートオブジェクト.
     ルートなので parent は None となる.
 
+    差分描画モードでは前フレームから変化した範囲のみ BG クリアと再描画を行い,
+    LCD へもその範囲のみ転送する.
+    スプライトの木は平らなリストにして持ち, 子スプライトの構成が変わった時のみ作り直す.
+    毎フレームの描画はこのリストを先頭から処理する（再帰しない）.
+
+    batch を True にすると, ステージ上のスプライトの追加・削除は記録だけして
+    commit() でまとめて行う. Scene はフレームの終わりと描画の前に commit() する.
+
     Attributes:
         scene (Scene): シーン
         event (EventManager): イベント管理
+        dirty_rect (bool): 差分描画モード
+        full_redraw (bool): 次回は全画面描画
+        stamp (int): 描画したフレーム数
+        dirty_rects (list): 再描画した矩形 [x, y, w, h, ...] 全画面の時は None
+        dirty_count (int): 再描画した矩形の数
+        tree_changed (bool): 子スプライトの構成が変わった 次の描画で作り直す
+        batch (bool): 追加・削除を commit() までまとめる
+        pending (list): まとめている追加・削除 [親, スプライト, 追加か, ...]
+        flat (list): スプライト 親が子より前（[0] はステージ）
+        flat_parent (list): 親の flat のインデックス
+        flat_x (list): 絶対座標 X update_transforms() で更新
+        flat_y (list): 絶対座標 Y
+        flat_visible (bytearray): 親も含めて表示しているか
+        order (list): 描画順の flat のインデックス 描画するスプライトのみ
+        collision (Collision): 当たり判定 action() の後に判定する
     """
 
-    def __init__(self, scene, event, name, x, y, z, w, h):
+    __slots__ = (
+        "dirty_rect",
+        "full_redraw",
+        "stamp",
+        "draw_list",
+        "draw_count",
+        "prev_list",
+        "prev_count",
+        "rects",
+        "dirty_rects",
+        "dirty_count",
+        "tree_changed",
+        "flat",
+        "flat_parent",
+        "flat_x",
+        "flat_y",
+        "flat_visible",
+        "flat_count",
+        "order",
+        "order_count",
+        "batch",
+        "pending",
+        "pending_count",
+        "collision",
+    )
+
+    drawable = False
+
+    def __init__(self, scene, event, name, x, y, z, w, h, dirty_rect=False):
         super().__init__()
         self.init_params(scene, event, name, x, y, z, w, h)
 
+        # 差分描画
+        self.dirty_rect = dirty_rect
+        self.full_redraw = True
+        self.stamp = 0
+        self.draw_list = []  # 今回描画したスプライト
+        self.draw_count = 0
+        self.prev_list = []  # 前回描画したスプライト
+        self.prev_count = 0
+        self.rects = [0] * (_DIRTY_MAX * 4)
+        self.dirty_rects = None
+        self.dirty_count = 0
+
+        # 平らにしたスプライトの木
+        self.tree_changed = True
+        self.flat = [self]
+        self.flat_parent = [0]
+        self.flat_x = [0]  # 絶対座標
+        self.flat_y = [0]
+        self.flat_visible = bytearray(1)  # 親も含めて表示するか
+        self.flat_count = 1
+        self.order = []
+        self.order_count = 0
+
+        # 追加・削除のバッチ
+        self.batch = False
+        self.pending = []
+        self.pending_count = 0
+
+        # 当たり判定
+        self.collision = None
+
     def init_params(self, scene, event, name, x, y, z, w, h):
         """パラメータをセット
 
@@ -573,25 +1469,590 @@ class Stage(Sprite):
         self.scene = scene
         return self
 
+    def enter(self):
+        """入場
+        最初のフレームは全画面描画.
+        """
+        self.full_redraw = True
+        return super().enter()
+
     def action(self):
-        """スプライトのアクションを実行"""
+        """スプライトのアクションを実行
+        当たり判定があれば動いた後の位置で判定.
+        """
         if self.visible:
             for s in self.sprite_list:
                 s.action()
+            if self.collision is not None:
+                self.collision.update()
 
     def show(self):
         """ステージを更新
         ・スプライトをバッファに描画
         """
-        # BGバッファ クリア
-        lcd.fill(bg_color)
-        # 子スプライトをバッファに描画
-        for s in self.sprite_list:
-            s.show(lcd, self.x, self.y)
+        global lcd_owner
+
+        if not self.dirty_rect:
+            # BGバッファ クリア
+            lcd.fill(bg_color)
+            # 子スプライトをバッファに描画
+            for s in self.sprite_list:
+                s.show(lcd, self.x, self.y)
+            if profiler is not None and profiler.bar is not None:
+                profiler.bar.show(lcd, 0, 0)
+            self.dirty_rects = None
+            lcd_owner = self
+            return
+
+        # 他のステージが描画していたら全画面
+        if lcd_owner is not self:
+            self.full_redraw = True
+            lcd_owner = self
+
+        # 描画リストを入れ替え
+        self.prev_list, self.draw_list = self.draw_list, self.prev_list
+        self.prev_count = self.draw_count
+        self.draw_count = 0
+        self.dirty_count = 0
+        self.stamp += 1
+
+        # 描画するスプライトを集めて変化を検出
+        self.collect_flat()
+        # プロファイラの表示は一番手前
+        if profiler is not None and profiler.bar is not None:
+            self.collect(profiler.bar, 0, 0)
+
+        # 消えたスプライト
+        stamp = self.stamp
+        prev = self.prev_list
+        for i in range(self.prev_count):
+            d = prev[i].drect
+            if d[5] == stamp - 1:
+                self.add_dirty(d[0], d[1], d[2], d[3])
+                d[5] = -1
+
+        if not self.full_redraw:
+            self.merge_dirty()
+            self.expand_dirty()
+
+        sprites = self.draw_list
+        count = self.draw_count
+
+        if self.full_redraw:
+            # 全画面
+            self.full_redraw = False
+            lcd.fill(bg_color)
+            for i in range(count):
+                sp = sprites[i]
+                d = sp.drect
+                sp.draw(lcd, d[0], d[1])
+            self.dirty_rects = None
+            return
+
+        # 変化した範囲のみ
+        r = self.rects
+        for j in range(self.dirty_count):
+            rx = r[j * 4]
+            ry = r[j * 4 + 1]
+            rw = r[j * 4 + 2]
+            rh = r[j * 4 + 3]
+            lcd.fill_rect(rx, ry, rw, rh, bg_color)
+            for i in range(count):
+                sp = sprites[i]
+                d = sp.drect
+                if (
+                    d[0] < rx + rw
+                    and rx < d[0] + d[2]
+                    and d[1] < ry + rh
+                    and ry < d[1] + d[3]
+                ):
+                    sp.draw_clip(lcd, d[0], d[1], rx, ry, rw, rh)
+        self.dirty_rects = r
+
+    def defer(self, parent, sp, add):
+        """追加・削除を記録
+
+        Params:
+            parent (Sprite): 親のスプライト
+            sp (Sprite): スプライト
+            add (bool): 追加か（False は削除）
+        """
+        i = self.pending_count * 3
+        pending = self.pending
+        if i < len(pending):
+            pending[i] = parent
+            pending[i + 1] = sp
+            pending[i + 2] = add
+        else:
+            pending.append(parent)
+            pending.append(sp)
+            pending.append(add)
+        self.pending_count += 1
+
+    def commit(self):
+        """記録した追加・削除を順に行う"""
+        pending = self.pending
+        for i in range(0, self.pending_count * 3, 3):
+            parent = pending[i]
+            sp = pending[i + 1]
+            # 記録した時の順に行うので追加は必ず未登録・削除は必ず登録済み
+            if pending[i + 2]:
+                parent.insert_sprite(sp)
+            else:
+                parent.delete_sprite(sp)
+            pending[i] = None
+            pending[i + 1] = None
+        self.pending_count = 0
+
+    def flatten(self):
+        """スプライトの木を平らなリストにする
+        子スプライトの構成が変わった時のみ.
+        """
+        self.tree_changed = False
+        n = self.flat_count
+        self.flat_count = 1
+        self.order_count = 0
+        self.flat[0].flat_index = 0
+        self.__flatten(self, 0)
+        # 外れたスプライトを離す
+        for i in range(self.flat_count, n):
+            self.flat[i] = None
+
+    def __flatten(self, sp, p):
+        """子スプライトを flat に追加 描画順（子が先, z 順）を order に追加
+
+        Params:
+            sp (Sprite): 親のスプライト
+            p (int): 親の flat のインデックス
+        """
+        for c in sp.sprite_list:
+            i = self.flat_count
+            self.flat_count = i + 1
+            if i < len(self.flat):
+                self.flat[i] = c
+                self.flat_parent[i] = p
+            else:
+                self.flat.append(c)
+                self.flat_parent.append(p)
+                self.flat_x.append(0)
+                self.flat_y.append(0)
+                self.flat_visible.append(0)
+            c.flat_index = i
+            self.__flatten(c, i)
+
+            if c.drawable:
+                j = self.order_count
+                if j < len(self.order):
+                    self.order[j] = i
+                else:
+                    self.order.append(i)
+                self.order_count = j + 1
+
+    def update_transforms(self):
+        """全てのスプライトの絶対座標と表示状態を求める
+        子スプライトの構成が変わっていたら先に flat を作り直す.
+        """
+        if self.pending_count:
+            self.commit()
+        if self.tree_changed:
+            self.flatten()
+        flat = self.flat
+        parent = self.flat_parent
+        fx = self.flat_x
+        fy = self.flat_y
+        visible = self.flat_visible
+        fx[0] = self.x
+        fy[0] = self.y
+        visible[0] = 1
+        # 親が先に並んでいるので先頭から絶対座標が決まる
+        for i in range(1, self.flat_count):
+            sp = flat[i]
+            p = parent[i]
+            if visible[p] and sp.visible:
+                visible[i] = 1
+                fx[i] = fx[p] + sp.x
+                fy[i] = fy[p] + sp.y
+            else:
+                visible[i] = 0
+
+    def collect_flat(self):
+        """描画するスプライトを描画順に集める
+        collect() と同じ結果を平らなリストから求める.
+        """
+        self.update_transforms()
+        flat = self.flat
+        fx = self.flat_x
+        fy = self.flat_y
+        visible = self.flat_visible
+        order = self.order
+        draw_list = self.draw_list
+        n = self.draw_count
+        for j in range(self.order_count):
+            i = order[j]
+            if visible[i]:
+                sp = flat[i]
+                sp.check_dirty(self, fx[i], fy[i])
+                if n < len(draw_list):
+                    draw_list[n] = sp
+                else:
+                    draw_list.append(sp)
+                n += 1
+        self.draw_count = n
+
+    def collect(self, sp, x, y):
+        """描画するスプライトを描画順に集める
+
+        Params:
+            sp (Sprite): スプライト
+            x (int): 親の絶対座標 X
+            y (int): 親の絶対座標 Y
+        """
+        if not sp.visible:
+            return
+        x += sp.x
+        y += sp.y
+        for c in sp.sprite_list:
+            self.collect(c, x, y)
+
+        if sp.drawable:
+            sp.check_dirty(self, x, y)
+            if self.draw_count < len(self.draw_list):
+                self.draw_list[self.draw_count] = sp
+            else:
+                self.draw_list.append(sp)
+            self.draw_count += 1
+
+    def add_dirty(self, x, y, w, h):
+        """再描画する範囲を追加
+        画面外はクリップ.
+
+        Params:
+            x (int): X座標（絶対座標）
+            y (int): Y座標（絶対座標）
+            w (int): 幅
+            h (int): 高さ
+        """
+        if x < 0:
+            w += x
+            x = 0
+        if y < 0:
+            h += y
+            y = 0
+        if x + w > lcd114.LCD_W:
+            w = lcd114.LCD_W - x
+        if y + h > lcd114.LCD_H:
+            h = lcd114.LCD_H - y
+        if w <= 0 or h <= 0:
+            return
+
+        n = self.dirty_count
+        if n >= _DIRTY_MAX:
+            # 多すぎるので全画面
+            self.full_redraw = True
+            return
+        r = self.rects
+        r[n * 4] = x
+        r[n * 4 + 1] = y
+        r[n * 4 + 2] = w
+        r[n * 4 + 3] = h
+        self.dirty_count = n + 1
+
+    def merge_dirty(self):
+        """重なる・接する矩形をまとめる"""
+        r = self.rects
+        n = self.dirty_count
+        i = 0
+        while i < n:
+            ix = i * 4
+            merged = False
+            j = i + 1
+            while j < n:
+                jx = j * 4
+                if (
+                    r[ix] <= r[jx] + r[jx + 2]
+                    and r[jx] <= r[ix] + r[ix + 2]
+                    and r[ix + 1] <= r[jx + 1] + r[jx + 3]
+                    and r[jx + 1] <= r[ix + 1] + r[ix + 3]
+                ):
+                    x0 = min(r[ix], r[jx])
+                    y0 = min(r[ix + 1], r[jx + 1])
+                    x1 = max(r[ix] + r[ix + 2], r[jx] + r[jx + 2])
+                    y1 = max(r[ix + 1] + r[ix + 3], r[jx + 1] + r[jx + 3])
+                    r[ix] = x0
+                    r[ix + 1] = y0
+                    r[ix + 2] = x1 - x0
+                    r[ix + 3] = y1 - y0
+                    # 最後の矩形で埋める
+                    n -= 1
+                    lx = n * 4
+                    r[jx] = r[lx]
+                    r[jx + 1] = r[lx + 1]
+                    r[jx + 2] = r[lx + 2]
+                    r[jx + 3] = r[lx + 3]
+                    merged = True
+                else:
+                    j += 1
+            if not merged:
+                i += 1
+        self.dirty_count = n
+
+    def expand_dirty(self):
+        """再描画範囲に一部だけ掛かるスプライトを含むように広げる"""
+        r = self.rects
+        sprites = self.draw_list
+        changed = True
+        while changed:
+            changed = False
+            for i in range(self.draw_count):
+                if sprites[i].fit_dirty(r, self.dirty_count):
+                    changed = True
+            if changed:
+                self.merge_dirty()
+
+        # 広すぎる場合は全画面
+        area = 0
+        for j in range(self.dirty_count):
+            area += r[j * 4 + 2] * r[j * 4 + 3]
+        if area > _DIRTY_AREA_MAX:
+            self.full_redraw = True
+
+
+class Collision:
+    """当たり判定
+    画面を一定の大きさのセルに分けて, 同じセルに入ったスプライトのみ比較する.
+    絶対座標は Stage.update_transforms() で求めたものを使う（入れ子でも正しい）.
+    当たった組ごとに EV_COLLISION イベントを発行する（次のフレームのイベント処理で通知）.
+        sender: check() の 1 番目のグループのスプライト
+        option: 2 番目のグループのスプライト
+    矩形が重なった時のみ当たり（接しているだけでは当たらない）.
+    非表示のスプライトは判定しない.
+
+    Params:
+        stage (Stage): ステージ
+        cell_w (int): セルの幅
+        cell_h (int): セルの高さ
+
+    Attributes:
+        bodies (list): 判定するスプライト
+        groups (list): スプライトのグループ 0-7
+        masks (bytearray): グループ毎の当たる相手のグループ（ビット）
+    """
+
+    def __init__(self, stage, cell_w=20, cell_h=22):
+        self.stage = stage
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+        self.cols = (lcd114.LCD_W + cell_w - 1) // cell_w
+        self.rows = (lcd114.LCD_H + cell_h - 1) // cell_h
+        self.bodies = []
+        self.groups = []
+        self.masks = bytearray(8)
+
+        # セル毎の連結リスト
+        self.head = [-1] * (self.cols * self.rows)
+        self.entry_body = []  # bodies のインデックス
+        self.entry_next = []  # 同じセルの次のエントリ
+        self.entry_count = 0
+        # 判定用の矩形（絶対座標）
+        self.rect = []
+
+    def add(self, sp, group):
+        """判定するスプライトを追加
+
+        Params:
+            sp (Sprite): スプライト
+            group (int): グループ 0-7
+        """
+        for b in self.bodies:
+            if b is sp:
+                return
+        self.bodies.append(sp)
+        self.groups.append(group)
+        for _ in range(4):
+            self.rect.append(0)
+
+    def remove(self, sp):
+        """判定するスプライトを削除
+
+        Params:
+            sp (Sprite): スプライト
+        """
+        bodies = self.bodies
+        for i in range(len(bodies)):
+            if bodies[i] is sp:
+                # 最後のスプライトで埋める
+                n = len(bodies) - 1
+                bodies[i] = bodies[n]
+                self.groups[i] = self.groups[n]
+                bodies.pop()
+                self.groups.pop()
+                for _ in range(4):
+                    self.rect.pop()
+                return
+
+    def check(self, group_a, group_b):
+        """当たり判定をするグループの組を登録
+
+        Params:
+            group_a (int): グループ sender になる
+            group_b (int): グループ option になる
+        """
+        self.masks[group_a] |= 1 << group_b
+
+    def __cell(self, v, size, n):
+        """座標のセル 画面外は端のセル"""
+        c = v // size
+        if c < 0:
+            return 0
+        if c >= n:
+            return n - 1
+        return c
+
+    def update(self):
+        """当たり判定
+        1 フレームに 1 回 スプライトが動いた後に呼ぶ.
+        """
+        stage = self.stage
+        stage.update_transforms()
+        flat = stage.flat
+        fx = stage.flat_x
+        fy = stage.flat_y
+        visible = stage.flat_visible
+        cw = self.cell_w
+        ch = self.cell_h
+        cols = self.cols
+        rows = self.rows
+        head = self.head
+        for c in range(cols * rows):
+            head[c] = -1
+        n = 0
+
+        # セルに登録
+        bodies = self.bodies
+        rect = self.rect
+        for i in range(len(bodies)):
+            sp = bodies[i]
+            k = sp.flat_index
+            if (
+                k < 0
+                or k >= stage.flat_count
+                or flat[k] is not sp
+                or not visible[k]
+                or sp.w <= 0
+                or sp.h <= 0
+            ):
+                continue
+            x = fx[k]
+            y = fy[k]
+            rect[i * 4] = x
+            rect[i * 4 + 1] = y
+            rect[i * 4 + 2] = sp.w
+            rect[i * 4 + 3] = sp.h
+            c0 = self.__cell(x, cw, cols)
+            c1 = self.__cell(x + sp.w - 1, cw, cols)
+            r0 = self.__cell(y, ch, rows)
+            r1 = self.__cell(y + sp.h - 1, ch, rows)
+            for c in range(c0, c1 + 1):
+                for r in range(r0, r1 + 1):
+                    cell = r * cols + c
+                    if n < len(self.entry_body):
+                        self.entry_body[n] = i
+                        self.entry_next[n] = head[cell]
+                    else:
+                        self.entry_body.append(i)
+                        self.entry_next.append(head[cell])
+                    head[cell] = n
+                    n += 1
+        self.entry_count = n
+
+        # セル毎に比較
+        groups = self.groups
+        masks = self.masks
+        body = self.entry_body
+        nxt = self.entry_next
+        event = stage.event
+        for cell in range(cols * rows):
+            e = head[cell]
+            while e >= 0:
+                i = body[e]
+                gi = groups[i]
+                f = nxt[e]
+                while f >= 0:
+                    j = body[f]
+                    gj = groups[j]
+                    if masks[gi] & (1 << gj):
+                        a = i
+                        b = j
+                    elif masks[gj] & (1 << gi):
+                        a = j
+                        b = i
+                    else:
+                        f = nxt[f]
+                        continue
+                    ax = rect[a * 4]
+                    ay = rect[a * 4 + 1]
+                    bx = rect[b * 4]
+                    by = rect[b * 4 + 1]
+                    if (
+                        ax < bx + rect[b * 4 + 2]
+                        and bx < ax + rect[a * 4 + 2]
+                        and ay < by + rect[b * 4 + 3]
+                        and by < ay + rect[a * 4 + 3]
+                    ):
+                        # 重なりの左上のセルでのみ通知（複数のセルで重複しない）
+                        if (
+                            self.__cell(max(ax, bx), cw, cols)
+                            + self.__cell(max(ay, by), ch, rows) * cols
+                            == cell
+                        ):
+                            event.post_event(
+                                EV_COLLISION, EV_PRIORITY_HI, 0, bodies[a], bodies[b]
+                            )
+                    f = nxt[f]
+                e = nxt[e]
+
+
+_ease_tables = {}
+"""イージングの表 (関数, start, delta, total) -> 値のタプル"""
+_ease_keys = []
+"""イージングの表のキー 最後に使ったものが末尾"""
+
+
+def ease_table(func, start, delta, total):
+    """イージングの値の表
+    1 から total フレーム目の値を int() したタプル. 同じパラメータの表は使い回す.
+    キャッシュが _EASE_TABLE_MAX を超えたら一番使っていない表を捨てる.
+
+    Params:
+        func (obj): イージング関数
+        start (int): スタート値
+        delta (int): 変化量
+        total (int): 終了フレーム
+
+    Returns:
+        (tuple): 値の表
+    """
+    key = (func, start, delta, total)
+    keys = _ease_keys
+    table = _ease_tables.get(key)
+    if table is not None:
+        if keys[-1] != key:
+            keys.remove(key)
+            keys.append(key)
+        return table
+
+    table = tuple(int(func(i, start, delta, total)) for i in range(1, total + 1))
+    if len(keys) >= _EASE_TABLE_MAX:
+        del _ease_tables[keys.pop(0)]
+    _ease_tables[key] = table
+    keys.append(key)
+    return table
 
 
 class Anime:
     """アニメーション管理
+    値は play() の時に ease_table() で作った表から取る（毎フレームの計算なし）.
+    値は整数. start, delta, total_frame を変えたら play() し直すこと.
 
     Attributes:
         name (str): 名前
@@ -604,6 +2065,7 @@ class Anime:
         current_frame (int) 現在のフレーム
         total_frame (int) 終了フレーム
         value (int): アニメーションの値
+        table (tuple): 値の表
     """
 
     def __init__(self, name, event, ease_func):
@@ -617,6 +2079,9 @@ class Anime:
         self.current_frame = 0
         self.total_frame = 0
         self.value = 0
+        self.table = ()
+        # アニメ終了のイベント 使い回す
+        self.complete_event = [EV_ANIME_COMPLETE, EV_PRIORITY_MID, 0, self, name]
 
     def attach(self):
         """アニメーションを使用可能に"""
@@ -631,6 +2096,7 @@ class Anime:
         if not self.is_paused:
             self.current_frame = 0
         self.value = self.start
+        self.table = ease_table(self.func, self.start, self.delta, self.total_frame)
 
         self.is_playing = True
         self.is_paused = False
@@ -652,64 +2118,427 @@ class Anime:
         if self.is_playing:
             self.current_frame += 1
             if self.current_frame <= self.total_frame:
-                self.value = self.func(
-                    self.current_frame, self.start, self.delta, self.total_frame
-                )
+                self.value = self.table[self.current_frame - 1]
             else:
                 self.stop()
                 # アニメ終了のイベント
-                self.event.post(
-                    [EV_ANIME_COMPLETE, EV_PRIORITY_MID, 0, self, self.name]
-                )
+                self.event.post(self.complete_event)
 
 
-class EventManager:
+class Tween:
+    """トゥイーン
+    対象の属性をイージングの値で毎フレーム書き換える.
+    TweenManager.play() で開始し, TweenManager.update() が 1 フレーム進める.
+    最後の値を書いたらその場で終了（イベントは使わない）. loops を設定すると繰り返す.
+    Anime と違ってリスナーを登録しないので, 止まっている間は処理しない.
+    同じトゥイーンは何度でも play() できる.
+
+    Params:
+        target (obj): 書き換える対象
+        attr (str): 属性名
+        ease_func (obj): イージング関数
+        callback (obj): 終了時に呼ぶ関数 引数はトゥイーン None は呼ばない
+
+    Attributes:
+        target (obj): 書き換える対象
+        attr (str): 属性名
+        func (obj): イージング関数
+        callback (obj): 終了時に呼ぶ関数
+        is_playing (bool): 実行中フラグ
+        listed (bool): TweenManager の配列にある
+        loops (int): 繰り返す回数 0 は止めるまで繰り返す
+        loop (int): 繰り返した回数
+        start (int) スタート値
+        delta (int) 変化量
+        current_frame (int) 現在のフレーム
+        total_frame (int) 終了フレーム
+        value (int): 最後に書いた値
+        table (tuple): 値の表
+    """
+
+    def __init__(self, target, attr, ease_func, callback=None):
+        self.target = target
+        self.attr = attr
+        self.func = ease_func
+        self.callback = callback
+        self.is_playing = False
+        self.listed = False
+        self.loops = 1
+        self.loop = 0
+        self.start = 0
+        self.delta = 0
+        self.current_frame = 0
+        self.total_frame = 0
+        self.value = 0
+        self.table = ()
+
+    def prepare(self):
+        """値の表を用意 TweenManager.play() が呼ぶ"""
+        self.table = ease_table(self.func, self.start, self.delta, self.total_frame)
+
+
+class Timeline(Tween):
+    """キーフレームのアニメーション
+    (値, フレーム数, イージング関数) の並びを 1 つのトゥイーンとして再生する.
+    値は start からの相対値. 各区間は前の区間の値（最初は start）から変化する.
+    イージング関数が None の区間は値をフレーム数の間そのまま保つ（点滅など）.
+    区間の間にフレームの空きやイベントはない.
+    loops 回繰り返した後に callback を 1 回だけ呼ぶ.
+
+    表は play() の時に区間の表をつないで作る. start が同じなら作り直さない.
+
+    Params:
+        target (obj): 書き換える対象
+        attr (str): 属性名
+        keys (tuple): キーフレーム (値, フレーム数, イージング関数) の並び
+        loops (int): 繰り返す回数 0 は止めるまで繰り返す
+        callback (obj): 終了時に呼ぶ関数 引数はタイムライン None は呼ばない
+
+    Attributes:
+        keys (tuple): キーフレーム
+    """
+
+    def __init__(self, target, attr, keys, loops=1, callback=None):
+        super().__init__(target, attr, None, callback)
+        self.keys = keys
+        self.loops = loops
+        self.table_start = None
+
+    def prepare(self):
+        """キーフレームから値の表を作る TweenManager.play() が呼ぶ"""
+        start = self.start
+        if self.table_start == start:
+            return
+        values = []
+        prev = start
+        for value, frames, func in self.keys:
+            v = start + value
+            if func is None:
+                for _ in range(frames):
+                    values.append(v)
+            else:
+                values.extend(ease_table(func, prev, v - prev, frames))
+            prev = v
+        self.table = tuple(values)
+        self.table_start = start
+        self.total_frame = len(values)
+        self.delta = prev - start
+
+
+class TweenManager:
+    """トゥイーンの管理
+    実行中のトゥイーンを配列に詰めておき, update() の 1 回のループで全て進める.
+    終わったトゥイーンは同じループで配列から外す.
+    Scene が持ち, Scene.action がイベント処理の後に update() を呼ぶ.
+
+    Attributes:
+        tweens (list): 実行中のトゥイーン 先頭から count 個
+        count (int): 実行中のトゥイーンの数
+    """
+
+    def __init__(self):
+        self.tweens = []
+        self.count = 0
+
+    def play(self, tween):
+        """トゥイーンを開始 start, delta, total_frame は設定しておく
+        次の update() から値を書く.
+
+        Params:
+            tween (Tween): トゥイーン
+        """
+        tween.current_frame = 0
+        tween.loop = 0
+        tween.value = tween.start
+        tween.prepare()
+        tween.is_playing = True
+        if not tween.listed:
+            tween.listed = True
+            if self.count < len(self.tweens):
+                self.tweens[self.count] = tween
+            else:
+                self.tweens.append(tween)
+            self.count += 1
+
+    def stop(self, tween):
+        """トゥイーンを停止 値はそのまま 配列からは次の update() で外す
+
+        Params:
+            tween (Tween): トゥイーン
+        """
+        tween.is_playing = False
+        tween.current_frame = 0
+
+    def clear(self):
+        """全てのトゥイーンを停止"""
+        tweens = self.tweens
+        for i in range(self.count):
+            tw = tweens[i]
+            tw.is_playing = False
+            tw.listed = False
+            tweens[i] = None
+        self.count = 0
+
+    def update(self):
+        """実行中のトゥイーンを 1 フレーム進める
+        終了時のコールバックで開始したトゥイーンは次の update() から.
+        """
+        tweens = self.tweens
+        count = self.count
+        n = 0
+        for i in range(count):
+            tw = tweens[i]
+            if tw.is_playing:
+                tw.current_frame += 1
+                c = tw.current_frame
+                if c <= tw.total_frame:
+                    tw.value = tw.table[c - 1]
+                    setattr(tw.target, tw.attr, tw.value)
+                if c >= tw.total_frame:
+                    tw.current_frame = 0
+                    tw.loop += 1
+                    if tw.loops and tw.loop >= tw.loops:
+                        tw.is_playing = False
+                        if tw.callback is not None:
+                            tw.callback(tw)
+            # 詰める コールバックで再開したものは残す
+            if tw.is_playing:
+                tweens[n] = tw
+                n += 1
+            else:
+                tw.listed = False
+
+        # コールバックで追加されたトゥイーン
+        for i in range(count, self.count):
+            tweens[n] = tweens[i]
+            n += 1
+        for i in range(n, self.count):
+            tweens[i] = None
+        self.count = n
+
+
+class EventManager:
     """イベント管理
     フレーム毎にイベントを処理する.
 
+    リスナーはイベントタイプ毎に管理. コールバックは登録時に解決する.
+    遅延イベントは処理するフレーム番号をキーにした 2段のタイミングホイールで管理する.
+    イベントは処理するフレームが近づいた時だけ移動する.
+        wheel0: 現在のブロック（64フレーム）のイベント フレーム毎
+        wheel1: 現在のスーパーブロック（4096フレーム）のイベント ブロック毎
+        overflow: それより先のイベント
+
+    post() はイベントを返す. cancel() に渡すと取り消せる.
+
+    ヒープを使わないための仕組み:
+        ・毎フレームのイベントは add_frame_event() で登録しておき,
+          post_frame_events() で同じリストを毎回ポストする.
+        ・使い捨てのイベントは post_event() でポストする.
+          リストはプールから取り出し, 処理後にプールへ戻す.
+
     Attributes:
-        queue (list): イベントキュー
-        listners (list): イベントリスナー [0]:type [1]:obj [2]:bool
+        frame (int): 処理済みフレーム数
+        queue (list): 今回のフレームで処理するイベント 末尾から処理（priority 降順）
+        wheel0 (list): 1段目のバケツ
+        wheel1 (list): 2段目のバケツ
+        overflow (list): ホイールに入らない先のイベント
+        listners (dict): イベントタイプ毎のリスナー [0]:obj [1]:bool [2]:callback
+        frame_events (list): 毎フレームポストするイベント
+        free (list): post_event() 用の空きイベント
     """
 
     def __init__(self):
+        self.frame = 0
         # イベントキュー
-        self.queue = []  # deque を使いたい
+        self.queue = []
+        self.wheel0 = [[] for _ in range(_WHEEL_SIZE)]
+        self.wheel1 = [[] for _ in range(_WHEEL_SIZE)]
+        self.overflow = []
         # イベントリスナー
-        self.listners = []
+        self.listners = {}
+        self.calling = 0  # リスナー呼び出しのネスト
+        self.removed = False  # 呼び出し中に削除されたリスナーがある
+        # 使い回すイベント
+        self.frame_events = []
+        self.free = []
 
     def post(self, event):
         """イベントをポスト
+        ポスト後の [2] は処理するフレーム番号になる.
 
         Params:
             event (list): [0]:type [1]:priority [2]:delay [3]:sender [4]:optiion
+
+        Returns:
+            (list): イベント 取り消し用
         """
-        # キューが空
-        if len(self.queue) == 0:
-            self.queue.append(event)
-            return
+        if event[2] == 0:
+            self.__push(event)
+        else:
+            event[2] += self.frame
+            self.__slot(event[2]).append(event)
+        return event
 
-        # delay, priority 昇順・新規は後ろに追加
-        for i, e in enumerate((self.queue)):
-            if event[2] > e[2]:
-                continue
-            if event[2] == e[2] and event[1] >= e[1]:
-                continue
-            # この位置に追加
-            self.queue.insert(i, event)
-            return
+    def post_event(self, type, priority, delay, sender, option):
+        """使い捨てのイベントをポスト
+        イベントのリストはプールのものを使い, 処理後にプールへ戻す.
+        戻したリストは別のイベントに使われるので取り消しはできない.
+
+        Params:
+            type (str): イベントタイプ
+            priority (int): プライオリティ
+            delay (int): 遅延フレーム数
+            sender (obj): 送り主
+            option (obj): オプション
+        """
+        if self.free:
+            event = self.free.pop()
+            event[0] = type
+            event[1] = priority
+            event[2] = delay
+            event[3] = sender
+            event[4] = option
+        else:
+            # プールを示す [5] 付き
+            event = [type, priority, delay, sender, option, True]
+        self.post(event)
+
+    def add_frame_event(self, event):
+        """毎フレームポストするイベントを登録
+
+        Params:
+            event (list): [0]:type [1]:priority [2]:0 [3]:sender [4]:optiion
+        """
+        for e in self.frame_events:
+            if e is event:
+                return
+        self.frame_events.append(event)
+
+    def remove_frame_event(self, event):
+        """毎フレームポストするイベントを削除
+
+        Params:
+            event (list): add_frame_event() で登録したイベント
+        """
+        lst = self.frame_events
+        for i in range(len(lst)):
+            if lst[i] is event:
+                del lst[i]
+                return
+
+    def post_frame_events(self):
+        """登録済みのイベントを登録順にポスト"""
+        for e in self.frame_events:
+            self.__push(e)
+
+    def cancel(self, event):
+        """ポストしたイベントを取り消す
+
+        Params:
+            event (list): post() が返したイベント
+
+        Returns:
+            (bool): 取り消せたか
+        """
+        if event[2] <= self.frame:
+            lst = self.queue
+        else:
+            lst = self.__slot(event[2])
+        for i in range(len(lst)):
+            if lst[i] is event:
+                del lst[i]
+                return True
+        return False
+
+    def __release(self, event):
+        """post_event() のイベントならプールへ戻す
+
+        Params:
+            event (list): 処理済み・取り消したイベント
+        """
+        if len(event) > 5:
+            event[3] = None  # 送り主を離す
+            event[4] = None
+            self.free.append(event)
+
+    def __slot(self, target):
+        """処理するフレームに対応するバケツ
+
+        Params:
+            target (int): 処理するフレーム番号
+
+        Returns:
+            (list): バケツ
+        """
+        if target >> _WHEEL_BITS == self.frame >> _WHEEL_BITS:
+            return self.wheel0[target & _WHEEL_MASK]
+        if target >> (_WHEEL_BITS * 2) == self.frame >> (_WHEEL_BITS * 2):
+            return self.wheel1[(target >> _WHEEL_BITS) & _WHEEL_MASK]
+        return self.overflow
+
+    def __push(self, event):
+        """今回のフレームのキューに追加
+        priority 昇順で処理・同じ priority は後から追加したものが後.
 
-        # 最後に追加
-        self.queue.append(event)
+        Params:
+            event (list): イベント
+        """
+        q = self.queue
+        p = event[1]
+        # priority 降順に並んでいるので二分探索
+        lo = 0
+        hi = len(q)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if q[mid][1] > p:
+                lo = mid + 1
+            else:
+                hi = mid
+        q.insert(lo, event)
 
     def clear_queue(self):
         """イベントキューをクリア"""
-        self.queue.clear()
+        self.__clear(self.queue)
+        for slot in self.wheel0:
+            self.__clear(slot)
+        for slot in self.wheel1:
+            self.__clear(slot)
+        self.__clear(self.overflow)
+
+    def __clear(self, lst):
+        """リストのイベントを捨てる プールのものは戻す
+
+        Params:
+            lst (list): キューまたはバケツ
+        """
+        for e in lst:
+            self.__release(e)
+        lst.clear()
 
     def clear_listners(self):
         """リスナーをクリア"""
         self.listners.clear()
 
+    def __set_listners(self, enabled, targets, ignores):
+        """リスナーの有効・無効を設定
+
+        Params:
+            enabled (bool): 有効か
+            target (list): 対象イベントタイプ
+            ignore (list): 除外イベントタイプ
+        """
+        for type, lst in self.listners.items():
+            # 全て対象
+            if targets is None and ignores is None:
+                pass
+            elif not (
+                (targets is not None and type in targets)
+                or (ignores is not None and type not in ignores)
+            ):
+                continue
+            for li in lst:
+                li[1] = enabled
+
     def enable_listners(self, targets=None, ignores=None):
         """全てのリスナーを有効化
 
@@ -717,20 +2546,7 @@ class EventManager:
             target (list): 対象イベントタイプ
             ignore (list): 除外イベントタイプ
         """
-        # 全て対象
-        if targets is None and ignores is None:
-            for ls in self.listners:
-                ls[2] = True
-        # 対象リスト
-        if targets is not None:
-            for ls in self.listners:
-                if ls[0] in targets:
-                    ls[2] = True
-        # 無視リスト
-        if ignores is not None:
-            for ls in self.listners:
-                if ls[0] not in ignores:
-                    ls[2] = True
+        self.__set_listners(True, targets, ignores)
 
     def disable_listners(self, targets=None, ignores=None):
         """全てのリスナーを無効化
@@ -739,20 +2555,7 @@ class EventManager:
             target (list): 対象イベントタイプ
             ignore (list): 除外イベントタイプ
         """
-        # 全て対象
-        if targets is None and ignores is None:
-            for ls in self.listners:
-                ls[2] = False
-        # 対象リスト
-        if targets is not None:
-            for ls in self.listners:
-                if ls[0] in targets:
-                    ls[2] = False
-        # 無視リスト
-        if ignores is not None:
-            for ls in self.listners:
-                if ls[0] not in ignores:
-                    ls[2] = False
+        self.__set_listners(False, targets, ignores)
 
     def add_listner(self, listner):
         """リスナー追加
@@ -761,10 +2564,14 @@ class EventManager:
         Params:
             listner (list): [0]:type [1]:リスナーを持つオブジェクト [2]: 有効か
         """
-        for li in self.listners:
-            if li[0] == listner[0] and li[1] == listner[1]:
+        lst = self.listners.get(listner[0])
+        if lst is None:
+            lst = []
+            self.listners[listner[0]] = lst
+        for li in lst:
+            if li[0] is listner[1]:
                 return
-        self.listners.append(listner)
+        lst.append([listner[1], listner[2], getattr(listner[1], listner[0])])
 
     def remove_lister(self, listner):
         """リスナーを削除
@@ -772,9 +2579,9 @@ class EventManager:
         Params:
             listner (list): [0]:type [1]:リスナーを持つオブジェクト [2]: 有効か
         """
-        for i in range(len(self.listners) - 1, -1, -1):
-            if self.listners[i][0] == listner[0] and self.listners[i][1] is listner[1]:
-                del self.listners[i]
+        lst = self.listners.get(listner[0])
+        if lst is not None:
+            self.__remove(lst, listner[1])
 
     def remove_all_listner(self, listner):
         """特定オブジェクトのすべてのリスナーを削除
@@ -782,20 +2589,68 @@ class EventManager:
         Params:
             listner (obj): リスナーを持つオブジェクト
         """
-        for i in range(len(self.listners) - 1, -1, -1):
-            if self.listners[i][1] is listner:
-                del self.listners[i]
+        for lst in self.listners.values():
+            self.__remove(lst, listner)
+
+    def __remove(self, lst, obj):
+        """リストからオブジェクトのリスナーを削除
+        呼び出し中は印を付けるだけで, 呼び出しが終わってから詰める.
+
+        Params:
+            lst (list): リスナーのリスト
+            obj (obj): リスナーを持つオブジェクト
+        """
+        for i in range(len(lst) - 1, -1, -1):
+            li = lst[i]
+            if li[0] is obj:
+                if self.calling:
+                    li[0] = None
+                    li[1] = False
+                    self.removed = True
+                else:
+                    del lst[i]
 
     def fire(self):
         """イベントを処理"""
-        while True:
-            if len(self.queue) == 0 or self.queue[0][2] != 0:
-                break
-            self.__call_listners(self.queue.pop(0))  # 遅い
+        q = self.queue
+        while q:
+            e = q.pop()
+            self.__call_listners(e)
+            self.__release(e)
+
+        # 次のフレーム
+        self.frame += 1
+        frame = self.frame
+        if frame & _WHEEL_MASK == 0:
+            # 新しいブロック 上の段から降ろす
+            if frame & ((1 << (_WHEEL_BITS * 2)) - 1) == 0 and self.overflow:
+                self.__cascade(self.overflow)
+            self.__cascade(self.wheel1[(frame >> _WHEEL_BITS) & _WHEEL_MASK])
+
+        slot = self.wheel0[frame & _WHEEL_MASK]
+        if slot:
+            for e in slot:
+                self.__push(e)
+            slot.clear()
+
+    def __cascade(self, lst):
+        """バケツのイベントを下の段へ移す 順番は保つ
+        残るイベントはその場で詰める（新しいリストを作らない）.
 
-        # delay 更新
-        for e in self.queue:
-            e[2] -= 1
+        Params:
+            lst (list): 移すバケツ
+        """
+        n = 0
+        for i in range(len(lst)):
+            e = lst[i]
+            slot = self.__slot(e[2])
+            if slot is lst:
+                lst[n] = e
+                n += 1
+            else:
+                slot.append(e)
+        while len(lst) > n:
+            lst.pop()
 
     def __call_listners(self, event):
         """イベントリスナー呼び出し
@@ -803,16 +2658,175 @@ class EventManager:
         Params:
             event (list): [0]:type [1]:priority [2]:delay [3]:sender [4]:optiion
         """
-        for listner in self.listners:
-            if event[0] == listner[0] and listner[2]:  # 有効なリスナーのみ
-                # コールバック呼び出し
-                getattr(listner[1], event[0])(event[0], event[3], event[4])
+        lst = self.listners.get(event[0])
+        if lst is None:
+            return
+        self.calling += 1
+        # 呼び出し中に追加されたリスナーも呼ぶ
+        i = 0
+        while i < len(lst):
+            li = lst[i]
+            if li[1]:  # 有効なリスナーのみ
+                li[2](event[0], event[3], event[4])
+            i += 1
+        self.calling -= 1
+
+        # 削除されたリスナーを詰める
+        if self.calling == 0 and self.removed:
+            self.removed = False
+            for lst in self.listners.values():
+                for i in range(len(lst) - 1, -1, -1):
+                    if lst[i][0] is None:
+                        del lst[i]
+
+
+class Random:
+    """乱数（xorshift 16bit）
+    シードが同じなら同じ並びになるのでリプレイできる.
+    値は 16bit に収まるのでヒープを使わない.
+
+    Attributes:
+        seed_value (int): 最後にセットしたシード
+    """
+
+    def __init__(self, seed=1):
+        self.seed(seed)
+
+    def seed(self, n=None):
+        """シードをセット
+
+        Params:
+            n (int): シード None の時は時刻から作る
+        """
+        if n is None:
+            n = utime.ticks_us()
+        n &= 0xFFFF
+        if n == 0:
+            n = 1  # 0 は 0 しか出ない
+        self.seed_value = n
+        self.x = n
+
+    def next(self):
+        """次の乱数 1～65535"""
+        x = self.x
+        x ^= (x << 7) & 0xFFFF
+        x ^= x >> 9
+        x ^= (x << 8) & 0xFFFF
+        self.x = x
+        return x
+
+    def randint(self, a, b):
+        """a 以上 b 以下の整数"""
+        return a + self.next() % (b - a + 1)
+
+
+class KeyRecorder:
+    """キー入力の記録
+    InputKey の代わりにシーンに渡す. 毎フレームの repeat を記録する.
+
+    Params:
+        key (InputKey): 実際のキー入力
+
+    Attributes:
+        repeat (int): 押しっぱなし
+        push (int): 押した
+        push_us (int): 押した時刻（ticks_us）
+        log (bytearray): フレーム毎の repeat
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.repeat = 0
+        self.push = 0
+        self.push_us = 0
+        self.log = bytearray()
+
+    def scan(self):
+        """キースキャン"""
+        self.key.scan()
+        self.repeat = self.key.repeat
+        self.push = self.key.push
+        self.push_us = self.key.push_us
+        self.log.append(self.repeat & 0xFF)
+
+    def save(self, filename, seed):
+        """記録を保存
+
+        Params:
+            filename (str): ファイル名
+            seed (int): 乱数のシード
+        """
+        with io.open(filename, "wb") as f:
+            f.write(struct.pack("<HI", seed, len(self.log)))
+            f.write(self.log)
+
+
+class KeyPlayer:
+    """記録したキー入力の再生
+    InputKey の代わりにシーンに渡す. 記録が終わったらキーは押されない.
+
+    Params:
+        log (bytes): フレーム毎の repeat
+        seed (int): 乱数のシード
+
+    Attributes:
+        repeat (int): 押しっぱなし
+        push (int): 押した
+        push_us (int): 押した時刻（ticks_us） scan() の時刻
+        pos (int): 再生位置
+        done (bool): 最後まで再生した
+    """
+
+    def __init__(self, log, seed):
+        self.log = log
+        self.seed = seed
+        self.pos = 0
+        self.done = False
+        self.repeat = 0
+        self.push = 0
+        self.push_us = 0
+
+    @staticmethod
+    def load(filename):
+        """KeyRecorder.save() で保存したファイルを読み込む
+
+        Params:
+            filename (str): ファイル名
+
+        Returns:
+            (KeyPlayer): ファイルがない時は None
+        """
+        try:
+            f = io.open(filename, "rb")
+        except OSError:
+            return None
+        with f:
+            head = f.read(6)
+            seed, n = struct.unpack("<HI", head)
+            return KeyPlayer(f.read(n), seed)
+
+    def scan(self):
+        """キースキャン InputKey と同じ"""
+        self.push = ~self.repeat
+        if self.pos < len(self.log):
+            self.repeat = self.log[self.pos]
+            self.pos += 1
+        else:
+            self.repeat = 0
+            self.done = True
+        self.push &= self.repeat
+        self.push_us = utime.ticks_us()
 
 
 class Scene:
     """シーン
     メイン画面, タイトル画面, ポース画面 等.
 
+    ゲームの処理は 1/fps 秒毎の固定ステップで進める.
+    処理が遅れた時は描画を飛ばして catch_up フレームまで追いつく.
+    それ以上の遅れは捨てる（ゲームがその分遅くなる）.
+    シーン固有のフレーム毎の処理は update() に書く.
+
     Params:
         name (str): シーン名
         stage (Stage): ステージ（スプライトのルート）
@@ -824,11 +2838,14 @@ class Scene:
         stage (Stage): ステージ（スプライトのルート）
         event (EventManageer): イベント管理
         key (InputKey): キー管理
-        fps_ticks (int): FPS用時間を記録
+        fps_ticks (int): 最後のフレームの予定時刻（ticks_us）
         fps (int): FPS デフォルト 30
-        fps_interval (int): 次回までのインターバル
+        fps_interval (int): 次回までのインターバル（us）
+        catch_up (int): 描画を飛ばして追いつくフレーム数の上限
         frame_count (int): 開始からのフレーム数
         active (bool): 現在シーンがアクティブ（フレーム処理中）か
+        random (Random): シーンの乱数
+        tweens (TweenManager): トゥイーンの管理
     """
 
     def __init__(self, name, event, stage, key):
@@ -836,58 +2853,149 @@ class Scene:
         self.stage = stage
         self.event = event
         self.key = key
+        self.random = Random()
+        self.tweens = TweenManager()
 
         # FPS関連
-        self.fps_ticks = utime.ticks_ms()
+        self.fps_ticks = utime.ticks_us()
         self.fps = DEFAULT_FPS
-        self.fps_interval = 1000 // self.fps
+        self.fps_interval = 1000000 // self.fps
+        self.catch_up = DEFAULT_CATCH_UP
         self.active = False  # 現在シーンがアクティブか
         self.frame_count = 0  # 経過フレーム
         self.director = None
 
+        # enter_frame イベント 毎フレーム同じリストをポストする
+        event.add_frame_event([EV_ENTER_FRAME, EV_PRIORITY_MID, 0, self, key])
+        event.add_frame_event([EV_ANIME_ENTER_FRAME, EV_PRIORITY_MID, 0, self, key])
+
     def enter(self):
         """入場"""
         # ステージの有効化
         self.stage.enter()
         # 初回イベント
-        self.event.post([EV_ENTER_FRAME, EV_PRIORITY_MID, 0, self, self.key])
-        self.event.post([EV_ANIME_ENTER_FRAME, EV_PRIORITY_MID, 0, self, self.key])
+        self.event.post_frame_events()
 
         self.frame_count = 0
 
     def action(self):
-        """実行"""
-        t = utime.ticks_ms()
-        if utime.ticks_diff(t, self.fps_ticks) < self.fps_interval:  # FPS
-            self.active = False
-            # たまに gc 実行
-            if self.frame_count % (DEFAULT_FPS * 10) == 0:
-                gc.collect()
-            return
+        """実行
+        予定時刻を過ぎたフレームを処理して最後のフレームのみ描画.
+        ターボモードでは待たずに 1 フレーム実行して描画しない.
+        """
+        steps = 1
+        if not turbo:
+            t = utime.ticks_us()
+            steps = utime.ticks_diff(t, self.fps_ticks) // self.fps_interval
+            if steps <= 0:  # FPS
+                self.active = False
+                return
+            if steps > self.catch_up:
+                # 追いつけない分は捨てる
+                steps = self.catch_up
+                self.fps_ticks = t
+            else:
+                self.fps_ticks = utime.ticks_add(
+                    self.fps_ticks, steps * self.fps_interval
+                )
 
-        self.fps_ticks = t
         self.active = True
-        self.frame_count += 1
 
-        # キースキャン
-        self.key.scan()
+        prof = profiler
+        if prof is not None:
+            prof.begin(self.fps_interval)
+
+        director = self.director
+        for i in range(steps - 1, -1, -1):
+            self.frame_count += 1
+
+            # キースキャン
+            self.key.scan()
+            if latency_probe is not None:
+                latency_probe.scan(self.key)
+            if prof is not None:
+                prof.mark(_PROF_KEY)
+
+            # イベント処理
+            self.event.fire()
+            # トゥイーン
+            if self.tweens.count:
+                self.tweens.update()
+            if prof is not None:
+                prof.mark(_PROF_EVENT)
+
+            # ステージ アクション
+            self.stage.action()
+            if prof is not None:
+                prof.mark(_PROF_ACTION)
+
+            # バッファに描画 最後のフレームのみ ターボモードでは描画しない
+            if i == 0 and not turbo:
+                self.show()
+
+            # enter_frame イベントは毎フレーム発生
+            self.event.post_frame_events()
+
+            # シーン固有の処理
+            self.update()
+            # まとめた追加・削除
+            if self.stage.pending_count:
+                self.stage.commit()
+            if prof is not None:
+                prof.mark(_PROF_ACTION)
+
+            # シーンが切り替わった
+            if director is not None and not director.is_playing:
+                break
 
-        # イベント処理
-        self.event.fire()
+        if prof is not None:
+            prof.end()
+        if gc_manager is not None:
+            gc_manager.frame()
 
-        # ステージ アクション
-        self.stage.action()
+    def update(self):
+        """フレーム毎の処理
+        キー入力, イベント, スプライトのアクションの後に呼ばれる.
+        継承したシーンで実装.
+        """
+        pass
 
-        # バッファに描画
-        # 排他処理
-        #lock.acquire()
-        self.stage.show()
-        #lock.release()
-        lcd.show()
+    def wait_us(self):
+        """次のフレームまでの時間
+
+        Returns:
+            (int): マイクロ秒 予定時刻を過ぎていたら 0 以下
+        """
+        return self.fps_interval - utime.ticks_diff(utime.ticks_us(), self.fps_ticks)
 
-        # enter_frame イベントは毎フレーム発生
-        self.event.post([EV_ENTER_FRAME, EV_PRIORITY_MID, 0, self, self.key])
-        self.event.post([EV_ANIME_ENTER_FRAME, EV_PRIORITY_MID, 0, self, self.key])
+    def resync(self):
+        """フレームの予定時刻を現在にする
+        止まっていたシーンを再開した時に遅れを取り戻さないように.
+        """
+        self.fps_ticks = utime.ticks_add(utime.ticks_us(), -self.fps_interval)
+
+    def show(self):
+        """ステージを描画して LCD に転送"""
+        prof = profiler
+        if pipeline is not None:
+            self.stage.show()
+            if prof is not None:
+                prof.mark(_PROF_DRAW)
+            # 転送は CORE1
+            pipeline.swap(self.stage.dirty_rects, self.stage.dirty_count)
+        else:
+            lcd.wait_done()  # 前フレームの転送完了
+            if prof is not None:
+                prof.mark(_PROF_SEND)
+            self.stage.show()
+            if prof is not None:
+                prof.mark(_PROF_DRAW)
+            # 次のフレームの処理中に転送
+            lcd.show_async(self.stage.dirty_rects, self.stage.dirty_count)
+        if latency_probe is not None:
+            latency_probe.shown()
+        if prof is not None:
+            prof.mark(_PROF_SEND)
 
     def leave(self):
         """終了処理"""
@@ -895,6 +3003,8 @@ class Scene:
         self.event.clear_queue()
         # リスナーをクリア
         self.event.clear_listners()
+        # トゥイーンを停止
+        self.tweens.clear()
         # スプライトを除去
         self.stage.leave()
 
@@ -938,15 +3048,24 @@ class Director:
     def play(self):
         """カレントシーン実行
         カレントシーンをループ再生
+        フレームの間は次の予定時刻まで sleep する.
         """
         while True:
             self.is_playing = True
-            s = self.scene_stack[-1]
             if not self.scene_stack:
                 return
+            s = self.scene_stack[-1]
+            s.resync()  # 切り替わったシーンはすぐに実行
 
             while self.is_playing:
                 s.action()
+                if not turbo:
+                    w = s.wait_us()
+                    # 空き時間に GC
+                    if w > 0 and gc_manager is not None and gc_manager.idle(w):
+                        w = s.wait_us()
+                    if w > 0:
+                        utime.sleep_us(w)
 
     def pop(self):
         """カレントシーンのポップ（ポーズ）"""
@@ -975,12 +3094,604 @@ class Director:
         return None
 
 
-#def thread_send_buf_to_lcd():
-#    """LCDにバッファを転送するスレッド
-#
-#    CORE1 が担当.
-#    """
-#    while True:
-#        lock.acquire()
-#        lcd.show()
-#        lock.release()
+class LCDPipeline:
+    """LCD転送パイプライン
+    CORE0 がフレーム N+1 を描画している間に CORE1 がフレーム N を転送する.
+    描画用(lcd.buf) と 転送用(front) のダブルバッファ.
+    swap() で描画済みのフレームを転送側に渡す.
+
+    Params:
+        display (LCD): LCD
+
+    Attributes:
+        front (bytearray): 転送用バッファ
+        rects (list): 転送する矩形
+        count (int): 矩形の数 全画面の時は -1
+        frames (int): 転送したフレーム数
+        swaps (int): 転送を要求したフレーム数
+        wait_us (int): swap() が転送完了を待った累計時間
+        send_us (int): 転送にかかった累計時間
+        done_us (int): 最後のフレームの転送が終わった時刻（ticks_us）
+    """
+
+    def __init__(self, display):
+        self.display = display
+        self.front = bytearray(len(display.buf))
+        self.rects = [0] * (_DIRTY_MAX * 4)
+        # コピーする矩形 毎回作らない
+        self.geom = pixel.new_geometry(lcd114.LCD_W, lcd114.LCD_H)
+        self.count = -1
+        self.frames = 0
+        self.swaps = 0
+        self.wait_us = 0
+        self.send_us = 0
+        self.done_us = 0
+        # 転送要求 CORE0 -> CORE1
+        self.ready = _thread.allocate_lock()
+        self.ready.acquire()
+        # 転送完了 CORE1 -> CORE0
+        self.done = _thread.allocate_lock()
+
+    def start(self):
+        """CORE1 で転送スレッドを開始"""
+        _thread.start_new_thread(self.run, ())
+
+    def swap(self, rects=None, count=0):
+        """描画済みのフレームを転送用バッファに移して転送を要求
+        前のフレームの転送が終わるまで待つ.
+
+        Params:
+            rects (list): 変化した矩形 [x, y, w, h, ...] None の時は全画面
+            count (int): 矩形の数
+        """
+        t = utime.ticks_us()
+        self.done.acquire()  # 前フレームの転送完了
+        self.wait_us += utime.ticks_diff(utime.ticks_us(), t)
+        if latency_probe is not None:
+            latency_probe.poll()
+
+        # スライスを作らずにコピー
+        g = self.geom
+        if rects is None:
+            g[pixel.GEOM_W] = lcd114.LCD_W
+            g[pixel.GEOM_H] = lcd114.LCD_H
+            g[pixel.GEOM_X] = 0
+            g[pixel.GEOM_Y] = 0
+            pixel.copy_rect(self.front, self.display.buf, g)
+            self.count = -1
+        else:
+            # 変化した範囲のみコピー
+            r = self.rects
+            for i in range(count * 4):
+                r[i] = rects[i]
+            for i in range(0, count * 4, 4):
+                g[pixel.GEOM_X] = rects[i]
+                g[pixel.GEOM_Y] = rects[i + 1]
+                g[pixel.GEOM_W] = rects[i + 2]
+                g[pixel.GEOM_H] = rects[i + 3]
+                pixel.copy_rect(self.front, self.display.buf, g)
+            self.count = count
+
+        self.swaps += 1
+        self.ready.release()  # 転送開始
+
+    def run(self):
+        """転送スレッド"""
+        while True:
+            self.ready.acquire()
+            t = utime.ticks_us()
+            if self.count < 0:
+                self.display.send(self.front)
+            else:
+                self.display.send(self.front, self.rects, self.count)
+            self.done_us = utime.ticks_us()
+            self.send_us += utime.ticks_diff(self.done_us, t)
+            self.frames += 1
+            self.done.release()
+
+
+def start_pipeline():
+    """LCD転送パイプラインを開始
+    以降のフレームは CORE1 が転送する.
+    """
+    global pipeline
+    pipeline = LCDPipeline(lcd)
+    pipeline.start()
+
+
+class Profiler:
+    """フレームの処理時間を計測
+    Scene.action の各フェーズの時間をマイクロ秒で記録する.
+    start_profiler() で開始. 開始しなければ計測しない.
+
+    Params:
+        window (int): ヒストグラムのフレーム数（直近のフレーム）
+        dump_interval (int): 結果を表示する間隔（フレーム数） 0 は表示しない
+        overlay (bool): 画面上部に処理時間のバーを表示
+
+    Attributes:
+        frames (int): 計測したフレーム数
+        late (int): 処理時間が 1 フレームを超えたフレーム数
+        dropped (int): 間に合わなかったフレーム数
+        total (list): フェーズ毎の合計時間
+        peak (list): フェーズ毎の最大時間
+        last (list): 直近フレームのフェーズ毎の時間
+        hist (list): 直近 window フレームの処理時間のヒストグラム（2ms 刻み）
+        bar (ProfileBar): 画面表示 表示しない時は None
+    """
+
+    names = ("key", "event", "action", "draw", "send")
+
+    def __init__(self, window=128, dump_interval=0, overlay=False):
+        self.window = window
+        self.dump_interval = dump_interval
+        self.ring = bytearray(window)
+        self.hist = [0] * _PROF_BUCKETS
+        self.total = [0] * _PROF_PHASES
+        self.peak = [0] * _PROF_PHASES
+        self.last = [0] * _PROF_PHASES
+        self.cur = [0] * _PROF_PHASES
+        self.bar = ProfileBar(self) if overlay else None
+        self.reset()
+
+    def reset(self):
+        """計測結果をクリア"""
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+        self.work_total = 0
+        self.work_peak = 0
+        self.budget_us = 1000000 // DEFAULT_FPS
+        self.pos = 0
+        self.filled = 0
+        for i in range(_PROF_BUCKETS):
+            self.hist[i] = 0
+        for i in range(_PROF_PHASES):
+            self.total[i] = 0
+            self.peak[i] = 0
+
+    def begin(self, budget):
+        """フレーム開始
+
+        Params:
+            budget (int): フレームの間隔（us）
+        """
+        t = utime.ticks_us()
+        # 前フレームの開始から 2 フレーム以上空いたら飛ばしたフレームがある
+        if self.frames > 0:
+            gap = utime.ticks_diff(t, self.t0)
+            if gap >= budget * 2:
+                self.dropped += gap // budget - 1
+        self.t0 = self.t = t
+        self.budget_us = budget
+        cur = self.cur
+        for i in range(_PROF_PHASES):
+            cur[i] = 0
+
+    def mark(self, phase):
+        """前回からの時間をフェーズに加算
+
+        Params:
+            phase (int): フェーズ
+        """
+        t = utime.ticks_us()
+        self.cur[phase] += utime.ticks_diff(t, self.t)
+        self.t = t
+
+    def end(self):
+        """フレーム終了"""
+        work = utime.ticks_diff(utime.ticks_us(), self.t0)
+        self.frames += 1
+        self.work_total += work
+        if work > self.work_peak:
+            self.work_peak = work
+        if work > self.budget_us:
+            self.late += 1
+
+        cur = self.cur
+        for i in range(_PROF_PHASES):
+            v = cur[i]
+            self.last[i] = v
+            self.total[i] += v
+            if v > self.peak[i]:
+                self.peak[i] = v
+
+        # ヒストグラム 古いフレームを除く
+        b = work // _PROF_BUCKET_US
+        if b >= _PROF_BUCKETS:
+            b = _PROF_BUCKETS - 1
+        if self.filled < self.window:
+            self.filled += 1
+        else:
+            self.hist[self.ring[self.pos]] -= 1
+        self.ring[self.pos] = b
+        self.hist[b] += 1
+        self.pos = (self.pos + 1) % self.window
+
+        if self.dump_interval and self.frames % self.dump_interval == 0:
+            self.dump()
+            dump_pools()
+
+    def dump(self):
+        """計測結果をシリアルに表示"""
+        n = self.frames
+        if n == 0:
+            return
+        print(
+            "frames %d late %d dropped %d avg %dus peak %dus"
+            % (n, self.late, self.dropped, self.work_total // n, self.work_peak)
+        )
+        for i in range(_PROF_PHASES):
+            print(
+                "  %-6s avg %6dus peak %6dus"
+                % (self.names[i], self.total[i] // n, self.peak[i])
+            )
+        for i in range(_PROF_BUCKETS):
+            if self.hist[i]:
+                print(
+                    "  %2dms%s %4d %s"
+                    % (
+                        i * _PROF_BUCKET_US // 1000,
+                        "+" if i == _PROF_BUCKETS - 1 else " ",
+                        self.hist[i],
+                        "#" * ((self.hist[i] * 40 + self.filled - 1) // self.filled),
+                    )
+                )
+
+
+class ProfileBar(Sprite):
+    """プロファイラの表示
+    直近フレームのフェーズ毎の時間を色分けした横棒で表示.
+    画面幅が 2 フレーム分. 中央の線が 1 フレーム.
+
+    Params:
+        profiler (Profiler): 表示するプロファイラ
+    """
+
+    __slots__ = ("profiler",)
+
+    colors = (0xFFFF, 0x07E0, 0x001F, 0xFFE0, 0xF800)
+
+    def __init__(self, profiler):
+        super().__init__()
+        self.init_params(None, 0, "profile", 0, 0, 0, lcd114.LCD_W, 3)
+        self.profiler = profiler
+        self.visible = True
+
+    def show(self, frame_buffer, x, y):
+        if self.visible:
+            self.draw(frame_buffer, x + self.x, y + self.y)
+
+    def check_dirty(self, stage, x, y):
+        """差分描画: 毎フレーム変化する"""
+        self.track_dirty(stage, x, y, self.w, self.h, self.profiler.frames)
+
+    def draw(self, frame_buffer, x, y):
+        p = self.profiler
+        scale = p.budget_us * 2
+        frame_buffer.fill_rect(x, y, self.w, self.h, 0)
+        px = x
+        for i in range(_PROF_PHASES):
+            w = p.last[i] * self.w // scale
+            if px + w > x + self.w:
+                w = x + self.w - px
+            frame_buffer.fill_rect(px, y, w, self.h, self.colors[i])
+            px += w
+        frame_buffer.vline(x + self.w // 2, y, self.h, 0xFFFF)
+
+
+def start_profiler(window=128, dump_interval=0, overlay=False):
+    """フレームのプロファイラを開始
+
+    Params:
+        window (int): ヒストグラムのフレーム数
+        dump_interval (int): 結果をシリアルに表示する間隔（フレーム数） 0 は表示しない
+        overlay (bool): 画面上部に処理時間のバーを表示
+
+    Returns:
+        (Profiler): プロファイラ
+    """
+    global profiler, lcd_owner
+    profiler = Profiler(window, dump_interval, overlay)
+    lcd_owner = None  # 全画面描画
+    return profiler
+
+
+def stop_profiler():
+    """フレームのプロファイラを停止"""
+    global profiler, lcd_owner
+    profiler = None
+    lcd_owner = None
+
+
+class LatencyProbe:
+    """キー入力から画面表示までの時間を計測
+    キーを押した時刻（InputKey.push_us）から, その入力で変化した画面の転送が終わるまで.
+    FPS の待ち, イベントの順序, 描画, LCD への転送を全て含む.
+    start_latency_probe() で開始. 開始しなければ計測しない.
+
+    入力で画面が変化したことはゲーム側が effect() で知らせる（例: 弾の発射）.
+    effect() の後に最初に描画したフレームの転送完了で 1 回分を記録する.
+    effect() がないまま timeout フレーム過ぎた入力は捨てる.
+
+    Params:
+        keys (int): 計測するキーのビット
+        size (int): 記録する回数（直近の回数で集計）
+        dump_interval (int): 結果を表示する間隔（記録した回数） 0 は表示しない
+        timeout (int): effect() を待つフレーム数
+
+    Attributes:
+        count (int): 記録した回数
+        ignored (int): effect() がなくて捨てた入力の数
+        peak (int): 最大の時間（マイクロ秒）
+        samples (list): 直近 size 回の時間（マイクロ秒）
+    """
+
+    def __init__(self, keys, size=128, dump_interval=0, timeout=8):
+        self.keys = keys
+        self.size = size
+        self.dump_interval = dump_interval
+        self.timeout = timeout
+        self.samples = [0] * size
+        self.reset()
+
+    def reset(self):
+        """計測結果をクリア"""
+        self.count = 0
+        self.ignored = 0
+        self.peak = 0
+        self.press_us = 0
+        self.wait = 0  # 0: なし 1: effect() 待ち 2: 描画待ち 3: 転送待ち
+        self.frames = 0
+        self.sent = 0
+
+    def scan(self, key):
+        """キースキャンの後に呼ぶ 計測するキーを押していたら時刻を記録
+
+        Params:
+            key (InputKey): キー入力
+        """
+        if self.wait == 1:
+            self.frames += 1
+            if self.frames > self.timeout:
+                self.wait = 0
+                self.ignored += 1
+        if key.push & self.keys and self.wait <= 1:
+            if self.wait == 1:
+                self.ignored += 1  # 前の入力は画面が変わらなかった
+            self.press_us = key.push_us
+            self.wait = 1
+            self.frames = 0
+
+    def effect(self):
+        """入力で画面が変化した 次に描画するフレームを計測する"""
+        if self.wait == 1:
+            self.wait = 2
+
+    def shown(self):
+        """フレームの転送を開始した後に呼ぶ"""
+        if self.wait != 2:
+            return
+        if pipeline is not None:
+            # 転送は CORE1 swap() で完了を確認
+            self.sent = pipeline.swaps
+            self.wait = 3
+            return
+        lcd.wait_done()  # DMA の完了を待って計測
+        self.record(utime.ticks_us())
+
+    def poll(self):
+        """パイプラインの転送完了を確認 LCDPipeline.swap() が前フレームの完了後に呼ぶ"""
+        if self.wait == 3 and pipeline.frames == self.sent:
+            self.record(pipeline.done_us)
+
+    def record(self, t):
+        """1 回分を記録
+
+        Params:
+            t (int): 転送が終わった時刻（ticks_us）
+        """
+        v = utime.ticks_diff(t, self.press_us)
+        self.samples[self.count % self.size] = v
+        self.count += 1
+        if v > self.peak:
+            self.peak = v
+        self.wait = 0
+        if self.dump_interval and self.count % self.dump_interval == 0:
+            self.dump()
+
+    def percentile(self, p):
+        """直近の記録のパーセンタイル
+
+        Params:
+            p (int): パーセント 0 - 100
+
+        Returns:
+            (int): 時間（マイクロ秒） 記録がない時は 0
+        """
+        n = min(self.count, self.size)
+        if n == 0:
+            return 0
+        values = sorted(self.samples[:n])
+        i = (n * p + 99) // 100 - 1
+        return values[max(i, 0)]
+
+    def dump(self):
+        """計測結果をシリアルに表示"""
+        print(
+            "latency n %d ignored %d p50 %dus p90 %dus p99 %dus peak %dus"
+            % (
+                self.count,
+                self.ignored,
+                self.percentile(50),
+                self.percentile(90),
+                self.percentile(99),
+                self.peak,
+            )
+        )
+
+
+def start_latency_probe(keys, size=128, dump_interval=0, timeout=8):
+    """キー入力から画面表示までの時間の計測を開始
+
+    Params:
+        keys (int): 計測するキーのビット
+        size (int): 記録する回数
+        dump_interval (int): 結果をシリアルに表示する間隔（記録した回数） 0 は表示しない
+        timeout (int): effect() を待つフレーム数
+
+    Returns:
+        (LatencyProbe): 計測
+    """
+    global latency_probe
+    latency_probe = LatencyProbe(keys, size, dump_interval, timeout)
+    return latency_probe
+
+
+def stop_latency_probe():
+    """キー入力から画面表示までの時間の計測を停止"""
+    global latency_probe
+    latency_probe = None
+
+
+class GCManager:
+    """GC の管理
+    フレーム毎のメモリ確保量を記録して, 描画と転送を始めた後の空き時間に回収する.
+    フレームの途中で回収が始まらないように gc.threshold を大きめに設定する.
+    回収にかかった時間を記録して, 次の回収が空き時間に収まるか見積もる.
+
+    Params:
+        collect_bytes (int): この量を確保したら空き時間に回収
+        threshold (int): gc.threshold に設定する値
+
+    Attributes:
+        frames (int): 記録したフレーム数
+        alloc_total (int): 確保量の合計
+        alloc_peak (int): 1 フレームの確保量の最大
+        collects (int): 空き時間に回収した回数
+        deferred (int): 空き時間が足りずに回収を延期した回数
+        auto (int): フレームの途中で回収された回数（threshold またはメモリ不足）
+        pause_total (int): 回収にかかった時間の合計（us）
+        pause_peak (int): 回収にかかった時間の最大（us）
+        pause_est (int): 次の回収にかかる時間の見積もり（us）
+    """
+
+    def __init__(self, collect_bytes=_GC_COLLECT_BYTES, threshold=_GC_THRESHOLD_BYTES):
+        # CPython には mem_alloc, threshold がない
+        self.mem = hasattr(gc, "mem_alloc")
+        self.collect_bytes = collect_bytes
+        self.urgent_bytes = threshold - collect_bytes
+        if self.mem:
+            gc.threshold(threshold)
+        self.reset()
+
+    def reset(self):
+        """記録をクリア"""
+        self.frames = 0
+        self.alloc_total = 0
+        self.alloc_peak = 0
+        self.collects = 0
+        self.deferred = 0
+        self.auto = 0
+        self.pause_total = 0
+        self.pause_peak = 0
+        self.pause_est = 0
+        self.frames_since = 0
+        self.base = self.last = self.alloc()
+
+    def alloc(self):
+        """現在の確保量"""
+        return gc.mem_alloc() if self.mem else 0
+
+    def frame(self):
+        """フレームの処理後に呼ぶ 確保量を記録"""
+        a = self.alloc()
+        d = a - self.last
+        if d < 0:
+            # フレームの途中で回収された
+            self.auto += 1
+            self.base = a
+            d = 0
+        self.last = a
+        self.frames += 1
+        self.frames_since += 1
+        self.alloc_total += d
+        if d > self.alloc_peak:
+            self.alloc_peak = d
+
+    def idle(self, slack_us):
+        """空き時間に必要なら回収
+
+        Params:
+            slack_us (int): 次のフレームまでの時間（us）
+
+        Returns:
+            (bool): 回収したか
+        """
+        since = self.last - self.base
+        if self.mem:
+            if since < self.collect_bytes:
+                return False
+            urgent = since >= self.urgent_bytes
+        else:
+            if self.frames_since < _GC_INTERVAL:
+                return False
+            urgent = False
+
+        if not urgent and slack_us < self.pause_est + _GC_MARGIN_US:
+            self.deferred += 1
+            return False
+
+        t = utime.ticks_us()
+        gc.collect()
+        p = utime.ticks_diff(utime.ticks_us(), t)
+
+        self.collects += 1
+        self.pause_total += p
+        if p > self.pause_peak:
+            self.pause_peak = p
+        # 長くなった時はすぐに, 短くなった時はゆっくり追従
+        if p > self.pause_est:
+            self.pause_est = p
+        else:
+            self.pause_est = (self.pause_est * 7 + p) >> 3
+        self.base = self.last = self.alloc()
+        self.frames_since = 0
+        return True
+
+    def dump(self):
+        """記録をシリアルに表示"""
+        n = self.frames
+        if n == 0:
+            return
+        print(
+            "gc alloc avg %dB peak %dB collects %d deferred %d auto %d"
+            % (
+                self.alloc_total // n,
+                self.alloc_peak,
+                self.collects,
+                self.deferred,
+                self.auto,
+            )
+        )
+        if self.collects:
+            print(
+                "gc pause avg %dus peak %dus est %dus"
+                % (self.pause_total // self.collects, self.pause_peak, self.pause_est)
+            )
+
+
+def start_gc_manager(collect_bytes=_GC_COLLECT_BYTES, threshold=_GC_THRESHOLD_BYTES):
+    """GC の管理を開始
+    以降はフレームの空き時間に回収する.
+
+    Params:
+        collect_bytes (int): この量を確保したら空き時間に回収
+        threshold (int): gc.threshold に設定する値
+
+    Returns:
+        (GCManager): GC の管理
+    """
+    global gc_manager
+    gc_manager = GCManager(collect_bytes, threshold)
+    return gc_manager
@@ -3,9 +3,24 @@
 https://www.waveshare.com/pico-lcd-1.14.htm
 """
 from machine import Pin, SPI, PWM
+import array
 import framebuf
+import utime
 from micropython import const
 
+try:
+    # レジスタを直接読み書きできる場合
+    from machine import mem32
+except ImportError:
+    mem32 = None
+
+try:
+    # DMA が使える場合は非同期転送
+    from rp2 import DMA
+    from uctypes import addressof
+except ImportError:
+    DMA = None
+
 
 _BL = const(13)
 _DC = const(8)
@@ -14,6 +29,30 @@ _MOSI = const(11)
 _SCK = const(10)
 _CS = const(9)
 
+# 表示領域のオフセット
+_X_OFFSET = const(40)
+_Y_OFFSET = const(53)
+
+# コマンド
+_CMD_CASET = const(0x2A)
+_CMD_RASET = const(0x2B)
+_CMD_RAMWR = const(0x2C)
+
+# 全画面のウィンドウ
+_CASET_FULL = b"\x00\x28\x01\x17"
+_RASET_FULL = b"\x00\x35\x00\xbb"
+
+# SPI1 レジスタ（DMA転送用）
+_SPI1_SSPDR = const(0x4004_0008)
+_SPI1_SSPSR = const(0x4004_000C)
+_SPI1_SSPICR = const(0x4004_0020)
+_SSPSR_RNE = const(0x04)
+_SSPSR_BSY = const(0x10)
+_DREQ_SPI1_TX = const(18)
+
+# SIO GPIO_IN レジスタ（全ピンの入力）
+_SIO_GPIO_IN = const(0xD000_0004)
+
 # 画面サイズ
 LCD_W = const(240)
 LCD_H = const(135)
@@ -27,13 +66,41 @@ KEY_A = const(0b0010_0000)
 KEY_B = const(0b0001_0000)
 KEY_CENTER = const(0b1000_0000)
 
+# キーのピン番号 (ピン, キー)
+_KEY_PINS = const(
+    (
+        (15, KEY_A),
+        (17, KEY_B),
+        (2, KEY_UP),
+        (3, KEY_CENTER),
+        (16, KEY_LEFT),
+        (18, KEY_DOWN),
+        (20, KEY_RIGHT),
+    )
+)
+_KEY_RING = const(16)
+"""キー入力の変化を記録するリングバッファの大きさ"""
+_KEY_DEBOUNCE_US = const(3000)
+"""前の変化からこの時間内の変化はチャタリングとして無視"""
+
 LCD_BRIGHTNESS_MAX = const(5)
 # LCDの明るさ
 brightness_table = const((4095, 8191, 16383, 32767, 65535))
 
 
 class LCD(framebuf.FrameBuffer):
-    """Pico LCD 1.14inch の画面表示制御"""
+    """Pico LCD 1.14inch の画面表示制御
+
+    show_async() は DMA で転送を開始してすぐに戻る.
+    バッファに描画する前に wait_done() で転送完了を待つこと.
+    DMA が使えない環境では同期転送になる.
+    DMA はバッファのアドレスを指定して転送するので, フレーム毎にヒープを使わない
+    （DMA がない時は memoryview のスライスを作る）.
+
+    Attributes:
+        dma (DMA): 転送用 DMA チャンネル 使えない時は None
+        busy (bool): DMA 転送中
+    """
 
     def __init__(self):
         self.cs = Pin(_CS, Pin.OUT)
@@ -57,6 +124,21 @@ class LCD(framebuf.FrameBuffer):
         self.buf = bytearray(LCD_W * LCD_H * 2)
         super().__init__(self.buf, LCD_W, LCD_H, framebuf.RGB565)
 
+        # コマンド送信用のバッファ 毎回作らない
+        self.cmd_buf = bytearray(1)
+        self.data_buf = bytearray(1)
+        self.caset = bytearray(4)
+        self.raset = bytearray(4)
+
+        # DMA
+        self.busy = False
+        self.dma = None
+        if DMA is not None:
+            self.dma = DMA()
+            self.dma_ctrl = self.dma.pack_ctrl(
+                size=0, inc_read=True, inc_write=False, treq_sel=_DREQ_SPI1_TX
+            )
+
         # 液晶の明るさ
         self.pwm = PWM(Pin(_BL))
         self.pwm.freq(1000)
@@ -65,19 +147,72 @@ class LCD(framebuf.FrameBuffer):
         self.init_display()
 
     def write_cmd(self, cmd):
+        self.cmd_buf[0] = cmd
         self.cs(1)
         self.dc(0)
         self.cs(0)
-        self.spi.write(bytearray([cmd]))
+        self.spi.write(self.cmd_buf)
         self.cs(1)
 
     def write_data(self, buf):
+        self.data_buf[0] = buf
         self.cs(1)
         self.dc(1)
         self.cs(0)
-        self.spi.write(bytearray([buf]))
+        self.spi.write(self.data_buf)
         self.cs(1)
 
+    def write_data_buf(self, buf):
+        """データをまとめて送信"""
+        self.cs(1)
+        self.dc(1)
+        self.cs(0)
+        self.spi.write(buf)
+        self.cs(1)
+
+    def set_window(self, caset, raset):
+        """転送先のウィンドウを設定して RAMWR
+        この後はピクセルデータを送る.
+
+        Params:
+            caset (bytes): CASET のパラメータ 4バイト
+            raset (bytes): RASET のパラメータ 4バイト
+        """
+        self.write_cmd(_CMD_CASET)
+        self.write_data_buf(caset)
+        self.write_cmd(_CMD_RASET)
+        self.write_data_buf(raset)
+        self.write_cmd(_CMD_RAMWR)
+
+        self.cs(1)
+        self.dc(1)
+        self.cs(0)
+
+    def set_rect_window(self, x, y, w, h):
+        """矩形のウィンドウを設定して RAMWR
+
+        Params:
+            x (int): X座標
+            y (int): Y座標
+            w (int): 幅
+            h (int): 高さ
+        """
+        x0 = x + _X_OFFSET
+        x1 = x0 + w - 1
+        y0 = y + _Y_OFFSET
+        y1 = y0 + h - 1
+        caset = self.caset
+        caset[0] = x0 >> 8
+        caset[1] = x0 & 0xFF
+        caset[2] = x1 >> 8
+        caset[3] = x1 & 0xFF
+        raset = self.raset
+        raset[0] = y0 >> 8
+        raset[1] = y0 & 0xFF
+        raset[2] = y1 >> 8
+        raset[3] = y1 & 0xFF
+        self.set_window(caset, raset)
+
     def init_display(self):
         """画面初期化"""
         self.rst(1)  # reset
@@ -139,26 +274,150 @@ class LCD(framebuf.FrameBuffer):
         self.write_cmd(0x11)  # Sleep out
         self.write_cmd(0x29)  # Display On
 
-    def show(self):
-        """バッファ転送"""
-        self.write_cmd(0x2A)
-        self.write_data(0x00)
-        self.write_data(0x28)
-        self.write_data(0x01)
-        self.write_data(0x17)
+    def show(self, rects=None, count=0):
+        """バッファ転送
 
-        self.write_cmd(0x2B)
-        self.write_data(0x00)
-        self.write_data(0x35)
-        self.write_data(0x00)
-        self.write_data(0xBB)
+        Params:
+            rects (list): 転送する矩形 [x, y, w, h, ...] None の時は全画面
+            count (int): 矩形の数
+        """
+        self.send(self.buf, rects, count)
+
+    def show_async(self, rects=None, count=0):
+        """バッファ転送を開始
+        DMA で転送できる場合は完了を待たずに戻る.
+        全画面または横幅いっぱいの矩形（メモリ上で連続）のみ DMA で転送する.
+
+        Params:
+            rects (list): 転送する矩形 [x, y, w, h, ...] None の時は全画面
+            count (int): 矩形の数
+        """
+        if self.dma is None:
+            self.send(self.buf, rects, count)
+            return
+
+        self.wait_done()
+        if rects is None:
+            self.set_window(_CASET_FULL, _RASET_FULL)
+            self.start_dma(addressof(self.buf), len(self.buf))
+            return
+
+        # 最後の矩形以外は同期転送
+        for i in range(count - 1):
+            self.send_rect(
+                self.buf,
+                rects[i * 4],
+                rects[i * 4 + 1],
+                rects[i * 4 + 2],
+                rects[i * 4 + 3],
+            )
+        if count == 0:
+            return
+        i = (count - 1) * 4
+        x = rects[i]
+        y = rects[i + 1]
+        w = rects[i + 2]
+        h = rects[i + 3]
+        if w == LCD_W:
+            self.set_rect_window(x, y, w, h)
+            self.start_dma(addressof(self.buf) + y * LCD_W * 2, w * h * 2)
+        else:
+            self.send_rect(self.buf, x, y, w, h)
+
+    def start_dma(self, addr, count):
+        """DMA 転送を開始
+        ウィンドウ設定済みで CS は LOW のまま.
+
+        Params:
+            addr (int): 転送するデータのアドレス
+            count (int): バイト数
+        """
+        self.busy = True
+        self.dma.config(
+            read=addr,
+            write=_SPI1_SSPDR,
+            count=count,
+            ctrl=self.dma_ctrl,
+            trigger=True,
+        )
+
+    def wait_done(self):
+        """DMA 転送の完了を待つ"""
+        if not self.busy:
+            return
+        while self.dma.active():
+            pass
+        # FIFO が空になるまで
+        while mem32[_SPI1_SSPSR] & _SSPSR_BSY:
+            pass
+        # 受信 FIFO を捨てる
+        while mem32[_SPI1_SSPSR] & _SSPSR_RNE:
+            mem32[_SPI1_SSPDR]
+        mem32[_SPI1_SSPICR] = 1  # オーバーラン解除
+        self.cs(1)
+        self.busy = False
 
-        self.write_cmd(0x2C)
+    def send(self, buf, rects=None, count=0):
+        """指定したバッファを転送
+        LCD と同じサイズのバッファであること.
 
+        Params:
+            buf (bytearray): 転送するバッファ
+            rects (list): 転送する矩形 [x, y, w, h, ...] None の時は全画面
+            count (int): 矩形の数
+        """
+        self.wait_done()
+        if rects is not None:
+            for i in range(count):
+                self.send_rect(
+                    buf,
+                    rects[i * 4],
+                    rects[i * 4 + 1],
+                    rects[i * 4 + 2],
+                    rects[i * 4 + 3],
+                )
+            return
+
+        self.set_window(_CASET_FULL, _RASET_FULL)
+        self.spi.write(buf)
         self.cs(1)
-        self.dc(1)
-        self.cs(0)
-        self.spi.write(self.buf)
+
+    def send_rect(self, buf, x, y, w, h):
+        """バッファの一部を転送
+        CASET/RASET でウィンドウを設定して 1 行ずつ送る.
+        DMA がある時は行のアドレスを指定して DMA で送り, 完了を待つ.
+
+        Params:
+            buf (bytearray): 転送するバッファ
+            x (int): X座標
+            y (int): Y座標
+            w (int): 幅
+            h (int): 高さ
+        """
+        self.set_rect_window(x, y, w, h)
+        start = (y * LCD_W + x) * 2
+        if self.dma is not None:
+            addr = addressof(buf) + start
+            if w == LCD_W:
+                # 連続している
+                self.start_dma(addr, w * h * 2)
+            else:
+                for _ in range(h):
+                    self.start_dma(addr, w * 2)
+                    while self.dma.active():
+                        pass
+                    addr += LCD_W * 2
+            self.wait_done()
+            return
+
+        mv = memoryview(buf)
+        if w == LCD_W:
+            # 連続している
+            self.spi.write(mv[start : start + w * h * 2])
+        else:
+            for _ in range(h):
+                self.spi.write(mv[start : start + w * 2])
+                start += LCD_W * 2
         self.cs(1)
 
     def brightness(self, v=2):
@@ -168,33 +427,106 @@ class LCD(framebuf.FrameBuffer):
 
 
 class InputKey:
-    """キー入力"""
+    """キー入力
+    ピンは最初に 1 回だけ設定し, 全てのキーを GPIO_IN レジスタの 1 回の読み込みで取得する.
+    （レジスタを読めない環境ではピンを順に読む）
+    キーの変化はピンの割り込みで時刻と一緒にリングバッファに記録する.
+    フレームの間に押して離したキーも次の scan() で押したことになる.
+    複数のキーの同時押しも取れる.
+
+    Attributes:
+        repeat (int): 押しているキー（前回の scan() 以降に押したキーを含む）
+        push (int): 今回押したキー
+        push_us (int): 今回押したキーの押した時刻（ticks_us） 割り込みがない時は scan() の時刻
+        states (bytearray): 記録したキーの状態
+        times (array): 記録した時刻（ticks_us）
+        head (int): 記録した数
+        tail (int): scan() で読んだ数
+    """
 
     def __init__(self):
         self.repeat = 0
         self.push = 0
+        self.push_us = 0
+
+        # 変化の記録
+        self.states = bytearray(_KEY_RING)
+        self.times = array.array("i", [0] * _KEY_RING)
+        self.head = 0
+        self.tail = 0
+        self.last_state = 0
+        self.last_us = utime.ticks_us()
+
+        # ピンの設定は 1 回だけ
+        self.pins = []
+        handler = self.__irq
+        for pin, key in _KEY_PINS:
+            p = Pin(pin, Pin.IN, Pin.PULL_UP)
+            try:
+                p.irq(handler, Pin.IRQ_FALLING | Pin.IRQ_RISING)
+            except (AttributeError, ValueError):
+                pass  # 割り込みが使えない時は scan() の読み込みのみ
+            self.pins.append(p)
+
+    def read(self):
+        """押しているキー
+
+        Returns:
+            (int): 押しているキーのビット
+        """
+        s = 0
+        if mem32 is not None:
+            g = mem32[_SIO_GPIO_IN]
+            for pin, key in _KEY_PINS:
+                if not (g >> pin) & 1:  # プルアップなので押すと 0
+                    s |= key
+        else:
+            pins = self.pins
+            for i in range(len(pins)):
+                if pins[i].value() == 0:
+                    s |= _KEY_PINS[i][1]
+        return s
+
+    def __irq(self, pin):
+        """割り込み: キーの変化を記録"""
+        t = utime.ticks_us()
+        s = self.read()
+        if s == self.last_state:
+            return
+        if utime.ticks_diff(t, self.last_us) < _KEY_DEBOUNCE_US:
+            return  # チャタリング 最後の状態は scan() で読む
+        self.last_state = s
+        self.last_us = t
+        i = self.head % _KEY_RING
+        self.states[i] = s
+        self.times[i] = t
+        self.head += 1
 
     def scan(self):
         """キースキャン
-        repeat は押しっぱなし, push は押したまま.
+        repeat は押しっぱなし, push は押した瞬間.
         """
         self.push = ~self.repeat
-        self.repeat = 0
-
-        if Pin(15, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_A
-        elif Pin(17, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_B
-
-        if Pin(2, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_UP
-        elif Pin(3, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_CENTER
-        elif Pin(16, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_LEFT
-        elif Pin(18, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_DOWN
-        elif Pin(20, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_RIGHT
-
-        self.push &= self.repeat
+        t = utime.ticks_us()
+        s = self.read()
+
+        # 前回からの変化 古いものはあふれている
+        head = self.head
+        tail = self.tail
+        if head - tail > _KEY_RING:
+            tail = head - _KEY_RING
+        push_us = -1
+        while tail != head:
+            i = tail % _KEY_RING
+            state = self.states[i]
+            if push_us < 0 and state & self.push:
+                push_us = self.times[i]  # 最初に押した時刻
+            s |= state
+            tail += 1
+        self.tail = tail
+        if push_us < 0:
+            push_us = t
+
+        self.repeat = s
+        self.push &= s
+        self.push_us = push_us
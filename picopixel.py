@@ -0,0 +1,326 @@
+"""ピクセル描画カーネル
+
+RGB565 のバッファに直接描画する.
+バッファは uint16 の並び（framebuf.RGB565 と同じ）.
+描画先からはみ出る部分はクリップする.
+
+・scale2x: 縦横2倍に拡大してコピー
+・rle2x: ランレングス圧縮画像を縦横2倍に展開して描画
+・copy_rect: 同じ大きさのバッファ間で矩形をコピー（スライスを作らない）
+
+引数は (描画先, 元画像, 位置と大きさ) の 3 つ.
+viper の関数は引数が 4 つまでなので, 位置と大きさは array("i") にまとめる:
+    [描画先の幅, 描画先の高さ, 拡大後の幅, 拡大後の高さ, X座標, Y座標]
+配列は呼び出し側で 1 つ作って使い回す（new_geometry()）.
+
+ランレングス圧縮画像（rle_encode で作成）:
+    パレット数 (1バイト), パレット (RGB565 リトルエンディアン),
+    以降は 1 バイトで 1 ラン. 上位4bit がラン長-1, 下位4bit がパレット番号.
+    ランは行をまたがない.
+
+*_ref は Python のみの実装（動作確認用）.
+MicroPython では viper 版を使う. host/test_pixel.py で両者が同じ結果になることを確認する.
+"""
+__author__ = "Choi Gyun 2022"
+
+import array
+import sys
+
+GEOM_DW = 0
+GEOM_DH = 1
+GEOM_W = 2
+GEOM_H = 3
+GEOM_X = 4
+GEOM_Y = 5
+
+
+def new_geometry(dw, dh):
+    """カーネルに渡す位置と大きさの配列
+
+    Params:
+        dw (int): 描画先の幅
+        dh (int): 描画先の高さ
+
+    Returns:
+        (array): [dw, dh, w, h, x, y]
+    """
+    return array.array("i", [dw, dh, 0, 0, 0, 0])
+
+
+def scale2x_ref(dst, src, geom):
+    """縦横2倍に拡大してコピー
+
+    Params:
+        dst (bytearray): 描画先のバッファ
+        src (bytes): 元画像 (w/2)x(h/2) ピクセル
+        geom (array): [描画先の幅, 描画先の高さ, 拡大後の幅, 拡大後の高さ, X座標, Y座標]
+    """
+    dw, dh, w, h, x, y = geom
+    x0 = max(x, 0)
+    x1 = min(x + w, dw)
+    y0 = max(y, 0)
+    y1 = min(y + h, dh)
+    if x0 >= x1 or y0 >= y1:
+        return
+    sw = w >> 1
+    for dy in range(y0, y1):
+        srow = ((dy - y) >> 1) * sw
+        drow = dy * dw
+        for dx in range(x0, x1):
+            s = (srow + ((dx - x) >> 1)) * 2
+            d = (drow + dx) * 2
+            dst[d] = src[s]
+            dst[d + 1] = src[s + 1]
+
+
+def _fill(dst, dw, dh, x, y, w, h, color):
+    """塗りつぶし（rle2x_ref 用）"""
+    x0 = max(x, 0)
+    x1 = min(x + w, dw)
+    y0 = max(y, 0)
+    y1 = min(y + h, dh)
+    if x0 >= x1 or y0 >= y1:
+        return
+    lo = color & 0xFF
+    hi = (color >> 8) & 0xFF
+    for dy in range(y0, y1):
+        drow = dy * dw
+        for dx in range(x0, x1):
+            d = (drow + dx) * 2
+            dst[d] = lo
+            dst[d + 1] = hi
+
+
+def rle_encode(src, w, h):
+    """RGB565 の画像をランレングス圧縮
+    色数が 16 を超える場合は圧縮できない.
+
+    Params:
+        src (bytes): 元画像 (w/2)x(h/2) ピクセル（scale2x と同じ）
+        w (int): 拡大後の幅
+        h (int): 拡大後の高さ
+
+    Returns:
+        (bytes): 圧縮した画像 圧縮できない時は None
+    """
+    sw = w >> 1
+    palette = []
+    runs = bytearray()
+    for sy in range(h >> 1):
+        sx = 0
+        while sx < sw:
+            s = (sy * sw + sx) * 2
+            c = src[s] | (src[s + 1] << 8)
+            if c not in palette:
+                if len(palette) == 16:
+                    return None
+                palette.append(c)
+            run = 1
+            while (
+                run < 16
+                and sx + run < sw
+                and src[s + run * 2] == src[s]
+                and src[s + run * 2 + 1] == src[s + 1]
+            ):
+                run += 1
+            runs.append(((run - 1) << 4) | palette.index(c))
+            sx += run
+    out = bytearray([len(palette)])
+    for c in palette:
+        out.append(c & 0xFF)
+        out.append(c >> 8)
+    return bytes(out + runs)
+
+
+def rle2x_ref(dst, src, geom):
+    """ランレングス圧縮画像を縦横2倍に展開して描画
+
+    Params:
+        dst (bytearray): 描画先のバッファ
+        src (bytes): 圧縮した画像
+        geom (array): [描画先の幅, 描画先の高さ, 拡大後の幅, 拡大後の高さ, X座標, Y座標]
+    """
+    dw, dh, w, h, x, y = geom
+    p = 1 + src[0] * 2
+    sw = w >> 1
+    for dy in range(y, y + h, 2):
+        if dy >= dh:
+            return
+        sx = 0
+        while sx < sw:
+            b = src[p]
+            p += 1
+            run = (b >> 4) + 1
+            if dy + 2 > 0:
+                c = 1 + (b & 0xF) * 2
+                x0 = x + sx * 2
+                _fill(dst, dw, dh, x0, dy, run * 2, 2, src[c] | (src[c + 1] << 8))
+            sx += run
+
+
+def copy_rect_ref(dst, src, geom):
+    """同じ大きさのバッファ間で矩形をコピー
+
+    Params:
+        dst (bytearray): コピー先のバッファ
+        src (bytes): コピー元のバッファ dst と同じ大きさ
+        geom (array): [バッファの幅, バッファの高さ, 幅, 高さ, X座標, Y座標]
+    """
+    dw, dh, w, h, x, y = geom
+    x0 = max(x, 0)
+    x1 = min(x + w, dw)
+    y0 = max(y, 0)
+    y1 = min(y + h, dh)
+    if x0 >= x1 or y0 >= y1:
+        return
+    for dy in range(y0, y1):
+        a = (dy * dw + x0) * 2
+        b = (dy * dw + x1) * 2
+        dst[a:b] = src[a:b]
+
+
+if sys.implementation.name == "micropython":
+    import micropython
+
+    # 描画先のバッファは 4 バイト境界から始まること（ヒープのバッファなら OK）
+    # 偶数番目のピクセルから 2 ピクセルずつ 32bit で書き込む
+
+    @micropython.viper
+    def scale2x(dst, src, geom):
+        """縦横2倍に拡大してコピー scale2x_ref と同じ"""
+        g = ptr32(geom)
+        dw = g[0]
+        dh = g[1]
+        w = g[2]
+        h = g[3]
+        x = g[4]
+        y = g[5]
+        x0 = x
+        if x0 < 0:
+            x0 = 0
+        x1 = x + w
+        if x1 > dw:
+            x1 = dw
+        y0 = y
+        if y0 < 0:
+            y0 = 0
+        y1 = y + h
+        if y1 > dh:
+            y1 = dh
+        if x0 >= x1 or y0 >= y1:
+            return
+        d = ptr16(dst)
+        d32 = ptr32(dst)
+        s = ptr16(src)
+        sw = w >> 1
+        for dy in range(y0, y1):
+            srow = ((dy - y) >> 1) * sw
+            drow = dy * dw
+            dx = x0
+            if (drow + dx) & 1:
+                d[drow + dx] = s[srow + ((dx - x) >> 1)]
+                dx += 1
+            while dx + 1 < x1:
+                lo = s[srow + ((dx - x) >> 1)]
+                hi = s[srow + ((dx + 1 - x) >> 1)]
+                d32[(drow + dx) >> 1] = lo | (hi << 16)
+                dx += 2
+            if dx < x1:
+                d[drow + dx] = s[srow + ((dx - x) >> 1)]
+
+    @micropython.viper
+    def rle2x(dst, src, geom):
+        """ランレングス圧縮画像を縦横2倍に展開して描画 rle2x_ref と同じ"""
+        g = ptr32(geom)
+        dw = g[0]
+        dh = g[1]
+        w = g[2]
+        h = g[3]
+        x = g[4]
+        y = g[5]
+        d = ptr16(dst)
+        d32 = ptr32(dst)
+        s = ptr8(src)
+        p = 1 + s[0] * 2
+        sw = w >> 1
+        dy = y
+        while dy < y + h:
+            if dy >= dh:
+                return
+            sx = 0
+            while sx < sw:
+                b = s[p]
+                p += 1
+                run = (b >> 4) + 1
+                x0 = x + sx * 2
+                sx += run
+                x1 = x0 + run * 2
+                if x0 < 0:
+                    x0 = 0
+                if x1 > dw:
+                    x1 = dw
+                if x0 >= x1:
+                    continue
+                c = 1 + (b & 0xF) * 2
+                color = s[c] | (s[c + 1] << 8)
+                c2 = color | (color << 16)
+                for ry in range(dy, dy + 2):
+                    if ry < 0 or ry >= dh:
+                        continue
+                    drow = ry * dw
+                    dx = x0
+                    if (drow + dx) & 1:
+                        d[drow + dx] = color
+                        dx += 1
+                    while dx + 1 < x1:
+                        d32[(drow + dx) >> 1] = c2
+                        dx += 2
+                    if dx < x1:
+                        d[drow + dx] = color
+            dy += 2
+
+    @micropython.viper
+    def copy_rect(dst, src, geom):
+        """同じ大きさのバッファ間で矩形をコピー copy_rect_ref と同じ"""
+        g = ptr32(geom)
+        dw = g[0]
+        dh = g[1]
+        w = g[2]
+        h = g[3]
+        x = g[4]
+        y = g[5]
+        x0 = x
+        if x0 < 0:
+            x0 = 0
+        x1 = x + w
+        if x1 > dw:
+            x1 = dw
+        y0 = y
+        if y0 < 0:
+            y0 = 0
+        y1 = y + h
+        if y1 > dh:
+            y1 = dh
+        if x0 >= x1 or y0 >= y1:
+            return
+        d = ptr16(dst)
+        d32 = ptr32(dst)
+        s = ptr16(src)
+        s32 = ptr32(src)
+        for dy in range(y0, y1):
+            i = dy * dw + x0
+            e = dy * dw + x1
+            # 位置は同じなので 32bit の境界も同じ
+            if i & 1:
+                d[i] = s[i]
+                i += 1
+            while i + 1 < e:
+                d32[i >> 1] = s32[i >> 1]
+                i += 2
+            if i < e:
+                d[i] = s[i]
+
+else:
+    scale2x = scale2x_ref
+    rle2x = rle2x_ref
+    copy_rect = copy_rect_ref
@@ -0,0 +1,188 @@
+"""アセットコンパイラ（PC で実行）
+
+gamedata.py の画像を RGB565 のバイナリにまとめて assets.bin を作成する.
+対象の画像とサイズは main.py の chr_data, bmp_data から取得する.
+どちらのファイルも import せずに構文解析するので MicroPython は不要.
+
+・chr_data: インデックスカラーを 2x2 に展開した RGB565（create_image_buffers と同じ）
+・bmp_data: ランレングス圧縮（picopixel.rle_encode）
+  小さくならない画像は RGB565 のまま（BitmapSprite が描画時に2倍にする）
+
+ファイル形式（リトルエンディアン）:
+    ヘッダ: magic "GWA2", chr の数 (u16), bmp の数 (u16)
+    インデックス: 幅 (u16), 高さ (u16), 形式 (u16), オフセット (u32), サイズ (u32)
+        を chr, bmp の順に. 形式は 0: RGB565, 1: ランレングス圧縮
+    データ: インデックスの順に続く
+
+使い方:
+    python3 tools/assetc.py [--src ディレクトリ] [-o assets.bin] [--raw]
+"""
+import argparse
+import ast
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import picopixel  # noqa: E402
+
+MAGIC = b"GWA2"
+HEADER = "<4sHH"
+ENTRY = "<HHHII"
+FMT_RAW = 0
+FMT_RLE = 1
+
+
+def load_gamedata(path):
+    """gamedata.py のモジュール変数を取得
+
+    Params:
+        path (str): gamedata.py のパス
+
+    Returns:
+        (dict): 変数名と値
+    """
+    tree = ast.parse(open(path, encoding="utf-8").read(), path)
+    values = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(
+            node.targets[0], ast.Name
+        ):
+            continue
+        value = node.value
+        # const(...) は中身
+        if (
+            isinstance(value, ast.Call)
+            and isinstance(value.func, ast.Name)
+            and value.func.id == "const"
+        ):
+            value = value.args[0]
+        try:
+            values[node.targets[0].id] = ast.literal_eval(value)
+        except ValueError:
+            pass
+    return values
+
+
+def load_sprite_list(path, name):
+    """main.py のスプライトリスト（(dat.xxx, w, h) のリスト）を取得
+
+    Params:
+        path (str): main.py のパス
+        name (str): リストの変数名
+
+    Returns:
+        (list): (画像の変数名, w, h) のリスト
+    """
+    tree = ast.parse(open(path, encoding="utf-8").read(), path)
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Assign)
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id == name
+            and isinstance(node.value, (ast.List, ast.Tuple))
+        ):
+            items = []
+            for e in node.value.elts:
+                name_, w, h = e.elts
+                items.append((name_.attr, ast.literal_eval(w), ast.literal_eval(h)))
+            return items
+    raise SystemExit("%s: %s not found" % (path, name))
+
+
+def expand_index(palette, image, w, h):
+    """インデックスカラーを RGB565 に展開
+    1インデックスは 2x2 ピクセル. 1バイトに横2インデックス（下位が左）.
+
+    Params:
+        palette (tuple): パレット
+        image (bytes): インデックスカラーの画像
+        w (int): 展開後の幅
+        h (int): 展開後の高さ
+
+    Returns:
+        (bytes): RGB565
+    """
+    out = bytearray(w * h * 2)
+    pos = 0
+    for y in range(0, h, 2):
+        for x in range(0, w, 4):
+            for dx, c in ((0, image[pos] & 0xF), (2, image[pos] >> 4)):
+                color = struct.pack("<H", palette[c])
+                for py in (y, y + 1):
+                    i = (py * w + x + dx) * 2
+                    out[i : i + 4] = color * 2
+            pos += 1
+    return bytes(out)
+
+
+def build(src, rle=True):
+    """assets.bin の内容を作成
+
+    Params:
+        src (str): main.py, gamedata.py のあるディレクトリ
+        rle (bool): bmp をランレングス圧縮するか
+
+    Returns:
+        (bytes, list): ファイルの内容, (種類, 名前, w, h, 元のサイズ, サイズ) のリスト
+    """
+    data = load_gamedata(os.path.join(src, "gamedata.py"))
+    main = os.path.join(src, "main.py")
+    chr_list = load_sprite_list(main, "chr_data")
+    bmp_list = load_sprite_list(main, "bmp_data")
+    palette = data["palette565"]
+
+    blobs = []
+    report = []
+    for name, w, h in chr_list:
+        b = expand_index(palette, data[name], w, h)
+        blobs.append((w, h, FMT_RAW, b))
+        report.append(("chr", name, w, h, len(b), len(b)))
+    for name, w, h in bmp_list:
+        b = data[name]
+        fmt = FMT_RAW
+        if rle:
+            packed = picopixel.rle_encode(b, w, h)
+            if packed is not None and len(packed) < len(b):
+                b = packed
+                fmt = FMT_RLE
+        blobs.append((w, h, fmt, b))
+        report.append(("bmp", name, w, h, len(data[name]), len(b)))
+
+    offset = struct.calcsize(HEADER) + struct.calcsize(ENTRY) * len(blobs)
+    out = bytearray(struct.pack(HEADER, MAGIC, len(chr_list), len(bmp_list)))
+    for w, h, fmt, b in blobs:
+        out += struct.pack(ENTRY, w, h, fmt, offset, len(b))
+        offset += len(b)
+    for w, h, fmt, b in blobs:
+        out += b
+    return bytes(out), report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="assets.bin を作成")
+    parser.add_argument(
+        "--src",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+        help="main.py, gamedata.py のあるディレクトリ",
+    )
+    parser.add_argument("-o", "--output", default=None, help="出力ファイル")
+    parser.add_argument("--raw", action="store_true", help="bmp を圧縮しない")
+    args = parser.parse_args(argv)
+
+    out, report = build(args.src, not args.raw)
+    path = args.output or os.path.join(args.src, "assets.bin")
+    with open(path, "wb") as f:
+        f.write(out)
+
+    for kind, name, w, h, raw, size in report:
+        print("%s %-12s %3dx%-3d %6d -> %6d bytes" % (kind, name, w, h, raw, size))
+    fills = sum(w * h // 8 for kind, _, w, h, _, _ in report if kind == "chr")
+    print(
+        "%s: %d bytes (%d images, %d fill_rect calls at boot removed)"
+        % (path, len(out), len(report), fills)
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())